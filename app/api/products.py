@@ -1,52 +1,228 @@
 
 import sys
 import os
+import hashlib
+import orjson
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from app.crud.product_crud import default_json_serializer
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
-from sqlmodel import Session
-from typing import List, Optional
-from app.db import get_session
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Any, Dict, List, Optional
+from app.db import get_async_read_session, get_async_session
 from app.models.product import (
     ProductRead,
     ProductCreate,
     ProductUpdate,
-    PaginatedProductResponse
+    PaginatedProductResponse,
+    BulkProductResponse,
+    BulkRowError,
+    RecommendRequest,
+    RecommendedProduct,
+    ReserveRequest,
+    ReserveResponse,
+    ReservedLine,
+    ProductStats,
 )
-from app.crud import product_crud
-import redis
-import json
+from app.cache import json_body
+from app.columnar import columnar_format, encode_table, stats_table
+from app.crud import async_product_crud
+from app.crud.product_crud import PRODUCT_FIELDS
+from app import changes, events, trending
+from app.export import EXPORT_CHUNK_ROWS, EXPORT_FORMATS, encode_export
+from app.trending import DEFAULT_WINDOW, TRENDING_WINDOWS
+from app.suggestions import NEIGHBOURS
 
 router = APIRouter()
 
-# Initialize Redis
-redis_client = redis.Redis.from_url("redis://redis:6379/0")
+BULK_MAX_BATCH = int(os.getenv("BULK_MAX_BATCH", 1000))
+DUPLICATE_PRODUCT = "A product with this name and brand already exists"
+SUGGEST_BATCH_MAX = int(os.getenv("SUGGEST_BATCH_MAX", 100))
+SUGGEST_MAX_LIMIT = NEIGHBOURS
+PRODUCT_BATCH_MAX = int(os.getenv("PRODUCT_BATCH_MAX", 100))
+RESERVE_MAX_LINES = int(os.getenv("RESERVE_MAX_LINES", 100))
+# Sent with product detail and listing responses; e.g. "public, max-age=0, s-maxage=30" lets a CDN serve them
+PRODUCT_CACHE_CONTROL = os.getenv("PRODUCT_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+
+def parse_ids(ids: str) -> List[int]:
+    """Comma-separated ids from a query string, de-duplicated in order."""
+    try:
+        return list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+
+FIELDS_QUERY = Query(None, description="Comma-separated product fields to return (id is always included); default all")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Sparse fieldset from a query string, in model order with id; None for every field."""
+    if not fields:
+        return None
+    requested = {part.strip() for part in fields.split(",") if part.strip()}
+    unknown = requested.difference(PRODUCT_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in PRODUCT_FIELDS if name in requested or name == "id"]
+
+def columnar_response(format: str, table, **headers) -> Response:
+    media_type, _ = EXPORT_FORMATS[format]
+    return Response(content=encode_table(format, table), media_type=media_type, headers={"Vary": "Accept", **headers})
+
+def json_response(value, **headers) -> Response:
+    # For projected rows, which the full response model would reject
+    return Response(content=json_body(value), media_type="application/json", headers=headers)
+
+# ----------------------------------
+# Conditional requests (ETag / Last-Modified)
+# ----------------------------------
+def not_modified(request: Request, etag: Optional[str], last_modified=None) -> bool:
+    """True if the client's cached copy is current; If-None-Match wins over If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+def validator_headers(etag: Optional[str], last_modified=None) -> Dict[str, str]:
+    headers = {"Cache-Control": PRODUCT_CACHE_CONTROL}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def product_etag(product_id: int, updated_at, fields: Optional[List[str]], product: dict) -> str:
+    # Counter flushes leave updated_at alone, so a response carrying counters is versioned on their values too
+    counters = ",".join(str(product[column]) for column in events.COUNTER_COLUMNS if column in product)
+    version = f"{product_id}:{updated_at.isoformat() if updated_at else ''}:{','.join(fields or ['*'])}:{counters}"
+    return f'"{hashlib.blake2b(version.encode(), digest_size=16).hexdigest()}"'
 
 # ----------------------------------
 # Create a new product
 # ----------------------------------
 @router.post("/products", response_model=ProductRead)
-def create_product(product: ProductCreate, session: Session = Depends(get_session)):
-    return product_crud.create_product(product, session)
+async def create_product(product: ProductCreate, session: AsyncSession = Depends(get_async_session)):
+    try:
+        return await async_product_crud.create_product(product, session)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_PRODUCT)
+
+# ----------------------------------
+# Create many products in one transaction
+# ----------------------------------
+@router.post("/products/bulk", response_model=BulkProductResponse)
+async def create_products_bulk(
+    items: List[Dict[str, Any]] = Body(...),
+    session: AsyncSession = Depends(get_async_session)
+):
+    if len(items) > BULK_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {BULK_MAX_BATCH} rows)")
+
+    # Validate row by row so one bad row doesn't reject the whole batch
+    valid = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, ProductCreate.model_validate(item)))
+        except ValidationError as e:
+            detail = "; ".join(
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            errors.append(BulkRowError(index=index, error=detail))
+
+    # (name, brand) is unique: reject repeats row by row too, rather than failing the batch
+    seen = await async_product_crud.existing_natural_keys(session, [product for _, product in valid])
+    new = []
+    for index, product in valid:
+        key = (product.name, product.brand or "")
+        if key in seen:
+            errors.append(BulkRowError(index=index, error=DUPLICATE_PRODUCT))
+            continue
+        seen.add(key)
+        new.append(product)
+    errors.sort(key=lambda error: error.index)
+
+    try:
+        created = await async_product_crud.create_products(new, session)
+    except IntegrityError:
+        # Another writer inserted one of these keys since the check above
+        raise HTTPException(status_code=409, detail=DUPLICATE_PRODUCT)
+    return BulkProductResponse(created=len(created), failed=len(errors), errors=errors)
+
+# ----------------------------------
+# Reserve stock for a cart/checkout: every line or none
+# ----------------------------------
+@router.post("/products/reserve", response_model=ReserveResponse)
+async def reserve_stock(request: ReserveRequest, session: AsyncSession = Depends(get_async_session)):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to reserve")
+    lines = {}
+    for item in request.items:
+        lines[item.product_id] = lines.get(item.product_id, 0) + item.quantity
+    if len(lines) > RESERVE_MAX_LINES:
+        raise HTTPException(status_code=413, detail=f"Too many products (max {RESERVE_MAX_LINES})")
+
+    reserved, short = await async_product_crud.reserve_stock(session, lines)
+    missing = [product_id for product_id, _, available in short if available is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown products: {', '.join(map(str, missing))}")
+    if not reserved:
+        raise HTTPException(status_code=409, detail={
+            "message": "Insufficient stock; nothing was reserved",
+            "unavailable": [
+                {"product_id": product_id, "requested": quantity, "available": available}
+                for product_id, quantity, available in short
+            ],
+        })
+    return ReserveResponse(reserved=[
+        ReservedLine(product_id=product_id, quantity=quantity, stock=stock) for product_id, quantity, stock in reserved
+    ])
+
+# ----------------------------------
+# "Need help choosing?": rank products against a free-text need
+# ----------------------------------
+@router.post("/products/recommend", response_model=List[RecommendedProduct])
+async def recommend_products(request: RecommendRequest, session: AsyncSession = Depends(get_async_read_session)):
+    return await async_product_crud.recommend_products(session, request)
 
 # ----------------------------------
 # Read/search products with filters
 # ----------------------------------
 @router.get("/products", response_model=PaginatedProductResponse)
-def read_products(
+async def read_products(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    search: Optional[str] = Query(None, description="Search product name"),
+    search: Optional[str] = Query(None, description="Full-text search over name, brand, description and tags"),
     category: Optional[str] = Query(None),
     region: Optional[str] = Query(None),
     min_price: Optional[float] = Query(None),
     max_price: Optional[float] = Query(None),
-    sort_by: Optional[str] = Query(None, regex="^(price|created_at|name)$"),
-    order: Optional[str] = Query("asc", regex="^(asc|desc)$"),
-    session: Session = Depends(get_session)
+    sort_by: Optional[str] = Query(None, pattern="^(price|created_at|name|id|relevance)$"),
+    order: Optional[str] = Query("asc", pattern="^(asc|desc)$"),
+    pagination: str = Query("offset", pattern="^(offset|cursor)$", description="cursor: keyset paging via next_cursor, no total"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    exact: bool = Query(True, description="false: allow an estimated total on large result sets"),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: AsyncSession = Depends(get_async_read_session)
 ):
-    return product_crud.get_products(
-        session=session,
+    projection = parse_fields(fields)
+    listing = dict(
         skip=skip,
         limit=limit,
         search=search,
@@ -56,69 +232,237 @@ def read_products(
         max_price=max_price,
         sort_by=sort_by,
         order=order,
+        pagination=pagination,
+        cursor=cursor,
+        exact=exact,
+        fields=projection,
     )
+    columnar = columnar_format(request.headers.get("accept"))
+    try:
+        if columnar:
+            batch = await async_product_crud.get_products_batch(session, **listing)
+            return columnar_response(columnar, batch)
+        body, etag, source = await async_product_crud.get_products_body(session=session, **listing)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {**validator_headers(etag), "Vary": "Accept", "X-Cache": "MISS" if source == "miss" else "HIT"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    # Already shaped like PaginatedProductResponse; returned raw to skip re-validation
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # ----------------------------------
 # STATIC ROUTES BEFORE DYNAMIC ONES
 @router.get("/products/trending", response_model=List[ProductRead])
-def get_trending_products(response: Response, session: Session = Depends(get_session)):
-    cache_key = "trending_products"
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        try:
-            products = json.loads(cached_data)
-            response.headers["X-Cache"] = "HIT"
-            return products
-        except json.JSONDecodeError:
-            pass  # fallback to DB query
+async def get_trending_products(
+    response: Response,
+    category: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+    window: str = Query(DEFAULT_WINDOW, pattern=f"^({'|'.join(TRENDING_WINDOWS)})$",
+                        description="Half-life of the time decay"),
+    limit: int = Query(10, ge=1, le=100),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    projection = parse_fields(fields)
+    products, source = await async_product_crud.get_trending_products(
+        session, limit=limit, category=category, region=region, window=window, fields=projection
+    )
+    cache_status = "MISS" if source == "miss" else "HIT"
+    if projection:
+        return json_response(products, **{"X-Cache": cache_status})
+    response.headers["X-Cache"] = cache_status
+    return products
 
-    products = product_crud.get_top_products_by_purchase_count(session, limit=10)
-    products_json = [p.dict() for p in products]
 
-    redis_client.setex(cache_key, 300, json.dumps(products_json, default=default_json_serializer))
-    response.headers["X-Cache"] = "MISS"
-    return products_json
+# ----------------------------------
+# Dashboard aggregates, computed in the database with the listing filters
+# ----------------------------------
+@router.get("/products/stats", response_model=ProductStats)
+async def get_product_stats(
+    request: Request,
+    response: Response,
+    search: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    bins: int = Query(20, ge=1, le=100, description="Price histogram buckets"),
+    top: int = Query(5, ge=0, le=50, description="Top-rated products to include"),
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    stats = await async_product_crud.get_product_stats(
+        session, search=search, category=category, region=region,
+        min_price=min_price, max_price=max_price, bins=bins, top=top,
+    )
+    columnar = columnar_format(request.headers.get("accept"))
+    if columnar:
+        return columnar_response(columnar, stats_table(stats))
+    response.headers["Vary"] = "Accept"
+    return stats
+
+
+# ----------------------------------
+# Suggestions for many products in one call: ?ids=1,2,3
+# ----------------------------------
+@router.get("/products/suggestions", response_model=Dict[int, List[ProductRead]])
+async def get_suggestions_batch(
+    ids: str = Query(..., description="Comma-separated product ids"),
+    limit: int = Query(5, ge=1, le=SUGGEST_MAX_LIMIT),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    product_ids = parse_ids(ids)
+    if len(product_ids) > SUGGEST_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many ids (max {SUGGEST_BATCH_MAX})")
+    projection = parse_fields(fields)
+    # Unknown ids are left out of the response
+    suggestions = await async_product_crud.get_suggestions(session, product_ids, limit=limit, fields=projection)
+    return json_response(suggestions) if projection else suggestions
+
+
+# ----------------------------------
+# Streaming export of every product matching the listing filters
+# ----------------------------------
+@router.get("/products/export")
+async def export_products(
+    request: Request,
+    format: Optional[str] = Query(None, pattern=f"^({'|'.join(EXPORT_FORMATS)})$",
+                                  description="Default: Arrow or Parquet if the Accept header asks for it, else ndjson"),
+    gzip: bool = Query(False, description="Compress the stream (Content-Encoding: gzip)"),
+    search: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    fields: Optional[str] = FIELDS_QUERY,
+):
+    format = format or columnar_format(request.headers.get("accept")) or "ndjson"
+    columns = parse_fields(fields) or PRODUCT_FIELDS
+    chunks = async_product_crud.stream_products(
+        EXPORT_CHUNK_ROWS, search=search, category=category, region=region,
+        min_price=min_price, max_price=max_price, fields=columns,
+    )
+    media_type, extension = EXPORT_FORMATS[format]
+    headers = {"Content-Disposition": f'attachment; filename="products.{extension}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(encode_export(format, columns, chunks, gzip), media_type=media_type, headers=headers)
+
+
+# ----------------------------------
+# Live change feed (server-sent events); see app/changes.py for the deltas
+# ----------------------------------
+@router.get("/products/events")
+async def product_events(request: Request):
+    return StreamingResponse(
+        changes.listen(request.is_disconnected),
+        media_type="text/event-stream",
+        # No caching, and no proxy buffering that would hold deltas back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------------------------
+# Many products by id in one call (carts, wishlists): ?ids=1,2,3
+# ----------------------------------
+@router.get("/products/batch", response_model=List[ProductRead])
+async def read_products_batch(
+    ids: str = Query(..., description="Comma-separated product ids"),
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    product_ids = parse_ids(ids)
+    if len(product_ids) > PRODUCT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many ids (max {PRODUCT_BATCH_MAX})")
+    bodies = await async_product_crud.get_product_bodies(session, product_ids)
+    # Requested order; unknown ids are left out. Bodies are cached JSON, joined without parsing.
+    body = b"[" + b",".join(bodies[product_id] for product_id in product_ids if product_id in bodies) + b"]"
+    return Response(content=body, media_type="application/json")
 
 
 @router.get("/products/{product_id}/suggestions", response_model=List[ProductRead])
-def get_suggested_products(
+async def get_suggested_products(
     product_id: int,
-    session: Session = Depends(get_session)
+    limit: int = Query(5, ge=1, le=SUGGEST_MAX_LIMIT),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: AsyncSession = Depends(get_async_read_session)
 ):
-    product = product_crud.get_product(session, product_id)
-    if not product:
+    projection = parse_fields(fields)
+    suggestions = await async_product_crud.get_suggestions(session, [product_id], limit=limit, fields=projection)
+    if product_id not in suggestions:
         raise HTTPException(status_code=404, detail="Product not found")
+    # Empty list if none found
+    return json_response(suggestions[product_id]) if projection else suggestions[product_id]
 
-    suggestions = product_crud.suggest_products(
-        session=session,
-        product_id=product_id,
-        price_range=500,
-        limit=5
-    )
+# ----------------------------------
+# View / purchase events, buffered and applied to the counters in batches
+# ----------------------------------
+async def _require_product(product_id: int):
+    # Checked before buffering: the flush can't tell the client about an unknown id
+    if not 0 < product_id <= events.MAX_PRODUCT_ID or await trending.product_scope(product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+@router.post("/products/{product_id}/view", status_code=202)
+async def record_view(product_id: int):
+    await _require_product(product_id)
+    await events.record_event(product_id, "views")
+    return {"recorded": True}
 
-    return suggestions  # Empty list if none found
+@router.post("/products/{product_id}/purchase", status_code=202)
+async def record_purchase(product_id: int, quantity: int = Query(1, ge=1, le=events.MAX_EVENT_QUANTITY)):
+    await _require_product(product_id)
+    await events.record_event(product_id, "purchase_count", quantity)
+    return {"recorded": True}
 
 
 @router.get("/products/{product_id}", response_model=ProductRead)
-def read_product(product_id: int, session: Session = Depends(get_session)):
-    product = product_crud.get_product(session, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+async def read_product(
+    product_id: int,
+    request: Request,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    projection = parse_fields(fields)
+    if projection:
+        # updated_at is always read for the validators, and dropped again if not asked for
+        columns = projection if "updated_at" in projection else projection + ["updated_at"]
+        product = await async_product_crud.get_product_fields(session, product_id, columns)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        updated_at = product["updated_at"] if "updated_at" in projection else product.pop("updated_at")
+    else:
+        # Cached JSON body, served as-is
+        body = (await async_product_crud.get_product_bodies(session, [product_id])).get(product_id)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        product = orjson.loads(body)
+        updated_at = datetime.fromisoformat(product["updated_at"]) if product.get("updated_at") else None
+
+    # updated_at doesn't date counter changes, so only counter-free responses get Last-Modified
+    last_modified = None if any(column in product for column in events.COUNTER_COLUMNS) else updated_at
+    headers = validator_headers(product_etag(product_id, updated_at, projection, product), last_modified)
+    if not_modified(request, headers["ETag"], last_modified):
+        return Response(status_code=304, headers=headers)
+    if projection:
+        return json_response(product, **headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Update a product by ID
 @router.put("/products/{product_id}", response_model=ProductRead)
-def update_product(product_id: int, product_update: ProductUpdate, session: Session = Depends(get_session)):
+async def update_product(product_id: int, product_update: ProductUpdate, session: AsyncSession = Depends(get_async_session)):
     product_data = product_update.dict(exclude_unset=True)
-    updated_product = product_crud.update_product(session, product_id, product_data)
+    try:
+        updated_product = await async_product_crud.update_product(session, product_id, product_data)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_PRODUCT)
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
     return updated_product
 
 # Delete a product by ID
 @router.delete("/products/{product_id}")
-def delete_product(product_id: int, session: Session = Depends(get_session)):
-    success = product_crud.delete_product(session, product_id)
+async def delete_product(product_id: int, session: AsyncSession = Depends(get_async_session)):
+    success = await async_product_crud.delete_product(session, product_id)
     if not success:
         raise HTTPException(status_code=404, detail="Product not found")
     return {"deleted": True}
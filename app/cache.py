@@ -1,22 +1,762 @@
 # app/cache.py
+#
+# The shared cache backend. A pooled Redis client guarded by a circuit
+# breaker, fronted by a bounded in-process LRU/TTL tier, with single-flight
+# loading so concurrent misses on one key run one query, and
+# stale-while-revalidate so hot keys are refreshed in the background.
 
-import redis
 import os
-import json
+import time
+import logging
+import datetime
+import threading
+import asyncio
+import orjson
+import redis
+import redis.asyncio as aioredis
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+logger = logging.getLogger("cache")
+logger.setLevel(logging.INFO)
+
+# ----------------------------------
+# Redis backend
+# ----------------------------------
+# One pooled client for the whole process. Timeouts are short and a circuit
+# breaker skips Redis entirely for a cool-down after repeated failures, so a
+# slow or dead Redis costs a request milliseconds rather than seconds.
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.05))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 0.05))
+REDIS_FAILURE_THRESHOLD = int(os.getenv("REDIS_FAILURE_THRESHOLD", 3))
+REDIS_COOLDOWN_SECONDS = float(os.getenv("REDIS_COOLDOWN_SECONDS", 10))
+
+def _make_client():
+    if not REDIS_URL:
+        logger.info("REDIS_URL is empty; running with the in-process cache only")
+        return None
+    pool = redis.ConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=30,
+        decode_responses=True,
+    )
+    # Connections are opened lazily, so a missing Redis doesn't block startup
+    return redis.Redis(connection_pool=pool)
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures; allow a trial call after `cooldown` seconds."""
+
+    def __init__(self, threshold: int = REDIS_FAILURE_THRESHOLD, cooldown: float = REDIS_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self._open_until
+
+    def record_success(self):
+        if self._failures:
+            with self._lock:
+                self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                if self.allow():
+                    logger.warning(f"Redis circuit open for {self.cooldown}s after {self._failures} failures")
+                self._open_until = time.monotonic() + self.cooldown
+
+redis_client = _make_client()
+breaker = CircuitBreaker()
+
+def get_redis():
+    """The shared client, or None while Redis is disabled or the breaker is open."""
+    if redis_client is None or not breaker.allow():
+        return None
+    return redis_client
+
+def redis_call(description: str, fn: Callable, default=None):
+    """Run fn(client) through the breaker; returns default if Redis is unavailable or errors."""
+    client = get_redis()
+    if client is None:
+        return default
+    try:
+        result = fn(client)
+        breaker.record_success()
+        return result
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning(f"Redis error ({description}): {e}")
+        return default
+
+CACHE_EXPIRE = 300  # 5 minutes
+CACHE_STALE_SECONDS = int(os.getenv("CACHE_STALE_SECONDS", 30))
+LOCAL_CACHE_TTL = int(os.getenv("LOCAL_CACHE_TTL", 30))
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 1024))
+# How long a worker trusts its copy of a tag generation written by other workers
+GENERATION_TTL = float(os.getenv("CACHE_GENERATION_TTL", 1.0))
+
+# Serialize datetime for caching
+def default_json_serializer(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+def json_body(value) -> bytes:
+    """Serialize a value to JSON bytes, ready to be cached or sent as a response body."""
+    return orjson.dumps(value, default=default_json_serializer, option=orjson.OPT_NON_STR_KEYS)
+
+# raw entries are JSON bodies cached as-is; the rest are (de)serialized on the way through Redis
+def _encode(value, raw: bool):
+    return value if raw else json_body(value)
+
+def _decode(data, raw: bool):
+    if not data:
+        return None
+    if raw:
+        return data.encode() if isinstance(data, str) else data
+    return orjson.loads(data)
+
+# ----------------------------------
+# In-process tier
+# ----------------------------------
+class LocalCache:
+    """Thread-safe LRU with a fresh TTL and an optional stale window per entry."""
+
+    def __init__(self, max_entries: int = LOCAL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return (value, state) where state is "fresh", "stale" or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None, None
+            value, fresh_until, stale_until = entry
+            if now >= stale_until:
+                del self._data[key]
+                return None, None
+            self._data.move_to_end(key)
+            return value, ("fresh" if now < fresh_until else "stale")
+
+    def set(self, key: str, value, ttl: float, stale_ttl: float = 0):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl, now + ttl + stale_ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
 
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")  # "redis" is the Docker service name
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_DB = int(os.getenv("REDIS_DB", 0))
+    def clear(self):
+        with self._lock:
+            self._data.clear()
 
-redis_client = redis.Redis(
-    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True
-)
+local_cache = LocalCache()
 
-def cache_set(key: str, value: dict, expire_seconds: int = 300):
-    redis_client.set(key, json.dumps(value), ex=expire_seconds)
+_stats = {
+    "local_hits": 0,
+    "local_stale_hits": 0,
+    "local_misses": 0,
+    "redis_hits": 0,
+    "redis_misses": 0,
+    "loads": 0,
+    "coalesced": 0,
+}
+_stats_lock = threading.Lock()
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+# ----------------------------------
+# Redis tier
+# ----------------------------------
+def _redis_get(key: str, raw: bool = False):
+    return _decode(redis_call(f"get {key}", lambda client: client.get(key)), raw)
+
+def _pipelined_set(items, expire_seconds: int, tag_generations=None, raw: bool = False):
+    """SET each (key, value) with a TTL in one round-trip, registering keys under their tag generations."""
+    def run(client):
+        pipe = client.pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(key, _encode(value, raw), ex=expire_seconds)
+            # Remember which keys belong to each tag generation so they can be purged later
+            for tag, generation in tag_generations or []:
+                members = f"{TAG_KEYS_PREFIX}{tag}:{generation}"
+                pipe.sadd(members, key)
+                pipe.expire(members, expire_seconds * 2)
+        pipe.execute()
+    redis_call(f"set {len(items)} keys", run)
+
+def cache_set(key: str, value, expire_seconds: int = CACHE_EXPIRE, tag_generations=None,
+              stale_seconds: int = 0, raw: bool = False):
+    local_cache.set(key, value, min(expire_seconds, LOCAL_CACHE_TTL), stale_seconds)
+    _pipelined_set([(key, value)], expire_seconds, tag_generations, raw)
+
+def cache_set_many(mapping: dict, expire_seconds: int = CACHE_EXPIRE, raw: bool = False,
+                   local_ttl: float = LOCAL_CACHE_TTL):
+    for key, value in mapping.items():
+        local_cache.set(key, value, min(expire_seconds, local_ttl))
+    if mapping:
+        _pipelined_set(list(mapping.items()), expire_seconds, raw=raw)
+
+def cache_get_many(keys: List[str], raw: bool = False, local_ttl: float = LOCAL_CACHE_TTL) -> dict:
+    """Return {key: value} for the keys found, checking the local tier first and MGET-ing the rest."""
+    found = {}
+    remote = []
+    for key in keys:
+        value, state = local_cache.get(key)
+        if state == "fresh":
+            found[key] = value
+        else:
+            remote.append(key)
+    if remote:
+        values = redis_call(f"mget {len(remote)} keys", lambda client: client.mget(remote), default=[])
+        for key, data in zip(remote, values):
+            if data:
+                found[key] = _decode(data, raw)
+                local_cache.set(key, found[key], local_ttl)
+    return found
+
+def cache_delete(keys: List[str]):
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        redis_call(f"delete {len(keys)} keys", lambda client: client.unlink(*keys))
 
 def cache_get(key: str):
-    data = redis_client.get(key)
-    if data:
-        return json.loads(data)
-    return None
+    value, state = local_cache.get(key)
+    if state == "fresh":
+        return value
+    value = _redis_get(key)
+    if value is not None:
+        local_cache.set(key, value, LOCAL_CACHE_TTL)
+    return value
+
+# ----------------------------------
+# Versioned entries
+# ----------------------------------
+# For entries dropped by key on write rather than orphaned by a generation
+# bump. A fill reads each key's version before loading and writes back only
+# the keys whose version is unchanged, so a load that raced with a write can't
+# put the old value back after the write deleted it.
+VERSION_SUFFIX = ":version"
+
+def _versions(keys: List[str], values) -> dict:
+    return {key: value or "0" for key, value in zip(keys, values)}
+
+def cache_versions(keys: List[str]) -> dict:
+    """{key: version} to pass to cache_set_many_if_unchanged; empty if Redis is unavailable."""
+    values = redis_call(f"mget {len(keys)} versions", lambda client: client.mget([key + VERSION_SUFFIX for key in keys]))
+    return {} if values is None else _versions(keys, values)
+
+def cache_set_many_if_unchanged(mapping: dict, versions: dict, expire_seconds: int = CACHE_EXPIRE,
+                                raw: bool = False, local_ttl: float = LOCAL_CACHE_TTL):
+    if not mapping:
+        return
+    if not versions:
+        # Redis is unavailable: only this worker's short-lived tier is filled
+        for key, value in mapping.items():
+            local_cache.set(key, value, min(expire_seconds, local_ttl))
+        return
+
+    def run(client):
+        version_keys = [key + VERSION_SUFFIX for key in mapping]
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(*version_keys)
+                current = _versions(list(mapping), pipe.mget(version_keys))
+                unchanged = [key for key in mapping if current[key] == versions.get(key)]
+                pipe.multi()
+                for key in unchanged:
+                    pipe.set(key, _encode(mapping[key], raw), ex=expire_seconds)
+                pipe.execute()
+                return unchanged
+            except redis.WatchError:
+                # A write landed meanwhile; leave the entries for the next reader
+                return []
+
+    written = redis_call(f"set {len(mapping)} keys if unchanged", run)
+    for key in written or []:
+        local_cache.set(key, mapping[key], min(expire_seconds, local_ttl))
+
+def cache_delete_versioned(keys: List[str]):
+    """Delete keys and bump their versions, so fills that read the old version are dropped."""
+    def run(client):
+        pipe = client.pipeline(transaction=True)
+        for key in keys:
+            pipe.unlink(key)
+            pipe.incr(key + VERSION_SUFFIX)
+            pipe.expire(key + VERSION_SUFFIX, CACHE_EXPIRE)
+        pipe.execute()
+
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        redis_call(f"delete {len(keys)} versioned keys", run)
+
+# ----------------------------------
+# Single-flight loading
+# ----------------------------------
+_inflight = {}
+_inflight_lock = threading.Lock()
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+
+def _single_flight(key: str, fn: Callable):
+    """Run fn once per key at a time; concurrent callers wait for and share its result."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    if not leader:
+        _count("coalesced")
+        return future.result()
+
+    try:
+        value = fn()
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def get_or_load(
+    key: str,
+    loader: Callable,
+    expire_seconds: int = CACHE_EXPIRE,
+    tag_generations=None,
+    stale_seconds: int = CACHE_STALE_SECONDS,
+    raw: bool = False,
+):
+    """Return (value, source) for key, where source is "local", "stale", "redis" or "miss".
+
+    loader must be callable from a background thread (it is reused to refresh
+    stale entries), so it should open its own DB session rather than borrow
+    the request's. With raw=True the loader returns a JSON body (see
+    json_body) that is cached and returned as bytes, never parsed.
+    """
+    def load():
+        _count("loads")
+        value = loader()
+        cache_set(key, value, expire_seconds, tag_generations, stale_seconds, raw)
+        return value
+
+    value, state = local_cache.get(key)
+    if state == "fresh":
+        _count("local_hits")
+        return value, "local"
+    if state == "stale":
+        _count("local_stale_hits")
+        with _inflight_lock:
+            refreshing = key in _inflight
+        if not refreshing:
+            _refresh_pool.submit(_single_flight, key, load)
+        return value, "stale"
+    _count("local_misses")
+
+    value = _redis_get(key, raw)
+    if value is not None:
+        _count("redis_hits")
+        local_cache.set(key, value, min(expire_seconds, LOCAL_CACHE_TTL), stale_seconds)
+        return value, "redis"
+    _count("redis_misses")
+
+    return _single_flight(key, load), "miss"
+
+# ----------------------------------
+# Generation-tagged cache namespaces
+# ----------------------------------
+# Every cached entry folds the current generation of its tags into its key.
+# A write bumps the generations of the tags it can affect (O(1) INCRs), which
+# orphans the old keys instead of scanning for them; a background worker then
+# unlinks the orphans in pipelined batches. Workers keep a short-lived local
+# copy of each generation so cache hits don't need a Redis round-trip.
+#
+# A bump made while Redis is unreachable is held locally (trusted until
+# further notice) and replayed as INCRs once Redis answers again, so neither
+# this worker's local tier nor Redis serves entries cached before the write.
+GENERATION_PREFIX = "products_gen:"
+TAG_KEYS_PREFIX = "products_tagkeys:"
+EPOCH_TAG = "epoch"  # Folded into every key; bumped when the affected scope is unknown
+PURGE_BATCH = 500
+
+_purge_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-purge")
+_generations = {}  # tag -> (generation, trusted_until)
+_generations_lock = threading.Lock()
+_pending_bumps = Counter()  # tag -> bumps made while Redis was unreachable, not yet replayed
+
+def _known_generations(tags: List[str]):
+    """Split tags into ({tag: generation} still trusted locally, [tags to fetch])."""
+    now = time.monotonic()
+    with _generations_lock:
+        known = {tag: _generations[tag][0] for tag in tags if tag in _generations and _generations[tag][1] > now}
+    return known, [tag for tag in tags if tag not in known]
+
+def _remember_generations(tags: List[str], values, known: dict):
+    trusted_until = time.monotonic() + GENERATION_TTL
+    with _generations_lock:
+        for tag, value in zip(tags, values):
+            known[tag] = int(value or 0)
+            _generations[tag] = (known[tag], trusted_until)
+
+def _last_generations(tags: List[str], known: dict):
+    # Redis is unreachable: keep the generations last seen rather than falling back to 0
+    with _generations_lock:
+        for tag in tags:
+            if tag in _generations:
+                known[tag] = _generations[tag][0]
+
+def _fold_generations(base: str, tags: List[str], known: dict):
+    generations = [known.get(tag, 0) for tag in tags]
+    return f"{base}@{'.'.join(str(generation) for generation in generations)}", list(zip(tags, generations))
+
+def tagged_cache_key(base: str, tags: List[str]):
+    """Return (key, [(tag, generation), ...]) with the current generations folded into `base`."""
+    _replay_pending()
+    tags = [EPOCH_TAG] + tags
+    known, missing = _known_generations(tags)
+    if missing:
+        values = redis_call(
+            f"mget generations {missing}",
+            lambda client: client.mget([GENERATION_PREFIX + tag for tag in missing]),
+        )
+        if values is not None:
+            _remember_generations(missing, values, known)
+        else:
+            _last_generations(missing, known)
+    return _fold_generations(base, tags, known)
+
+def _purge_generations(tag_generations):
+    for tag, generation in tag_generations:
+        members = f"{TAG_KEYS_PREFIX}{tag}:{generation}"
+
+        def purge(client):
+            batch = []
+            for key in client.sscan_iter(members, count=PURGE_BATCH):
+                batch.append(key)
+                if len(batch) >= PURGE_BATCH:
+                    client.unlink(*batch)
+                    batch = []
+            if batch:
+                client.unlink(*batch)
+            client.unlink(members)
+
+        redis_call(f"purge {members}", purge)
+
+def _apply_invalidation(tags: List[str], generations):
+    if generations is None:
+        # Redis is off or unreachable: stop this worker serving the old entries,
+        # and hold the bumps until they can be replayed
+        with _generations_lock:
+            for tag in tags:
+                _generations[tag] = (_generations.get(tag, (0, 0))[0] + 1, float("inf"))
+            if redis_client is not None:
+                _pending_bumps.update(tags)
+        return
+
+    _remember_generations(tags, generations, {})
+    _purge_pool.submit(_purge_generations, [
+        (tag, generation - 1) for tag, generation in zip(tags, generations)
+    ])
+
+def _held_bumps() -> dict:
+    """Bumps held while Redis was unreachable, if it may be reachable now."""
+    if not _pending_bumps or not breaker.allow():
+        return {}
+    with _generations_lock:
+        return dict(_pending_bumps)
+
+def _replayed(bumps: dict, generations):
+    # Replaying the same number of bumps lands Redis on generations no entry
+    # from before the writes was cached under
+    if generations is None:
+        return
+    with _generations_lock:
+        _pending_bumps.subtract(bumps)
+        for tag in bumps:
+            if _pending_bumps[tag] <= 0:
+                del _pending_bumps[tag]
+    _remember_generations(list(bumps), generations, {})
+    _purge_pool.submit(_purge_generations, [
+        (tag, generation - step)
+        for tag, generation in zip(bumps, generations)
+        for step in range(1, bumps[tag] + 1)
+    ])
+
+def _bump(bumps: dict):
+    def bump(client):
+        pipe = client.pipeline(transaction=False)
+        for tag, amount in bumps.items():
+            pipe.incrby(GENERATION_PREFIX + tag, amount)
+        return pipe.execute()
+    return bump
+
+def _replay_pending():
+    bumps = _held_bumps()
+    if bumps:
+        _replayed(bumps, redis_call(f"replay invalidation {list(bumps)}", _bump(bumps)))
+
+def invalidate_tags(tags: List[str]):
+    _replay_pending()
+    _apply_invalidation(tags, redis_call(f"invalidate {tags}", _bump(dict.fromkeys(tags, 1))))
+
+# ----------------------------------
+# Async API
+# ----------------------------------
+# Same semantics as the sync functions above, on redis.asyncio so async routes
+# never block the event loop. Both share the local tier, the breaker and the
+# generation table.
+def _make_async_client():
+    if not REDIS_URL:
+        return None
+    pool = aioredis.ConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=30,
+        decode_responses=True,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+async_redis_client = _make_async_client()
+
+async def aredis_call(description: str, fn: Callable, default=None):
+    """Await fn(client) through the breaker; returns default if Redis is unavailable or errors."""
+    if async_redis_client is None or not breaker.allow():
+        return default
+    try:
+        result = await fn(async_redis_client)
+        breaker.record_success()
+        return result
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning(f"Redis error ({description}): {e}")
+        return default
+
+async def _aredis_get(key: str, raw: bool = False):
+    return _decode(await aredis_call(f"get {key}", lambda client: client.get(key)), raw)
+
+async def _apipelined_set(items, expire_seconds: int, tag_generations=None, raw: bool = False):
+    async def run(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for key, value in items:
+                pipe.set(key, _encode(value, raw), ex=expire_seconds)
+                for tag, generation in tag_generations or []:
+                    members = f"{TAG_KEYS_PREFIX}{tag}:{generation}"
+                    pipe.sadd(members, key)
+                    pipe.expire(members, expire_seconds * 2)
+            await pipe.execute()
+    await aredis_call(f"set {len(items)} keys", run)
+
+async def acache_set(key: str, value, expire_seconds: int = CACHE_EXPIRE, tag_generations=None,
+                     stale_seconds: int = 0, raw: bool = False):
+    local_cache.set(key, value, min(expire_seconds, LOCAL_CACHE_TTL), stale_seconds)
+    await _apipelined_set([(key, value)], expire_seconds, tag_generations, raw)
+
+async def acache_set_many(mapping: dict, expire_seconds: int = CACHE_EXPIRE, raw: bool = False,
+                          local_ttl: float = LOCAL_CACHE_TTL):
+    for key, value in mapping.items():
+        local_cache.set(key, value, min(expire_seconds, local_ttl))
+    if mapping:
+        await _apipelined_set(list(mapping.items()), expire_seconds, raw=raw)
+
+async def acache_get_many(keys: List[str], raw: bool = False, local_ttl: float = LOCAL_CACHE_TTL) -> dict:
+    found = {}
+    remote = []
+    for key in keys:
+        value, state = local_cache.get(key)
+        if state == "fresh":
+            found[key] = value
+        else:
+            remote.append(key)
+    if remote:
+        values = await aredis_call(f"mget {len(remote)} keys", lambda client: client.mget(remote), default=[])
+        for key, data in zip(remote, values):
+            if data:
+                found[key] = _decode(data, raw)
+                local_cache.set(key, found[key], local_ttl)
+    return found
+
+async def acache_delete(keys: List[str]):
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        await aredis_call(f"delete {len(keys)} keys", lambda client: client.unlink(*keys))
+
+async def acache_get(key: str):
+    value, state = local_cache.get(key)
+    if state == "fresh":
+        return value
+    value = await _aredis_get(key)
+    if value is not None:
+        local_cache.set(key, value, LOCAL_CACHE_TTL)
+    return value
+
+async def acache_versions(keys: List[str]) -> dict:
+    values = await aredis_call(f"mget {len(keys)} versions", lambda client: client.mget([key + VERSION_SUFFIX for key in keys]))
+    return {} if values is None else _versions(keys, values)
+
+async def acache_set_many_if_unchanged(mapping: dict, versions: dict, expire_seconds: int = CACHE_EXPIRE,
+                                       raw: bool = False, local_ttl: float = LOCAL_CACHE_TTL):
+    if not mapping:
+        return
+    if not versions:
+        for key, value in mapping.items():
+            local_cache.set(key, value, min(expire_seconds, local_ttl))
+        return
+
+    async def run(client):
+        version_keys = [key + VERSION_SUFFIX for key in mapping]
+        async with client.pipeline() as pipe:
+            try:
+                await pipe.watch(*version_keys)
+                current = _versions(list(mapping), await pipe.mget(version_keys))
+                unchanged = [key for key in mapping if current[key] == versions.get(key)]
+                pipe.multi()
+                for key in unchanged:
+                    pipe.set(key, _encode(mapping[key], raw), ex=expire_seconds)
+                await pipe.execute()
+                return unchanged
+            except redis.WatchError:
+                return []
+
+    written = await aredis_call(f"set {len(mapping)} keys if unchanged", run)
+    for key in written or []:
+        local_cache.set(key, mapping[key], min(expire_seconds, local_ttl))
+
+async def acache_delete_versioned(keys: List[str]):
+    async def run(client):
+        async with client.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.unlink(key)
+                pipe.incr(key + VERSION_SUFFIX)
+                pipe.expire(key + VERSION_SUFFIX, CACHE_EXPIRE)
+            await pipe.execute()
+
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        await aredis_call(f"delete {len(keys)} versioned keys", run)
+
+_ainflight = {}
+_background_tasks = set()
+
+async def _asingle_flight(key: str, fn: Callable):
+    future = _ainflight.get(key)
+    if future is not None:
+        _count("coalesced")
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _ainflight[key] = future
+    try:
+        value = await fn()
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        # Nobody may be waiting; don't log "exception never retrieved"
+        future.exception()
+        raise
+    finally:
+        _ainflight.pop(key, None)
+
+def _refresh_done(task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Background cache refresh failed: {task.exception()}")
+
+async def aget_or_load(
+    key: str,
+    loader: Callable,
+    expire_seconds: int = CACHE_EXPIRE,
+    tag_generations=None,
+    stale_seconds: int = CACHE_STALE_SECONDS,
+    raw: bool = False,
+):
+    """Async get_or_load; loader is a coroutine function that opens its own session."""
+    async def load():
+        _count("loads")
+        value = await loader()
+        await acache_set(key, value, expire_seconds, tag_generations, stale_seconds, raw)
+        return value
+
+    value, state = local_cache.get(key)
+    if state == "fresh":
+        _count("local_hits")
+        return value, "local"
+    if state == "stale":
+        _count("local_stale_hits")
+        if key not in _ainflight:
+            task = asyncio.create_task(_asingle_flight(key, load))
+            _background_tasks.add(task)
+            task.add_done_callback(_refresh_done)
+        return value, "stale"
+    _count("local_misses")
+
+    value = await _aredis_get(key, raw)
+    if value is not None:
+        _count("redis_hits")
+        local_cache.set(key, value, min(expire_seconds, LOCAL_CACHE_TTL), stale_seconds)
+        return value, "redis"
+    _count("redis_misses")
+
+    return await _asingle_flight(key, load), "miss"
+
+async def atagged_cache_key(base: str, tags: List[str]):
+    await _areplay_pending()
+    tags = [EPOCH_TAG] + tags
+    known, missing = _known_generations(tags)
+    if missing:
+        values = await aredis_call(
+            f"mget generations {missing}",
+            lambda client: client.mget([GENERATION_PREFIX + tag for tag in missing]),
+        )
+        if values is not None:
+            _remember_generations(missing, values, known)
+        else:
+            _last_generations(missing, known)
+    return _fold_generations(base, tags, known)
+
+def _abump(bumps: dict):
+    async def bump(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for tag, amount in bumps.items():
+                pipe.incrby(GENERATION_PREFIX + tag, amount)
+            return await pipe.execute()
+    return bump
+
+async def _areplay_pending():
+    bumps = _held_bumps()
+    if bumps:
+        _replayed(bumps, await aredis_call(f"replay invalidation {list(bumps)}", _abump(bumps)))
+
+async def ainvalidate_tags(tags: List[str]):
+    await _areplay_pending()
+    _apply_invalidation(tags, await aredis_call(f"invalidate {tags}", _abump(dict.fromkeys(tags, 1))))
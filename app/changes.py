@@ -0,0 +1,164 @@
+# app/changes.py
+#
+# Live change feed behind GET /api/products/events. Product writes and
+# counter flushes publish compact deltas to the CHANGES_CHANNEL Redis
+# channel; every worker runs one subscriber task that hands each message to
+# its server-sent-event listeners. While Redis is unavailable (or this
+# worker's subscriber is reconnecting) deltas are delivered in-process, so
+# listeners on the writing worker still see them.
+#
+# A message is a JSON array of deltas, passed through as the SSE data:
+#   {"type": "created", "id": 7, "product": {...}}
+#   {"type": "updated", "id": 7, "updated_at": ..., "changes": {"price": [old, new], ...}}
+#   {"type": "deleted", "id": 7, "product": {...}}
+#   {"type": "counters", "changes": {"7": {"views": 3, "purchase_count": 1}}}
+#   {"type": "reset"}  -- this listener fell behind and dropped deltas; reload
+# Old values ride along with updates and deletes so clients can keep
+# aggregates current without refetching.
+
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, Optional
+from app import cache
+from app.cache import aredis_call, json_body, redis_call
+
+logger = logging.getLogger("changes")
+logger.setLevel(logging.INFO)
+
+CHANGES_CHANNEL = os.getenv("CHANGES_CHANNEL", "product_changes")
+# Messages buffered per listener before it is reset instead of slowing everyone down
+CHANGES_QUEUE_SIZE = int(os.getenv("CHANGES_QUEUE_SIZE", 1000))
+CHANGES_KEEPALIVE_SECONDS = float(os.getenv("CHANGES_KEEPALIVE_SECONDS", 15))
+CHANGES_RETRY_SECONDS = float(os.getenv("CHANGES_RETRY_SECONDS", 3))
+
+RESET = json_body([{"type": "reset"}])
+
+_listeners = set()
+_subscriber = None
+_subscribed = False
+
+# ----------------------------------
+# Deltas
+# ----------------------------------
+def created(products: Iterable) -> list:
+    return [{"type": "created", "id": product.id, "product": product.dict()} for product in products]
+
+def updated(product, before: dict) -> list:
+    """Fields whose value changed, as [old, new]; nothing if the update was a no-op."""
+    changes = {
+        name: [old, getattr(product, name)] for name, old in before.items() if getattr(product, name) != old
+    }
+    if not changes:
+        return []
+    return [{"type": "updated", "id": product.id, "updated_at": product.updated_at, "changes": changes}]
+
+def deleted(product) -> list:
+    return [{"type": "deleted", "id": product.id, "product": product.dict()}]
+
+def reserved(rows) -> list:
+    """rows: (id, quantity, stock, purchase_count, updated_at) after a stock reservation."""
+    return [
+        {"type": "updated", "id": product_id, "updated_at": updated_at, "changes": {
+            "stock": [stock + quantity, stock],
+            "purchase_count": [purchase_count - quantity, purchase_count],
+        }}
+        for product_id, quantity, stock, purchase_count, updated_at in rows
+    ]
+
+def counters(per_product: dict) -> list:
+    """per_product: {id: {column: amount}} as applied by a counter flush."""
+    changes = {
+        product_id: {column: amount for column, amount in counts.items() if amount}
+        for product_id, counts in per_product.items()
+    }
+    return [{"type": "counters", "changes": changes}] if changes else []
+
+# ----------------------------------
+# Publishing
+# ----------------------------------
+def _deliver(message: bytes):
+    for queue in list(_listeners):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A stalled client: drop its backlog and tell it to reload
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESET)
+
+async def apublish(deltas: list):
+    if not deltas:
+        return
+    message = json_body(deltas)
+    receivers = await aredis_call("publish changes", lambda client: client.publish(CHANGES_CHANNEL, message))
+    if receivers is None or not _subscribed:
+        _deliver(message)
+
+def publish(deltas: list):
+    """For the sync CRUD functions (scripts): Redis only, there are no listeners in-process."""
+    if deltas:
+        redis_call("publish changes", lambda client: client.publish(CHANGES_CHANNEL, json_body(deltas)))
+
+# ----------------------------------
+# Subscribing
+# ----------------------------------
+async def _subscribe_forever():
+    global _subscribed
+    while True:
+        client = cache.async_redis_client
+        if client is None:
+            return
+        if not cache.breaker.allow():
+            await asyncio.sleep(CHANGES_RETRY_SECONDS)
+            continue
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CHANGES_CHANNEL)
+            _subscribed = True
+            while True:
+                # Explicit timeout: the shared pool's socket timeout is tuned for cache calls
+                message = await pubsub.get_message(timeout=CHANGES_KEEPALIVE_SECONDS)
+                if message is not None:
+                    data = message["data"]
+                    _deliver(data.encode() if isinstance(data, str) else data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if _subscribed:
+                logger.warning(f"Change feed subscription lost, retrying every {CHANGES_RETRY_SECONDS}s: {e}")
+        finally:
+            _subscribed = False
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(CHANGES_RETRY_SECONDS)
+
+def start_change_feed():
+    global _subscriber
+    if _subscriber is None:
+        _subscriber = asyncio.create_task(_subscribe_forever())
+
+async def stop_change_feed():
+    global _subscriber
+    if _subscriber is not None:
+        _subscriber.cancel()
+        _subscriber = None
+
+async def listen(is_disconnected) -> AsyncIterator[bytes]:
+    """SSE frames for one client until is_disconnected() says it has gone."""
+    queue = asyncio.Queue(maxsize=CHANGES_QUEUE_SIZE)
+    _listeners.add(queue)
+    try:
+        yield f"retry: {int(CHANGES_RETRY_SECONDS * 1000)}\n\n".encode()
+        while not await is_disconnected():
+            try:
+                message: Optional[bytes] = await asyncio.wait_for(queue.get(), CHANGES_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+                continue
+            yield b"data: " + message + b"\n\n"
+    finally:
+        _listeners.discard(queue)
@@ -0,0 +1,173 @@
+# app/columnar.py
+#
+# Columnar responses for analytics clients: Apache Arrow IPC streams and
+# Parquet, negotiated from the Accept header on the listing, stats and export
+# routes. Tables are built column by column from the query's row tuples with
+# types taken from the Product table, so no per-row dicts or models are made
+# and clients get typed columns they can load without parsing.
+
+import io
+import os
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Sequence
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import types
+from app.cache import json_body
+from app.models.product import Product
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+COLUMNAR_MEDIA_TYPES = {ARROW_MEDIA_TYPE: "arrow", PARQUET_MEDIA_TYPE: "parquet"}
+
+# Arrow IPC body compression ("lz4" or "zstd"); off by default so clients can read buffers zero-copy
+ARROW_IPC_COMPRESSION = os.getenv("ARROW_IPC_COMPRESSION") or None
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+# Exports arrive in small chunks; Parquet row groups are gathered up to this size
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", 65536))
+
+# Low-cardinality text columns sent dictionary-encoded
+DICTIONARY_FIELDS = {"brand", "category", "region"}
+
+# Checked in order: DateTime is matched before Date, Boolean before Integer
+_ARROW_TYPES = [
+    (types.Boolean, pa.bool_()),
+    (types.Integer, pa.int64()),
+    (types.Float, pa.float64()),
+    (types.DateTime, pa.timestamp("us")),
+    (types.Date, pa.date32()),
+    (types.String, pa.string()),
+]
+
+def columnar_format(accept: Optional[str]) -> Optional[str]:
+    """'arrow' or 'parquet' if the Accept header prefers one over JSON, else None."""
+    if not accept:
+        return None
+    preferred = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            preferred.append((-quality, position, media_type.lower()))
+    for _, _, media_type in sorted(preferred):
+        if media_type in COLUMNAR_MEDIA_TYPES:
+            return COLUMNAR_MEDIA_TYPES[media_type]
+        if media_type in ("application/json", "application/*", "*/*"):
+            return None
+    return None
+
+@lru_cache(maxsize=None)
+def arrow_schema(fields: tuple, dictionary: bool = True) -> pa.Schema:
+    """Arrow schema for Product columns, typed from the table definition."""
+    columns = Product.__table__.c
+    schema = []
+    for name in fields:
+        sql_type = columns[name].type
+        if isinstance(sql_type, types.TypeDecorator):  # e.g. SQLModel's AutoString
+            sql_type = sql_type.impl
+        arrow_type = next(arrow for sql, arrow in _ARROW_TYPES if isinstance(sql_type, sql))
+        if dictionary and name in DICTIONARY_FIELDS:
+            arrow_type = pa.dictionary(pa.int32(), arrow_type)
+        schema.append(pa.field(name, arrow_type, nullable=columns[name].nullable))
+    return pa.schema(schema)
+
+def record_batch(columns: List[str], rows: Sequence, metadata: Optional[dict] = None) -> pa.RecordBatch:
+    """A record batch from row tuples, transposed straight into typed column arrays."""
+    schema = arrow_schema(tuple(columns))
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = []
+    for field, column in zip(schema, values):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(column, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(column, type=field.type))
+    if metadata:
+        schema = schema.with_metadata({
+            key: value if isinstance(value, str) else json_body(value)
+            for key, value in metadata.items() if value is not None
+        })
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def stats_table(stats: dict) -> pa.Table:
+    """ProductStats as a one-row table; the breakdowns are list<struct> columns."""
+    product = pa.struct(list(arrow_schema(tuple(Product.__table__.c.keys()), dictionary=False)))
+    schema = pa.schema([
+        ("total", pa.int64()),
+        ("average_price", pa.float64()),
+        ("average_rating", pa.float64()),
+        ("rated", pa.int64()),
+        ("total_stock", pa.int64()),
+        ("categories", pa.list_(pa.struct([("category", pa.string()), ("count", pa.int64())]))),
+        ("price_histogram", pa.list_(pa.struct([("min", pa.float64()), ("max", pa.float64()), ("count", pa.int64())]))),
+        ("top_rated", pa.list_(product)),
+    ])
+    return pa.Table.from_pylist([stats], schema=schema)
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose contents are taken after each write, for streaming writers."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+def encode_table(format: str, table) -> bytes:
+    """A whole table or record batch as an Arrow IPC stream or Parquet file."""
+    sink = pa.BufferOutputStream()
+    if format == "parquet":
+        if isinstance(table, pa.RecordBatch):
+            table = pa.Table.from_batches([table])
+        pq.write_table(table, sink, compression=PARQUET_COMPRESSION)
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=ARROW_IPC_COMPRESSION)
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write(table)
+    return sink.getvalue().to_pybytes()
+
+async def encode_arrow(columns: List[str], chunks: AsyncIterator[Sequence]) -> AsyncIterator[bytes]:
+    # One record batch per chunk, written as it arrives
+    sink = _Drain()
+    options = pa.ipc.IpcWriteOptions(compression=ARROW_IPC_COMPRESSION)
+    with pa.ipc.new_stream(sink, arrow_schema(tuple(columns)), options=options) as writer:
+        async for rows in chunks:
+            writer.write_batch(record_batch(columns, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+async def encode_parquet(columns: List[str], chunks: AsyncIterator[Sequence]) -> AsyncIterator[bytes]:
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, arrow_schema(tuple(columns)), compression=PARQUET_COMPRESSION)
+    pending, pending_rows = [], 0
+    async for rows in chunks:
+        pending.append(record_batch(columns, rows))
+        pending_rows += len(rows)
+        if pending_rows >= PARQUET_ROW_GROUP_ROWS:
+            writer.write_table(pa.Table.from_batches(pending))
+            pending, pending_rows = [], 0
+            yield sink.drain()
+    if pending:
+        writer.write_table(pa.Table.from_batches(pending))
+    writer.close()
+    yield sink.drain()
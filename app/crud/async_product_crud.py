@@ -0,0 +1,525 @@
+# Async counterparts of app/crud/product_crud.py for the API routes.
+#
+# Cache lookups go through the async cache API (local tier + redis.asyncio).
+# Misses run the shared query functions from product_crud through
+# AsyncSession.run_sync, so both APIs return identical data and the sync
+# functions keep working for scripts.
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import afill_engine, anote_write, async_read_engine
+from app.models.product import Product, ProductCreate
+from app.cache import (
+    EPOCH_TAG,
+    acache_delete_versioned,
+    acache_get_many,
+    acache_set_many_if_unchanged,
+    acache_versions,
+    aget_or_load,
+    ainvalidate_tags,
+    atagged_cache_key,
+    json_body,
+)
+from app import changes, recommend, trending
+from app.columnar import record_batch
+from app.crud import product_crud
+from app.crud.product_crud import ALL_TAG, listing_tags, product_tags
+
+# Setup logger
+logger = logging.getLogger("async_product_crud")
+logger.setLevel(logging.INFO)
+
+async def invalidate_product_caches(*products):
+    if not products:
+        await ainvalidate_tags([EPOCH_TAG])
+        return
+    await ainvalidate_tags(product_tags(*products))
+
+async def product_cache_keys(product_ids) -> dict:
+    namespace, _ = await atagged_cache_key("product", [])
+    return product_crud._product_cache_keys(namespace, product_ids)
+
+async def invalidate_product_entries(product_ids):
+    await acache_delete_versioned(list((await product_cache_keys(product_ids)).values()))
+
+# Index maintenance costs NumPy work that grows with the index (seconds for a
+# large batch), so it runs off the event loop. Every index change goes through
+# this one thread, so they apply in the order the writes were made.
+_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-writes")
+
+def _update_indexes(fn, *args) -> asyncio.Future:
+    return asyncio.get_running_loop().run_in_executor(_index_executor, fn, *args)
+
+def after_product_write(products) -> asyncio.Future:
+    return _update_indexes(product_crud._after_product_write, [product.dict() for product in products])
+
+def after_product_delete(product_ids) -> asyncio.Future:
+    return _update_indexes(product_crud._after_product_delete, list(product_ids))
+
+# Create a product
+async def create_product(product_create: ProductCreate, db: AsyncSession) -> Product:
+    try:
+        product = product_crud._to_product(product_create)
+        db.add(product)
+        await db.commit()
+        await anote_write()
+        await db.refresh(product)
+
+        await invalidate_product_caches(product_crud._scope(product))
+        await after_product_write([product])
+        await changes.apublish(changes.created([product]))
+
+        return product
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error creating product: {e}")
+        raise
+
+# Create many products in one transaction
+async def create_products(products_create: List[ProductCreate], db: AsyncSession) -> List[Product]:
+    try:
+        products = [product_crud._to_product(product_create) for product_create in products_create]
+        if not products:
+            return []
+
+        db.add_all(products)
+        await db.commit()
+        await anote_write()
+
+        # One invalidation for the whole batch
+        await invalidate_product_caches(*product_crud._batch_scopes(products))
+        # Not awaited: indexing a large batch takes seconds, and lookups fall back to SQL meanwhile
+        after_product_write(products)
+        await changes.apublish(changes.created(products))
+
+        return products
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error bulk creating {len(products_create)} products: {e}")
+        raise
+
+# (name, brand) keys among products_create that already exist, brand normalised like the unique index
+async def existing_natural_keys(db: AsyncSession, products_create: List[ProductCreate]) -> set:
+    names = {product_create.name for product_create in products_create}
+    if not names:
+        return set()
+    rows = await db.exec(select(Product.name, Product.brand).where(Product.name.in_(names)))
+    return {(name, brand or "") for name, brand in rows}
+
+# Get a single product
+async def get_product(session: AsyncSession, product_id: int) -> Optional[Product]:
+    try:
+        return await session.get(Product, product_id)
+    except Exception as e:
+        logger.error(f"Error fetching product {product_id}: {e}")
+        return None
+
+# Products by id as JSON bodies, read through the per-product cache: one MGET,
+# one IN query for the misses, one pipelined write-back. Missing ids are omitted.
+async def get_product_bodies(session: AsyncSession, product_ids: List[int]) -> dict:
+    keys = await product_cache_keys(product_ids)
+    found = await acache_get_many(list(keys.values()), raw=True, local_ttl=product_crud.PRODUCT_LOCAL_CACHE_SECONDS)
+    bodies = {product_id: found[key] for product_id, key in keys.items() if key in found}
+
+    missing = [product_id for product_id in product_ids if product_id not in bodies]
+    if missing:
+        # Versions are read before the query so a write racing with it drops our copy
+        versions = await acache_versions([keys[product_id] for product_id in missing])
+        async with AsyncSession(await afill_engine(session.bind)) as load_session:
+            loaded = await load_session.run_sync(product_crud._query_product_bodies, missing)
+        await acache_set_many_if_unchanged({keys[product_id]: body for product_id, body in loaded.items()}, versions,
+                                           product_crud.PRODUCT_CACHE_SECONDS, raw=True,
+                                           local_ttl=product_crud.PRODUCT_LOCAL_CACHE_SECONDS)
+        bodies.update(loaded)
+    return bodies
+
+# Rows for an export, streamed from a server-side cursor in chunks of chunk_rows.
+# Opens its own session: the stream outlives the request's dependencies.
+async def stream_products(
+    chunk_rows: int,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    fields: Optional[List[str]] = None,
+):
+    async with AsyncSession(async_read_engine()) as session:
+        statement = await session.run_sync(
+            product_crud._export_statement, search, category, region, min_price, max_price, fields
+        )
+        result = await session.stream(statement.execution_options(yield_per=chunk_rows))
+        async for rows in result.partitions():
+            yield rows
+
+# A single product narrowed to a sparse fieldset, as a dict
+async def get_product_fields(session: AsyncSession, product_id: int, fields: List[str]) -> Optional[dict]:
+    try:
+        return await session.run_sync(product_crud._query_product, product_id, fields)
+    except Exception as e:
+        logger.error(f"Error fetching product {product_id}: {e}")
+        return None
+
+# Loaders open their own session so a stale entry can be refreshed in a
+# background task after the request's session has closed.
+async def _run_query(session: AsyncSession, query, *args):
+    async with AsyncSession(await afill_engine(session.bind)) as load_session:
+        return await load_session.run_sync(query, *args)
+
+async def _facet_counts(session: AsyncSession) -> list:
+    cache_key, tag_generations = await atagged_cache_key("products_facets", [ALL_TAG])
+    facets, _ = await aget_or_load(
+        cache_key,
+        lambda: _run_query(session, product_crud._query_facets),
+        tag_generations=tag_generations,
+    )
+    return facets
+
+# Count products for a filter set; cached per filter set so every page shares it
+async def count_products(
+    session: AsyncSession,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    exact: bool = True,
+) -> dict:
+    if product_crud._counts_from_facets(search, min_price, max_price, exact):
+        return product_crud._sum_facets(await _facet_counts(session), category, region)
+
+    cache_key, tag_generations = await atagged_cache_key(
+        product_crud._count_cache_base(search, category, region, min_price, max_price, exact),
+        listing_tags(category, region),
+    )
+    result, _ = await aget_or_load(
+        cache_key,
+        lambda: _run_query(session, product_crud._query_count, search, category, region, min_price, max_price, exact),
+        tag_generations=tag_generations,
+    )
+    return result
+
+# Get multiple products with filters, sort, pagination and caching
+async def get_products(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = None,
+    order: Optional[str] = "asc",
+    pagination: str = "offset",
+    cursor: Optional[str] = None,
+    exact: bool = True,
+    fields: Optional[List[str]] = None,
+) -> dict:
+    keyset, sort_by, after = product_crud._prepare_listing(sort_by, order, pagination, cursor)
+
+    try:
+        cache_key, tag_generations = await atagged_cache_key(
+            product_crud._listing_cache_base(pagination, keyset, cursor, skip, limit, search, category, region,
+                                             min_price, max_price, sort_by, order, fields),
+            listing_tags(category, region),
+        )
+        result, _ = await aget_or_load(
+            cache_key,
+            lambda: _run_query(session, product_crud._query_listing, skip, limit, search, category, region,
+                               min_price, max_price, sort_by, order, keyset, after, fields),
+            tag_generations=tag_generations,
+        )
+
+        # Total count (skipped in cursor mode, where pages must stay constant-time)
+        if keyset:
+            return {**result, "total": None}
+        return {**result, **await count_products(session, search, category, region, min_price, max_price, exact=exact)}
+
+    except Exception as e:
+        logger.error(f"Error fetching products: {e}")
+        return {"total": 0, "items": []}
+
+# Listing bodies are cached with their ETag in front: b'"<etag>"\n<body>'
+def _pack_body(cache_key: str, body: bytes) -> bytes:
+    # Strong validator: the key carries the filter's tag generations, the digest the content
+    etag = hashlib.blake2b(cache_key.encode() + body, digest_size=16).hexdigest()
+    return f'"{etag}"\n'.encode() + body
+
+def _unpack_body(packed: bytes) -> Tuple[str, bytes]:
+    etag, _, body = packed.partition(b"\n")
+    return etag.decode(), body
+
+# get_products as a finished PaginatedProductResponse JSON body, cached whole:
+# a hit is returned as-is with no parsing or re-validation.
+# Returns (body, ETag, cache source); the ETag is None if the listing failed.
+async def get_products_body(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = None,
+    order: Optional[str] = "asc",
+    pagination: str = "offset",
+    cursor: Optional[str] = None,
+    exact: bool = True,
+    fields: Optional[List[str]] = None,
+) -> Tuple[bytes, Optional[str], str]:
+    keyset, sort_by, after = product_crud._prepare_listing(sort_by, order, pagination, cursor)
+
+    async def load():
+        page = await _run_query(session, product_crud._query_listing, skip, limit, search, category, region,
+                                min_price, max_price, sort_by, order, keyset, after, fields)
+        counts = {"total": None, "total_is_estimate": False}
+        if not keyset:
+            counts = await count_products(session, search, category, region, min_price, max_price, exact=exact)
+        return _pack_body(cache_key, json_body({**counts, "items": page["items"], "next_cursor": page["next_cursor"]}))
+
+    try:
+        cache_key, tag_generations = await atagged_cache_key(
+            product_crud._listing_body_cache_base(exact, pagination, keyset, cursor, skip, limit, search, category,
+                                                  region, min_price, max_price, sort_by, order, fields),
+            listing_tags(category, region),
+        )
+        packed, source = await aget_or_load(cache_key, load, tag_generations=tag_generations, raw=True)
+        etag, body = _unpack_body(packed)
+        return body, etag, source
+
+    except Exception as e:
+        logger.error(f"Error fetching products: {e}")
+        return json_body({"total": 0, "total_is_estimate": False, "items": [], "next_cursor": None}), None, "miss"
+
+# A listing page as an Arrow record batch (column tuples straight from the
+# query, no per-row objects); totals and the cursor ride in the schema metadata.
+# Not cached: the pages are binary and analytics pulls rarely repeat.
+async def get_products_batch(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = None,
+    order: Optional[str] = "asc",
+    pagination: str = "offset",
+    cursor: Optional[str] = None,
+    exact: bool = True,
+    fields: Optional[List[str]] = None,
+):
+    keyset, sort_by, after = product_crud._prepare_listing(sort_by, order, pagination, cursor)
+    page = await session.run_sync(product_crud._query_listing_rows, skip, limit, search, category, region,
+                                  min_price, max_price, sort_by, order, keyset, after, fields)
+    counts = {"total": None, "total_is_estimate": False}
+    if not keyset:
+        counts = await count_products(session, search, category, region, min_price, max_price, exact=exact)
+    metadata = {**counts, "next_cursor": page["next_cursor"]}
+    return record_batch(page["columns"], page["rows"], metadata)
+
+# Dashboard aggregates for a filter set, cached until a product write touches it
+async def get_product_stats(
+    session: AsyncSession,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    bins: int = 20,
+    top: int = 5,
+) -> dict:
+    cache_key, tag_generations = await atagged_cache_key(
+        product_crud._stats_cache_base(search, category, region, min_price, max_price, bins, top),
+        listing_tags(category, region),
+    )
+    result, _ = await aget_or_load(
+        cache_key,
+        lambda: _run_query(session, product_crud._query_stats, search, category, region,
+                           min_price, max_price, bins, top),
+        tag_generations=tag_generations,
+    )
+    return result
+
+# Update product
+async def update_product(session: AsyncSession, product_id: int, product_data: dict) -> Optional[Product]:
+    try:
+        product = await session.get(Product, product_id)
+        if not product:
+            return None
+
+        before = product_crud._scope(product)
+        previous = {key: getattr(product, key) for key in product_data if hasattr(Product, key)}
+        for key, value in product_data.items():
+            if hasattr(Product, key):
+                setattr(product, key, value)
+
+        session.add(product)
+        await session.commit()
+        await anote_write()
+        await session.refresh(product)
+
+        await invalidate_product_caches(before, product_crud._scope(product))
+        await invalidate_product_entries([product_id])
+        trending.remember_scope(product.id, product.category, product.region)
+        await after_product_write([product])
+        await changes.apublish(changes.updated(product, previous))
+
+        return product
+    except IntegrityError:
+        # Renamed onto another product's (name, brand); the route answers 409
+        await session.rollback()
+        raise
+    except Exception as e:
+        logger.error(f"Error updating product {product_id}: {e}")
+        return None
+
+# Delete product
+async def delete_product(session: AsyncSession, product_id: int) -> bool:
+    try:
+        product = await session.get(Product, product_id)
+        if not product:
+            return False
+
+        scope = product_crud._scope(product)
+        deltas = changes.deleted(product)
+        await session.delete(product)
+        await session.commit()
+        await anote_write()
+
+        await invalidate_product_caches(scope)
+        await invalidate_product_entries([product_id])
+        await after_product_delete([product_id])
+        await changes.apublish(deltas)
+
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting product {product_id}: {e}")
+        return False
+
+# Conditional decrement: matches no row, so reserves nothing, if stock is short.
+# The check and the write are one statement, so concurrent buyers can't both
+# pass the check, and no row is locked for longer than the transaction's UPDATEs.
+_product = Product.__table__
+_reserve = (
+    update(_product)
+    .where(_product.c.id == bindparam("product_id"), _product.c.stock >= bindparam("quantity"))
+    .values(
+        stock=_product.c.stock - bindparam("quantity"),
+        purchase_count=_product.c.purchase_count + bindparam("quantity"),
+    )
+    .returning(_product.c.stock, _product.c.purchase_count, _product.c.updated_at)
+)
+
+# Reserve stock for {product id: quantity}, all or nothing, in one transaction.
+# Returns ([(id, quantity, stock left)], []) or, if nothing was reserved,
+# ([], [(id, requested, available or None if the product doesn't exist)]).
+async def reserve_stock(session: AsyncSession, lines: Dict[int, int]) -> Tuple[list, list]:
+    rows = []
+    try:
+        # Sorted ids give concurrent reservations the same lock order, so they queue rather than deadlock
+        for product_id in sorted(lines):
+            row = (await session.exec(_reserve, params={"product_id": product_id, "quantity": lines[product_id]})).first()
+            if row is None:
+                break
+            rows.append((product_id, lines[product_id], *row))
+        else:
+            await session.commit()
+            await anote_write()
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Error reserving stock for {len(lines)} products: {e}")
+        raise
+
+    if len(rows) < len(lines):
+        # Give back the lines already taken, then report every short line (no locks held)
+        await session.rollback()
+        available = dict((await session.exec(
+            select(Product.id, Product.stock).where(Product.id.in_(list(lines)))
+        )).all())
+        return [], [
+            (product_id, quantity, available.get(product_id))
+            for product_id, quantity in sorted(lines.items())
+            if available.get(product_id) is None or available[product_id] < quantity
+        ]
+
+    # Listings aren't invalidated: like counter flushes, only the per-product entries change
+    await invalidate_product_entries(list(lines))
+    # Not awaited: checkout shouldn't queue behind a bulk re-index
+    _update_indexes(recommend.update_stock, {product_id: stock for product_id, _, stock, _, _ in rows})
+    await changes.apublish(changes.reserved(rows))
+    for product_id, quantity, *_ in rows:
+        try:
+            await trending.record_counter(product_id, "purchase_count", quantity)
+        except Exception as e:
+            logger.warning(f"Failed to score purchase of product {product_id} on trending: {e}")
+
+    return [(product_id, quantity, stock) for product_id, quantity, stock, _, _ in rows], []
+
+# Top products by purchase count
+async def get_top_products_by_purchase_count(
+    session: AsyncSession,
+    limit: int = 10,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+) -> List[Product]:
+    try:
+        return (await session.exec(product_crud._top_purchase_statement(limit, category, region))).all()
+    except Exception as e:
+        logger.error(f"Error fetching top products by purchase count: {e}")
+        return []
+
+# Trending products: ranked from the leaderboards, hydrated from the database
+# and held briefly in the two-tier cache; returns (items, cache source)
+async def get_trending_products(
+    session: AsyncSession,
+    limit: int = 10,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    window: str = trending.DEFAULT_WINDOW,
+    fields: Optional[List[str]] = None,
+):
+    async def load():
+        ranked = await trending.atop_products(window, category, region, limit)
+        ranked_ids = [product_id for product_id, _ in ranked]
+        return await _run_query(session, product_crud._query_trending, limit, ranked_ids, category, region, fields)
+
+    cache_key, tag_generations = await atagged_cache_key(
+        product_crud._trending_cache_base(limit, category, region, window, fields), listing_tags(category, region)
+    )
+    return await aget_or_load(
+        cache_key, load,
+        expire_seconds=product_crud.TRENDING_CACHE_SECONDS,
+        tag_generations=tag_generations,
+        stale_seconds=product_crud.TRENDING_CACHE_SECONDS,
+    )
+
+# Suggestions for one or many products: {product id: [products]}, missing ids omitted
+async def get_suggestions(session: AsyncSession, product_ids: List[int], limit: int = 5,
+                          fields: Optional[List[str]] = None) -> dict:
+    try:
+        return await session.run_sync(product_crud._query_suggestions, product_ids, limit, fields=fields)
+    except Exception as e:
+        logger.error(f"Error fetching suggestions for {product_ids}: {e}")
+        raise
+
+# Free-text "need help choosing" recommendations
+async def recommend_products(session: AsyncSession, request) -> list:
+    try:
+        return await session.run_sync(
+            product_crud._query_recommendations, request.query, request.limit,
+            request.min_price, request.max_price, request.region, request.in_stock,
+        )
+    except Exception as e:
+        logger.error(f"Error recommending products for {request.query!r}: {e}")
+        raise
@@ -1,99 +1,141 @@
-import sys
 import os
 import logging
-import redis
 import json
+import base64
 import datetime
 from sqlmodel import Session, select
-from sqlalchemy import func, or_
-from app.models.product import Product, ProductCreate
+from sqlalchemy import Integer, and_, cast, func, or_
+from app.models.product import Product, ProductCreate, ProductRead
 from typing import List, Optional
-from urllib.parse import urlparse
-from app.db import engine
+from app.search import match_products
+from app import changes, recommend, suggestions, trending
+from app.db import fill_engine, note_write
+from app.cache import (
+    CACHE_EXPIRE,
+    EPOCH_TAG,
+    cache_delete_versioned,
+    cache_get_many,
+    cache_set_many_if_unchanged,
+    cache_versions,
+    get_or_load,
+    invalidate_tags,
+    json_body,
+    tagged_cache_key,
+)
 
 # Setup logger
 logger = logging.getLogger("product_crud")
 logger.setLevel(logging.INFO)
 
-# Redis Configuration
-redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
-parsed_url = urlparse(redis_url)
-REDIS_HOST = parsed_url.hostname
-REDIS_PORT = parsed_url.port or 6379
-REDIS_DB = int(parsed_url.path.lstrip("/")) if parsed_url.path else 0
-REDIS_PASSWORD = parsed_url.password
-
-try:
-    redis_client = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        db=REDIS_DB,
-        password=REDIS_PASSWORD,
-        decode_responses=True
-    )
-    redis_client.ping()
-except Exception as e:
-    logger.warning(f"Could not connect to Redis: {e}")
-    redis_client = None
-
-CACHE_EXPIRE = 300  # 5 minutes
-
-# Serialize datetime for caching
-def default_json_serializer(obj):
-    if isinstance(obj, (datetime.datetime, datetime.date)):
-        return obj.isoformat()
-    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
-
-# Redis Cache Helpers
-def cache_set(key: str, value: dict, expire_seconds: int = CACHE_EXPIRE):
-    if not redis_client:
+ALL_TAG = "all"  # Cache tag for listings without a category/region filter
+# Trending moves continuously, so its pages are only held briefly
+TRENDING_CACHE_SECONDS = int(os.getenv("TRENDING_CACHE_SECONDS", 10))
+# Columns a sparse fieldset (fields=) may name
+PRODUCT_FIELDS = list(ProductRead.model_fields)
+PRODUCT_CACHE_SECONDS = int(os.getenv("PRODUCT_CACHE_SECONDS", CACHE_EXPIRE))
+# Per-product entries are dropped on write, but only from this worker's local
+# tier; this bounds how long other workers can serve their old copy
+PRODUCT_LOCAL_CACHE_SECONDS = float(os.getenv("PRODUCT_LOCAL_CACHE_SECONDS", 1.0))
+
+def listing_tags(category: Optional[str] = None, region: Optional[str] = None) -> List[str]:
+    tags = []
+    if category:
+        tags.append(f"category:{category}")
+    if region:
+        tags.append(f"region:{region}")
+    return tags or [ALL_TAG]
+
+def product_tags(*products) -> List[str]:
+    tags = {ALL_TAG}
+    for product in products:
+        if product.get("category"):
+            tags.add(f"category:{product['category']}")
+        if product.get("region"):
+            tags.add(f"region:{product['region']}")
+    return sorted(tags)
+
+# Invalidate the cached listings a write can affect. Pass the product state
+# before and/or after the write; with no products every listing is dropped.
+def invalidate_product_caches(*products):
+    if not products:
+        invalidate_tags([EPOCH_TAG])
         return
-    try:
-        redis_client.set(key, json.dumps(value, default=default_json_serializer), ex=expire_seconds)
-    except Exception as e:
-        logger.warning(f"Redis cache set error for key {key}: {e}")
+    invalidate_tags(product_tags(*products))
 
-def cache_get(key: str):
-    if not redis_client:
-        return None
-    try:
-        data = redis_client.get(key)
-        if data:
-            return json.loads(data)
-    except Exception as e:
-        logger.warning(f"Redis cache get error for key {key}: {e}")
-    return None
+# Per-product cache entries, in a namespace folded with the epoch generation so
+# a catalogue-wide invalidation drops them too
+def _product_cache_keys(namespace: str, product_ids) -> dict:
+    return {product_id: f"{namespace}:{product_id}" for product_id in product_ids}
 
-def cache_delete(pattern: str):
-    if not redis_client:
-        return
-    try:
-        for key in redis_client.scan_iter(pattern):
-            redis_client.delete(key)
-    except Exception as e:
-        logger.warning(f"Redis cache delete error for pattern {pattern}: {e}")
+def product_cache_keys(product_ids) -> dict:
+    namespace, _ = tagged_cache_key("product", [])
+    return _product_cache_keys(namespace, product_ids)
+
+def invalidate_product_entries(product_ids):
+    cache_delete_versioned(list(product_cache_keys(product_ids).values()))
+
+def _scope(product) -> dict:
+    return {"category": product.category, "region": product.region}
+
+def _to_product(product_create: ProductCreate) -> Product:
+    return Product(**{
+        key: value for key, value in product_create.dict().items()
+        if hasattr(Product, key) and value is not None
+    })
+
+# Keep this worker's in-process indexes in step with its writes
+def _after_product_write(products):
+    suggestions.index_products(products)
+    recommend.index_products(products)
+
+def _after_product_delete(product_ids):
+    suggestions.remove_products(product_ids)
+    recommend.remove_products(product_ids)
+
+def _batch_scopes(products) -> list:
+    # One scope per distinct (category, region) in a batch
+    return list({(product.category, product.region): _scope(product) for product in products}.values())
 
 # Create a product
 def create_product(product_create: ProductCreate, db: Session) -> Product:
     try:
-        product_data = {
-            key: value for key, value in product_create.dict().items()
-            if hasattr(Product, key) and value is not None
-        }
-        product = Product(**product_data)
+        product = _to_product(product_create)
         db.add(product)
         db.commit()
+        note_write()
         db.refresh(product)
 
-        # Invalidate cache
-        cache_delete("products_list*")
-        cache_delete("trending_products")
+        invalidate_product_caches(_scope(product))
+        _after_product_write([product])
+        changes.publish(changes.created([product]))
 
         return product
     except Exception as e:
         logger.error(f"Error creating product: {e}")
         raise
 
+# Create many products in one transaction
+def create_products(products_create: List[ProductCreate], db: Session) -> List[Product]:
+    try:
+        products = [_to_product(product_create) for product_create in products_create]
+        if not products:
+            return []
+
+        db.add_all(products)
+        db.commit()
+        note_write()
+
+        # One invalidation for the whole batch
+        invalidate_product_caches(*_batch_scopes(products))
+        _after_product_write(products)
+        changes.publish(changes.created(products))
+
+        return products
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error bulk creating {len(products_create)} products: {e}")
+        raise
+
 # Get a single product
 def get_product(session: Session, product_id: int) -> Optional[Product]:
     try:
@@ -102,6 +144,344 @@ def get_product(session: Session, product_id: int) -> Optional[Product]:
         logger.error(f"Error fetching product {product_id}: {e}")
         return None
 
+# Keyset pagination cursors
+CURSOR_SORT_FIELDS = ["price", "created_at", "name", "id"]
+
+def encode_cursor(sort_by: str, order: str, value, last_id: int) -> str:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    payload = json.dumps([sort_by, order, value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_by: str, order: str):
+    """Return (value, last_id) from a cursor, or raise ValueError if it doesn't fit this query."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if cursor_sort != sort_by or cursor_order != order or not isinstance(last_id, int):
+        raise ValueError("Cursor does not match sort_by/order")
+    if sort_by == "created_at":
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError("Malformed cursor")
+    return value, last_id
+
+# Filtered SELECT shared by listing and counting; returns (statement, search matches)
+def _filtered_statement(
+    session: Session,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+):
+    filters = []
+    if category:
+        filters.append(Product.category == category)
+    if region:
+        filters.append(Product.region == region)
+    if min_price is not None:
+        filters.append(Product.price >= min_price)
+    if max_price is not None:
+        filters.append(Product.price <= max_price)
+
+    statement = select(Product).where(*filters)
+
+    matches = None
+    if search:
+        # Join against the text index instead of LIKE-scanning four columns
+        matches = match_products(session, search)
+        statement = statement.join(matches, matches.c.id == Product.id)
+
+    return statement, matches
+
+# ----------------------------------
+# Read queries. These take a sync Session and return plain, cacheable data so
+# the same code serves the sync API and, through AsyncSession.run_sync, the
+# async one.
+# ----------------------------------
+def _select_tuples(session: Session, statement, fields: List[str]) -> list:
+    """Rows of a select(Product) statement narrowed to fields, as plain column tuples."""
+    statement = statement.with_only_columns(*[getattr(Product, name) for name in fields], maintain_column_froms=True)
+    return session.execute(statement).all()
+
+def _select_rows(session: Session, statement, fields: Optional[List[str]] = None) -> list:
+    """Rows of a select(Product) statement as dicts; with fields, only those columns are SELECTed."""
+    if fields is None:
+        return [product.dict() for product in session.exec(statement).all()]
+    return [dict(row._mapping) for row in _select_tuples(session, statement, fields)]
+
+def _export_statement(session: Session, search, category, region, min_price, max_price, fields=None):
+    """Filtered SELECT of plain columns (no ORM objects) in id order, for streaming."""
+    statement, _ = _filtered_statement(session, search, category, region, min_price, max_price)
+    columns = [getattr(Product, name) for name in fields or PRODUCT_FIELDS]
+    return statement.with_only_columns(*columns, maintain_column_froms=True).order_by(Product.id)
+
+def _fields_key(fields: Optional[List[str]]) -> str:
+    return ",".join(fields) if fields else "*"
+
+def _facets_statement():
+    return select(Product.category, Product.region, func.count()).group_by(Product.category, Product.region)
+
+def _query_facets(session: Session) -> list:
+    rows = session.exec(_facets_statement()).all()
+    return [[category, region, count] for category, region, count in rows]
+
+def _driver_sql(session: Session, statement):
+    """(sql, params) for a statement, ready for exec_driver_sql with an EXPLAIN prefix."""
+    compiled = statement.compile(dialect=session.get_bind().dialect)
+    params = (
+        tuple(compiled.params[name] for name in compiled.positiontup)
+        if compiled.positional else compiled.params
+    )
+    return str(compiled), params
+
+def _estimated_count(session: Session, statement) -> Optional[int]:
+    """Planner row estimate for a statement (PostgreSQL only)."""
+    if session.get_bind().dialect.name != "postgresql":
+        return None
+    sql, params = _driver_sql(session, statement)
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def _query_count(session: Session, search, category, region, min_price, max_price, exact) -> dict:
+    statement, _ = _filtered_statement(session, search, category, region, min_price, max_price)
+    total = _estimated_count(session, statement) if not exact else None
+    if total is not None:
+        return {"total": total, "total_is_estimate": True}
+
+    total = session.exec(
+        statement.with_only_columns(func.count(), maintain_column_froms=True).order_by(None)
+    ).first() or 0
+    return {"total": total, "total_is_estimate": False}
+
+def _counts_from_facets(search, min_price, max_price, exact) -> bool:
+    # Category/region-only filters can be answered from the facet counters
+    return not exact and not search and min_price is None and max_price is None
+
+def _sum_facets(facets: list, category, region) -> dict:
+    total = sum(
+        count for facet_category, facet_region, count in facets
+        if (not category or facet_category == category)
+        and (not region or facet_region == region)
+    )
+    return {"total": total, "total_is_estimate": False}
+
+def _prepare_listing(sort_by, order, pagination, cursor):
+    """Validate paging options up front so a bad cursor surfaces as a client error.
+
+    Returns (keyset, sort_by, after).
+    """
+    if pagination != "cursor":
+        return False, sort_by, None
+    if sort_by == "relevance":
+        raise ValueError("Cursor pagination does not support sort_by=relevance")
+    sort_by = sort_by or "id"
+    return True, sort_by, (decode_cursor(cursor, sort_by, order) if cursor else None)
+
+def _listing_statement(session: Session, skip, limit, search, category, region, min_price, max_price,
+                       sort_by, order, keyset, after):
+    statement, matches = _filtered_statement(session, search, category, region, min_price, max_price)
+
+    # Sorting, always tie-broken on id so pages are stable
+    descending = order == "desc"
+    id_order = Product.id.desc() if descending else Product.id.asc()
+    sort_col = None
+    if sort_by == "relevance" and matches is not None:
+        statement = statement.order_by(matches.c.rank.desc(), Product.id.asc())
+    elif sort_by in CURSOR_SORT_FIELDS and sort_by != "id":
+        sort_col = getattr(Product, sort_by)
+        statement = statement.order_by(sort_col.desc() if descending else sort_col.asc(), id_order)
+    elif keyset or sort_by == "id":
+        statement = statement.order_by(id_order)
+    else:
+        statement = statement.order_by(Product.id.asc())
+
+    # Pagination
+    if keyset:
+        if after is not None:
+            value, last_id = after
+            id_after = Product.id < last_id if descending else Product.id > last_id
+            if sort_col is None:
+                statement = statement.where(id_after)
+            else:
+                col_after = sort_col < value if descending else sort_col > value
+                statement = statement.where(or_(col_after, and_(sort_col == value, id_after)))
+        # Fetch one extra row to learn whether another page exists
+        statement = statement.limit(limit + 1)
+    else:
+        statement = statement.offset(skip).limit(limit)
+
+    return statement
+
+def _query_listing_rows(session: Session, skip, limit, search, category, region, min_price, max_price,
+                        sort_by, order, keyset, after, fields=None) -> dict:
+    """A listing page as column tuples (no ORM objects or dicts), for columnar responses."""
+    columns = fields or PRODUCT_FIELDS
+    # The cursor needs the sort value of the last row even if the client didn't ask for it
+    selected = columns
+    if keyset and sort_by not in columns:
+        selected = columns + [sort_by]
+    rows = _select_tuples(session, _listing_statement(
+        session, skip, limit, search, category, region, min_price, max_price, sort_by, order, keyset, after
+    ), selected)
+
+    next_cursor = None
+    if keyset and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor(sort_by, order, last[sort_by], last["id"])
+    if selected is not columns:
+        rows = [row[:len(columns)] for row in rows]
+
+    return {
+        "columns": columns,
+        "rows": rows,
+        "next_cursor": next_cursor,
+    }
+
+def _query_listing(session: Session, skip, limit, search, category, region, min_price, max_price,
+                   sort_by, order, keyset, after, fields=None) -> dict:
+    page = _query_listing_rows(session, skip, limit, search, category, region, min_price, max_price,
+                               sort_by, order, keyset, after, fields)
+    return {
+        "items": [dict(zip(page["columns"], row)) for row in page["rows"]],
+        "next_cursor": page["next_cursor"],
+    }
+
+def _query_products_by_ids(session: Session, ids: List[int], fields=None) -> list:
+    """Products for ids, in the order given; missing ids are dropped."""
+    products = {item["id"]: item for item in _select_rows(session, select(Product).where(Product.id.in_(ids)), fields)}
+    return [products[product_id] for product_id in ids if product_id in products]
+
+def _query_product_bodies(session: Session, ids: List[int]) -> dict:
+    """{id: product JSON body} for the ids that exist, from one IN query."""
+    return {item["id"]: json_body(item) for item in _query_products_by_ids(session, ids)}
+
+def _query_product(session: Session, product_id: int, fields=None) -> Optional[dict]:
+    items = _select_rows(session, select(Product).where(Product.id == product_id), fields)
+    return items[0] if items else None
+
+def _query_trending(session: Session, limit: int, ranked_ids: List[int],
+                    category: Optional[str] = None, region: Optional[str] = None, fields=None) -> list:
+    items = _query_products_by_ids(session, ranked_ids, fields) if ranked_ids else []
+    if len(items) < limit:
+        # Not enough recent activity in this scope yet; top up with all-time best sellers
+        seen = {item["id"] for item in items}
+        for item in _select_rows(session, _top_purchase_statement(limit + len(seen), category, region), fields):
+            if len(items) == limit:
+                break
+            if item["id"] not in seen:
+                items.append(item)
+    return items
+
+def _query_stats(session: Session, search, category, region, min_price, max_price,
+                 bins: int = 20, top: int = 5) -> dict:
+    """Dashboard aggregates for a filter set, computed in the database."""
+    statement, _ = _filtered_statement(session, search, category, region, min_price, max_price)
+
+    def aggregate(*columns):
+        return statement.with_only_columns(*columns, maintain_column_froms=True)
+
+    total, average_price, average_rating, rated, total_stock, low, high = session.execute(aggregate(
+        func.count(), func.avg(Product.price), func.avg(Product.rating), func.count(Product.rating),
+        func.sum(Product.stock), func.min(Product.price), func.max(Product.price),
+    )).one()
+
+    categories = session.execute(
+        aggregate(Product.category, func.count()).group_by(Product.category).order_by(func.count().desc())
+    ).all()
+
+    # Equal-width buckets between the min and max price; the max lands in the last one
+    histogram = []
+    if total:
+        width = (high - low) / bins or 1.0
+        bucket = cast(func.floor((Product.price - low) / width), Integer)
+        counts = [0] * bins
+        for index, count in session.execute(aggregate(bucket, func.count()).group_by(bucket)).all():
+            counts[min(index, bins - 1)] += count
+        histogram = [
+            {"min": low + index * width, "max": low + (index + 1) * width, "count": count}
+            for index, count in enumerate(counts)
+        ]
+
+    top_rated = session.exec(
+        statement.where(Product.rating.is_not(None)).order_by(Product.rating.desc(), Product.id.asc()).limit(top)
+    ).all()
+
+    return {
+        "total": total,
+        "average_price": average_price,
+        "average_rating": average_rating,
+        "rated": rated,
+        "total_stock": total_stock or 0,
+        "categories": [{"category": category, "count": count} for category, count in categories],
+        "price_histogram": histogram,
+        "top_rated": [product.dict() for product in top_rated],
+    }
+
+# Cache key bases; totals are cached apart from pages so every page shares them
+def _count_cache_base(search, category, region, min_price, max_price, exact) -> str:
+    return f"products_count:{exact}:{search}:{category}:{region}:{min_price}:{max_price}"
+
+def _listing_cache_base(pagination, keyset, cursor, skip, limit, search, category, region,
+                        min_price, max_price, sort_by, order, fields=None) -> str:
+    return f"products_list:{pagination}:{cursor if keyset else skip}:{limit}:{search}:{category}:{region}:{min_price}:{max_price}:{sort_by}:{order}:{_fields_key(fields)}"
+
+def _listing_body_cache_base(exact, *listing) -> str:
+    return f"products_body:{exact}:{_listing_cache_base(*listing)}"
+
+def _stats_cache_base(search, category, region, min_price, max_price, bins, top) -> str:
+    return f"products_stats:{bins}:{top}:{search}:{category}:{region}:{min_price}:{max_price}"
+
+# ----------------------------------
+# Cached reads (sync)
+# ----------------------------------
+# Loaders open their own session: get_or_load may rerun them in a background
+# thread to refresh a stale entry after the request's session has closed.
+def _facet_counts(session: Session) -> list:
+    """[category, region, count] rows, kept in cache until the next product write."""
+    bind = session.get_bind()
+
+    def load():
+        with Session(fill_engine(bind)) as load_session:
+            return _query_facets(load_session)
+
+    cache_key, tag_generations = tagged_cache_key("products_facets", [ALL_TAG])
+    facets, _ = get_or_load(cache_key, load, tag_generations=tag_generations)
+    return facets
+
+# Count products for a filter set; cached per filter set so every page shares it
+def count_products(
+    session: Session,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    exact: bool = True,
+) -> dict:
+    if _counts_from_facets(search, min_price, max_price, exact):
+        return _sum_facets(_facet_counts(session), category, region)
+
+    bind = session.get_bind()
+
+    def load():
+        with Session(fill_engine(bind)) as load_session:
+            return _query_count(load_session, search, category, region, min_price, max_price, exact)
+
+    cache_key, tag_generations = tagged_cache_key(
+        _count_cache_base(search, category, region, min_price, max_price, exact),
+        listing_tags(category, region),
+    )
+    result, _ = get_or_load(cache_key, load, tag_generations=tag_generations)
+    return result
+
 # Get multiple products with filters, sort, pagination and caching
 def get_products(
     session: Session,
@@ -113,64 +493,80 @@ def get_products(
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     sort_by: Optional[str] = None,
-    order: Optional[str] = "asc"
+    order: Optional[str] = "asc",
+    pagination: str = "offset",
+    cursor: Optional[str] = None,
+    exact: bool = True,
+    fields: Optional[List[str]] = None,
 ) -> dict:
-    try:
-        # Build cache key
-        cache_key = f"products_list:{skip}:{limit}:{search}:{category}:{region}:{min_price}:{max_price}:{sort_by}:{order}"
-        cached = cache_get(cache_key)
-        if cached:
-            return cached
-
-        filters = []
-        if search:
-            term = f"%{search.lower()}%"
-            filters.append(or_(
-                func.lower(Product.name).like(term),
-                func.lower(Product.brand).like(term),
-                func.lower(Product.description).like(term),
-                func.lower(Product.tags).like(term),
-            ))
-        if category:
-            filters.append(Product.category == category)
-        if region:
-            filters.append(Product.region == region)
-        if min_price is not None:
-            filters.append(Product.price >= min_price)
-        if max_price is not None:
-            filters.append(Product.price <= max_price)
-
-        statement = select(Product).where(*filters)
-
-        # Total count
-        total = session.exec(
-            statement.with_only_columns(func.count()).order_by(None)
-        ).first() or 0
-
-        # Sorting
-        if sort_by in ["price", "created_at", "name"]:
-            sort_col = getattr(Product, sort_by)
-            statement = statement.order_by(sort_col.desc() if order == "desc" else sort_col.asc())
-        else:
-            statement = statement.order_by(Product.id.asc())
+    keyset, sort_by, after = _prepare_listing(sort_by, order, pagination, cursor)
 
-        # Pagination
-        statement = statement.offset(skip).limit(limit)
+    try:
+        bind = session.get_bind()
 
-        products = session.exec(statement).all()
+        def load():
+            with Session(fill_engine(bind)) as load_session:
+                return _query_listing(load_session, skip, limit, search, category, region,
+                                      min_price, max_price, sort_by, order, keyset, after, fields)
 
-        result = {
-            "total": total,
-            "items": [product.dict() for product in products]
-        }
+        cache_key, tag_generations = tagged_cache_key(
+            _listing_cache_base(pagination, keyset, cursor, skip, limit, search, category, region,
+                                min_price, max_price, sort_by, order, fields),
+            listing_tags(category, region),
+        )
+        result, _ = get_or_load(cache_key, load, tag_generations=tag_generations)
 
-        cache_set(cache_key, result)
-        return result
+        # Total count (skipped in cursor mode, where pages must stay constant-time)
+        if keyset:
+            return {**result, "total": None}
+        return {**result, **count_products(session, search, category, region, min_price, max_price, exact=exact)}
 
     except Exception as e:
         logger.error(f"Error fetching products: {e}")
         return {"total": 0, "items": []}
 
+# Dashboard aggregates for a filter set, cached until a product write touches it
+def get_product_stats(
+    session: Session,
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    bins: int = 20,
+    top: int = 5,
+) -> dict:
+    bind = session.get_bind()
+
+    def load():
+        with Session(fill_engine(bind)) as load_session:
+            return _query_stats(load_session, search, category, region, min_price, max_price, bins, top)
+
+    cache_key, tag_generations = tagged_cache_key(
+        _stats_cache_base(search, category, region, min_price, max_price, bins, top),
+        listing_tags(category, region),
+    )
+    result, _ = get_or_load(cache_key, load, tag_generations=tag_generations)
+    return result
+
+# Products by id as JSON bodies, read through the per-product cache: one MGET,
+# one IN query for the misses, one pipelined write-back. Missing ids are omitted.
+def get_product_bodies(session: Session, product_ids: List[int]) -> dict:
+    keys = product_cache_keys(product_ids)
+    found = cache_get_many(list(keys.values()), raw=True, local_ttl=PRODUCT_LOCAL_CACHE_SECONDS)
+    bodies = {product_id: found[key] for product_id, key in keys.items() if key in found}
+
+    missing = [product_id for product_id in product_ids if product_id not in bodies]
+    if missing:
+        # Versions are read before the query so a write racing with it drops our copy
+        versions = cache_versions([keys[product_id] for product_id in missing])
+        with Session(fill_engine(session.get_bind())) as load_session:
+            loaded = _query_product_bodies(load_session, missing)
+        cache_set_many_if_unchanged({keys[product_id]: body for product_id, body in loaded.items()}, versions,
+                                    PRODUCT_CACHE_SECONDS, raw=True, local_ttl=PRODUCT_LOCAL_CACHE_SECONDS)
+        bodies.update(loaded)
+    return bodies
+
 # Update product
 def update_product(session: Session, product_id: int, product_data: dict) -> Optional[Product]:
     try:
@@ -178,16 +574,22 @@ def update_product(session: Session, product_id: int, product_data: dict) -> Opt
         if not product:
             return None
 
+        before = _scope(product)
+        previous = {key: getattr(product, key) for key in product_data if hasattr(Product, key)}
         for key, value in product_data.items():
             if hasattr(Product, key):
                 setattr(product, key, value)
 
         session.add(product)
         session.commit()
+        note_write()
         session.refresh(product)
 
-        cache_delete("products_list*")
-        cache_delete("trending_products")
+        invalidate_product_caches(before, _scope(product))
+        invalidate_product_entries([product_id])
+        trending.remember_scope(product.id, product.category, product.region)
+        _after_product_write([product])
+        changes.publish(changes.updated(product, previous))
 
         return product
     except Exception as e:
@@ -201,11 +603,16 @@ def delete_product(session: Session, product_id: int) -> bool:
         if not product:
             return False
 
+        scope = _scope(product)
+        deltas = changes.deleted(product)
         session.delete(product)
         session.commit()
+        note_write()
 
-        cache_delete("products_list*")
-        cache_delete("trending_products")
+        invalidate_product_caches(scope)
+        invalidate_product_entries([product_id])
+        _after_product_delete([product_id])
+        changes.publish(deltas)
 
         return True
     except Exception as e:
@@ -213,39 +620,132 @@ def delete_product(session: Session, product_id: int) -> bool:
         return False
 
 # Top products by purchase count
-def get_top_products_by_purchase_count(session: Session, limit: int = 10) -> List[Product]:
+def _top_purchase_statement(limit: int, category: Optional[str] = None, region: Optional[str] = None):
+    statement = select(Product)
+    if category:
+        statement = statement.where(Product.category == category)
+    if region:
+        statement = statement.where(Product.region == region)
+    # Both keys descending so ix_product_purchase_count can be walked backwards
+    return statement.order_by(Product.purchase_count.desc(), Product.id.desc()).limit(limit)
+
+def get_top_products_by_purchase_count(
+    session: Session,
+    limit: int = 10,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+) -> List[Product]:
     try:
-        statement = select(Product).order_by(Product.purchase_count.desc()).limit(limit)
-        return session.exec(statement).all()
+        return session.exec(_top_purchase_statement(limit, category, region)).all()
     except Exception as e:
         logger.error(f"Error fetching top products by purchase count: {e}")
         return []
 
+def _trending_cache_base(limit, category, region, window, fields=None) -> str:
+    return f"trending_products:{window}:{category}:{region}:{limit}:{_fields_key(fields)}"
+
+# Trending products: ranked from the leaderboards, hydrated from the database
+# and held briefly in the two-tier cache; returns (items, cache source)
+def get_trending_products(
+    session: Session,
+    limit: int = 10,
+    category: Optional[str] = None,
+    region: Optional[str] = None,
+    window: str = trending.DEFAULT_WINDOW,
+    fields: Optional[List[str]] = None,
+):
+    bind = session.get_bind()
+
+    def load():
+        ranked_ids = [product_id for product_id, _ in trending.top_products(window, category, region, limit)]
+        with Session(fill_engine(bind)) as load_session:
+            return _query_trending(load_session, limit, ranked_ids, category, region, fields)
+
+    cache_key, tag_generations = tagged_cache_key(
+        _trending_cache_base(limit, category, region, window, fields), listing_tags(category, region)
+    )
+    return get_or_load(
+        cache_key, load,
+        expire_seconds=TRENDING_CACHE_SECONDS,
+        tag_generations=tag_generations,
+        stale_seconds=TRENDING_CACHE_SECONDS,
+    )
+
 # Suggest products based on category and price range
+def _suggest_statement(product: Product, price_range: float, limit: int):
+    min_price = max(0, product.price - price_range)
+    max_price = product.price + price_range
+    return (
+        select(Product)
+        .where(Product.category == product.category)
+        .where(Product.id != product.id)
+        .where(Product.price.between(min_price, max_price))
+        .order_by(Product.rating.desc())
+        .limit(limit)
+    )
+
+def _query_suggestions(session: Session, product_ids: List[int], limit: int, price_range: float = 500,
+                       fields=None) -> dict:
+    """{product id: [suggested product dicts]} for the ids that exist.
+
+    Neighbours come from the precomputed index; products it can't answer for
+    (not indexed yet) fall back to the category/price-band query. All
+    suggested products are then fetched in one IN query.
+    """
+    ranked = {}
+    unindexed = []
+    for product_id in product_ids:
+        neighbour_ids = suggestions.neighbours(product_id, limit)
+        if neighbour_ids is None:
+            unindexed.append(product_id)
+        else:
+            ranked[product_id] = neighbour_ids
+
+    if unindexed:
+        for product in session.exec(select(Product).where(Product.id.in_(unindexed))).all():
+            if product.category is None or product.price is None:
+                ranked[product.id] = []
+            else:
+                ranked[product.id] = [match.id for match in session.exec(_suggest_statement(product, price_range, limit)).all()]
+
+    # The requested ids ride along so products deleted since indexing are dropped
+    wanted = set(ranked)
+    for neighbour_ids in ranked.values():
+        wanted.update(neighbour_ids)
+    products = {item["id"]: item for item in _query_products_by_ids(session, list(wanted), fields)}
+    return {
+        product_id: [products[neighbour_id] for neighbour_id in neighbour_ids if neighbour_id in products]
+        for product_id, neighbour_ids in ranked.items()
+        if product_id in products
+    }
+
+def _query_recommendations(session: Session, query: str, limit: int, min_price=None, max_price=None,
+                           region=None, in_stock=False) -> list:
+    """Products matching a free-text need, best first, each with its relevance score."""
+    if not query.strip():
+        return []
+    ranked = recommend.recommend(
+        query, limit, min_price=min_price, max_price=max_price, region=region, in_stock=in_stock
+    )
+    if ranked is None:
+        # Index still building: fall back to the database text search
+        statement, matches = _filtered_statement(session, query, None, region, min_price, max_price)
+        if in_stock:
+            statement = statement.where(Product.stock > 0)
+        rows = session.exec(statement.add_columns(matches.c.rank).order_by(matches.c.rank.desc()).limit(limit)).all()
+        return [{**product.dict(), "score": float(rank)} for product, rank in rows]
+
+    products = {item["id"]: item for item in _query_products_by_ids(session, [product_id for product_id, _ in ranked])}
+    return [{**products[product_id], "score": score} for product_id, score in ranked if product_id in products]
+
 def suggest_products(
     session: Session,
     product_id: int,
     price_range: float = 500,
     limit: int = 5
-) -> List[Product]:
+) -> list:
     try:
-        product = session.get(Product, product_id)
-        if not product or product.category is None or product.price is None:
-            return []
-
-        min_price = max(0, product.price - price_range)
-        max_price = product.price + price_range
-
-        statement = (
-            select(Product)
-            .where(Product.category == product.category)
-            .where(Product.id != product_id)
-            .where(Product.price.between(min_price, max_price))
-            .order_by(Product.rating.desc())
-            .limit(limit)
-        )
-
-        return session.exec(statement).all()
+        return _query_suggestions(session, [product_id], limit, price_range).get(product_id, [])
     except Exception as e:
         logger.error(f"Error in suggest_products: {e}")
         return []
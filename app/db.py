@@ -1,13 +1,145 @@
 import os
+import time
+import itertools
+from typing import Optional
 from dotenv import load_dotenv
-from sqlmodel import create_engine, Session, SQLModel
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.cache import aredis_call, redis_call
 
 load_dotenv()  # Loads variables from .env file
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional comma-separated replicas; reads are spread over them round-robin
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
 
-engine = create_engine(DATABASE_URL, echo=True)
+# Engine tuning
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# After a write, this worker reads from the primary for this long to hide replica lag
+DB_REPLICA_LAG_SECONDS = float(os.getenv("DB_REPLICA_LAG_SECONDS", 2))
 
+# Async drivers for the sync URLs we accept
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+def engine_options(url: str) -> dict:
+    """create_engine/create_async_engine keyword arguments for a URL, from the environment."""
+    options = {
+        "echo": SQL_ECHO,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if url.startswith("sqlite"):
+        return options
+
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if DB_STATEMENT_TIMEOUT_MS:
+        if "+asyncpg" in url:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def make_engine(url: str):
+    return create_engine(url, **engine_options(url))
+
+def make_async_engine(url: str):
+    return create_async_engine(url, **engine_options(url))
+
+engine = make_engine(DATABASE_URL)
+async_engine = make_async_engine(ASYNC_DATABASE_URL)
+
+read_engines = [make_engine(url) for url in DATABASE_READ_URLS] or [engine]
+async_read_engines = [make_async_engine(async_database_url(url)) for url in DATABASE_READ_URLS] or [async_engine]
+
+_read_counter = itertools.count()
+_last_write = float("-inf")
+
+# Wall-clock time of the latest write by any worker, shared through Redis so a
+# worker filling the shared cache doesn't store a lagging replica's rows
+LAST_WRITE_KEY = "db:last_write"
+_LAST_WRITE_TTL = max(1, int(DB_REPLICA_LAG_SECONDS) + 1)
+
+def note_write():
+    global _last_write
+    _last_write = time.monotonic()
+    redis_call("note write", lambda client: client.set(LAST_WRITE_KEY, time.time(), ex=_LAST_WRITE_TTL))
+
+async def anote_write():
+    global _last_write
+    _last_write = time.monotonic()
+    await aredis_call("note write", lambda client: client.set(LAST_WRITE_KEY, time.time(), ex=_LAST_WRITE_TTL))
+
+def _recently_written(last_write) -> bool:
+    return last_write is not None and time.time() - float(last_write) < DB_REPLICA_LAG_SECONDS
+
+def _read_index() -> Optional[int]:
+    """Next replica index, or None to read from the primary."""
+    if not DATABASE_READ_URLS or time.monotonic() - _last_write < DB_REPLICA_LAG_SECONDS:
+        return None
+    return next(_read_counter) % len(DATABASE_READ_URLS)
+
+def read_engine():
+    index = _read_index()
+    return engine if index is None else read_engines[index]
+
+def async_read_engine():
+    index = _read_index()
+    return async_engine if index is None else async_read_engines[index]
+
+# For loaders whose result goes into the shared cache: the replica they were
+# given, or the primary while another worker's write may still be replicating
+def fill_engine(bind):
+    if bind is engine:
+        return bind
+    if not _recently_written(redis_call("last write", lambda client: client.get(LAST_WRITE_KEY))):
+        return bind
+    return engine
+
+async def afill_engine(bind):
+    if bind is async_engine:
+        return bind
+    if not _recently_written(await aredis_call("last write", lambda client: client.get(LAST_WRITE_KEY))):
+        return bind
+    return async_engine
+
+# Sessions on the primary; use these for anything that writes
 def get_session():
     with Session(engine) as session:
         yield session
+    note_write()
+
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+    await anote_write()
+
+# Sessions on a replica (or the primary when none are configured)
+def get_read_session():
+    with Session(read_engine()) as session:
+        yield session
+
+async def get_async_read_session():
+    async with AsyncSession(async_read_engine(), expire_on_commit=False) as session:
+        yield session
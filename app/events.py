@@ -0,0 +1,253 @@
+# app/events.py
+#
+# Buffered view/purchase counters. Routes only HINCRBY a Redis hash (or bump
+# an in-process Counter while Redis is unavailable); a background task folds
+# the buffered counts into the product table every EVENT_FLUSH_INTERVAL
+# seconds with one batched `UPDATE ... SET x = x + n` per product.
+#
+# Redis counts are accounted at least once: the pending hash is RENAMEd to a
+# processing hash before it is applied and only deleted after the database
+# commit, so a crash in between replays (never drops) that batch. Counts held
+# in the in-process fallback are lost if the worker dies before a flush.
+# A row the database refuses as bad data (an id or total out of the column's
+# range) is set aside in the rejected hash rather than failing every later
+# flush; any other error retries the whole batch.
+#
+# Each event also scores the product on the trending leaderboards, and each
+# flush drops the per-product cache entries of the products it touched and
+# publishes the applied counts on the change feed (app/changes.py).
+
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from collections import Counter
+from sqlalchemy import bindparam, exc, update
+from app import changes, trending
+from app.cache import aredis_call
+from app.crud import async_product_crud
+from app.db import anote_write, async_engine
+from app.models.product import Product
+
+try:
+    from asyncpg.exceptions import DataError as _ServerDataError
+    from asyncpg.exceptions._base import DataError as _ClientDataError
+    _ASYNCPG_DATA_ERRORS = (_ServerDataError, _ClientDataError)
+except ImportError:  # SQLite-only installs
+    _ASYNCPG_DATA_ERRORS = ()
+
+logger = logging.getLogger("events")
+logger.setLevel(logging.INFO)
+
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", 1.0))
+EVENT_FLUSH_BATCH = int(os.getenv("EVENT_FLUSH_BATCH", 1000))
+# Lease on the flush lock; a crashed flusher's batch is picked up after this
+EVENT_FLUSH_LOCK_SECONDS = int(os.getenv("EVENT_FLUSH_LOCK_SECONDS", 30))
+
+PENDING_KEY = "product_events:pending"
+PROCESSING_KEY = "product_events:processing"
+FLUSH_LOCK_KEY = "product_events:flush_lock"
+REJECTED_KEY = "product_events:rejected"
+
+# product.id is a 32-bit integer column
+MAX_PRODUCT_ID = 2 ** 31 - 1
+# Largest quantity one purchase event may add
+MAX_EVENT_QUANTITY = int(os.getenv("MAX_EVENT_QUANTITY", 1000))
+
+# Counter columns that events may bump
+COUNTER_COLUMNS = ("views", "purchase_count")
+
+_local_counts = Counter()
+_local_lock = threading.Lock()
+_flusher = None
+
+def _field(product_id: int, column: str) -> str:
+    return f"{column}:{product_id}"
+
+def _parse_counts(raw: dict) -> Counter:
+    counts = Counter()
+    for field, value in raw.items():
+        column, _, product_id = field.partition(":")
+        if column in COUNTER_COLUMNS and product_id.isdigit():
+            counts[(int(product_id), column)] += int(value)
+    return counts
+
+# ----------------------------------
+# Recording
+# ----------------------------------
+async def record_event(product_id: int, column: str, amount: int = 1):
+    """Buffer `amount` for product_id's counter column; applied on the next flush."""
+    if column not in COUNTER_COLUMNS:
+        raise ValueError(f"Unknown counter column: {column}")
+
+    recorded = await aredis_call(
+        f"record {column} for {product_id}",
+        lambda client: client.hincrby(PENDING_KEY, _field(product_id, column), amount),
+    )
+    if recorded is None:
+        with _local_lock:
+            _local_counts[(product_id, column)] += amount
+
+    try:
+        await trending.record_counter(product_id, column, amount)
+    except Exception as e:
+        logger.warning(f"Failed to score {column} for product {product_id} on trending: {e}")
+
+# ----------------------------------
+# Flushing
+# ----------------------------------
+_increment = (
+    update(Product.__table__)
+    .where(Product.__table__.c.id == bindparam("product_id"))
+    .values(
+        views=Product.__table__.c.views + bindparam("add_views"),
+        purchase_count=Product.__table__.c.purchase_count + bindparam("add_purchase_count"),
+        # Counters aren't edits: keep the onupdate hook from moving updated_at (and with it the ETag)
+        updated_at=Product.__table__.c.updated_at,
+    )
+)
+
+def _rejected_row(error: Exception) -> bool:
+    """Whether a failed increment is down to the row's values; anything else is retried."""
+    # SQLite raises "Python int too large" as a bare OverflowError
+    if isinstance(error, (exc.DataError, OverflowError)):
+        return True
+    # asyncpg's errors arrive as generic DBAPI errors with the original as the cause:
+    # its client-side "out of int32 range" even comes through as an InterfaceError
+    cause = getattr(getattr(error, "orig", None), "__cause__", None)
+    return isinstance(cause, _ASYNCPG_DATA_ERRORS)
+
+async def apply_counts(counts: Counter) -> Counter:
+    """Add buffered counts to the product table, one executemany per batch.
+
+    Returns the counts of rows the database rejected; those are not applied.
+    """
+    per_product = {}
+    for (product_id, column), amount in counts.items():
+        row = per_product.setdefault(
+            product_id, {"product_id": product_id, "add_views": 0, "add_purchase_count": 0}
+        )
+        row[f"add_{column}"] += amount
+
+    # Sorted ids give every flusher the same lock order
+    rows = [per_product[product_id] for product_id in sorted(per_product)]
+    rejected = Counter()
+    async with async_engine.begin() as conn:
+        for start in range(0, len(rows), EVENT_FLUSH_BATCH):
+            batch = rows[start:start + EVENT_FLUSH_BATCH]
+            try:
+                async with conn.begin_nested():
+                    await conn.execute(_increment, batch)
+                continue
+            except Exception as e:
+                if not _rejected_row(e):
+                    raise
+            # One bad row fails the whole executemany; retry row by row so only it is left out
+            for row in batch:
+                try:
+                    async with conn.begin_nested():
+                        await conn.execute(_increment, row)
+                except Exception as e:
+                    if not _rejected_row(e):
+                        raise
+                    logger.error(f"Setting aside counters for product {row['product_id']}: {e}")
+                    del per_product[row["product_id"]]
+                    for column in COUNTER_COLUMNS:
+                        if row[f"add_{column}"]:
+                            rejected[(row["product_id"], column)] = row[f"add_{column}"]
+
+    await anote_write()
+    # Cached product bodies carry the counters
+    await async_product_crud.invalidate_product_entries(list(per_product))
+    await changes.apublish(changes.counters({
+        product_id: {column: row[f"add_{column}"] for column in COUNTER_COLUMNS}
+        for product_id, row in per_product.items()
+    }))
+    return rejected
+
+async def _flush_local():
+    with _local_lock:
+        counts = _local_counts.copy()
+        _local_counts.clear()
+    if not counts:
+        return 0
+    try:
+        rejected = await apply_counts(counts)
+    except Exception as e:
+        # Put them back for the next flush
+        with _local_lock:
+            _local_counts.update(counts)
+        logger.error(f"Failed to flush {len(counts)} buffered counters: {e}")
+        return 0
+    if rejected:
+        # No Redis to set them aside in
+        logger.error(f"Dropped {len(rejected)} rejected counters: {dict(rejected)}")
+    return sum(counts.values()) - sum(rejected.values())
+
+async def _clear_processing(client, rejected: Counter):
+    # One transaction, so a replayed batch never sets the same counts aside twice
+    async with client.pipeline(transaction=True) as pipe:
+        for (product_id, column), amount in rejected.items():
+            pipe.hincrby(REJECTED_KEY, _field(product_id, column), amount)
+        pipe.delete(PROCESSING_KEY)
+        return await pipe.execute()
+
+async def _flush_redis():
+    token = uuid.uuid4().hex
+    locked = await aredis_call(
+        "event flush lock",
+        lambda client: client.set(FLUSH_LOCK_KEY, token, nx=True, ex=EVENT_FLUSH_LOCK_SECONDS),
+    )
+    if not locked:
+        return 0
+
+    try:
+        # A leftover processing hash is a batch whose flush didn't finish; replay it first
+        if not await aredis_call("check processing events", lambda client: client.exists(PROCESSING_KEY)):
+            if not await aredis_call("check pending events", lambda client: client.exists(PENDING_KEY)):
+                return 0
+            await aredis_call("claim pending events", lambda client: client.rename(PENDING_KEY, PROCESSING_KEY))
+
+        raw = await aredis_call("read processing events", lambda client: client.hgetall(PROCESSING_KEY))
+        if not raw:
+            return 0
+
+        counts = _parse_counts(raw)
+        try:
+            rejected = await apply_counts(counts)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(counts)} counters, will retry: {e}")
+            return 0
+
+        await aredis_call("clear processing events", lambda client: _clear_processing(client, rejected))
+        return sum(counts.values()) - sum(rejected.values())
+    finally:
+        owner = await aredis_call("event flush lock owner", lambda client: client.get(FLUSH_LOCK_KEY))
+        if owner == token:
+            await aredis_call("release event flush lock", lambda client: client.delete(FLUSH_LOCK_KEY))
+
+async def flush_events() -> int:
+    """Apply everything buffered so far; returns the number of events applied."""
+    return await _flush_local() + await _flush_redis()
+
+async def _flush_forever():
+    while True:
+        await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+        try:
+            await flush_events()
+        except Exception as e:
+            logger.error(f"Event flush failed: {e}")
+
+def start_event_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = asyncio.create_task(_flush_forever())
+
+async def stop_event_flusher():
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        _flusher = None
+    # Don't leave this worker's buffer behind on a clean shutdown
+    await flush_events()
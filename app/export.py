@@ -0,0 +1,69 @@
+# app/export.py
+#
+# Streaming catalogue export. Rows come from a server-side cursor in chunks
+# of EXPORT_CHUNK_ROWS (see async_product_crud.stream_products), are encoded
+# one chunk at a time as NDJSON, CSV, Arrow or Parquet and optionally gzipped
+# on the fly, so worker memory stays flat however many rows are exported.
+
+import io
+import os
+import csv
+import zlib
+import datetime
+from typing import AsyncIterator, List, Sequence
+from app.cache import json_body
+from app.columnar import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, encode_arrow, encode_parquet
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 1000))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": (ARROW_MEDIA_TYPE, "arrows"),
+    "parquet": (PARQUET_MEDIA_TYPE, "parquet"),
+}
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+async def encode_ndjson(columns: List[str], chunks: AsyncIterator[Sequence]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b"".join(json_body(dict(zip(columns, row))) + b"\n" for row in rows)
+
+async def encode_csv(columns: List[str], chunks: AsyncIterator[Sequence]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in chunks:
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+_ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "arrow": encode_arrow,
+    "parquet": encode_parquet,
+}
+
+def encode_export(format: str, columns: List[str], chunks: AsyncIterator[Sequence], gzip: bool = False):
+    encoded = _ENCODERS[format](columns, chunks)
+    return gzip_stream(encoded) if gzip else encoded
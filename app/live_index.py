@@ -0,0 +1,129 @@
+# app/live_index.py
+#
+# Holder for the in-process product indexes (suggestions, recommendations).
+# An index class implements build(products), upsert(products),
+# remove(product_ids) and __len__, plus save(path) / load(path) if it can be
+# persisted, and may offer narrower in-place updates applied through
+# patch(). The holder rebuilds it from the product table in a background
+# thread every `rebuild_seconds`, which picks up writes made by other workers
+# or straight to the database. Writes made through this worker's CRUD layer
+# are applied in place in between, and journaled while a rebuild runs so the
+# fresh index doesn't miss them.
+
+import os
+import time
+import logging
+import threading
+from typing import Optional, Sequence
+from sqlmodel import Session, select
+from app.models.product import Product
+
+logger = logging.getLogger("live_index")
+logger.setLevel(logging.INFO)
+
+LOAD_BATCH = 10000
+
+def product_field(product, name):
+    return product.get(name) if isinstance(product, dict) else getattr(product, name)
+
+class LiveIndex:
+    def __init__(self, name: str, index_class, fields: Sequence[str], rebuild_seconds: int,
+                 path: Optional[str] = None, where=None):
+        self.name = name
+        self.index_class = index_class
+        self.fields = tuple(fields)
+        self.rebuild_seconds = rebuild_seconds
+        self.path = path
+        self.where = where  # Optional filter on the rows worth indexing
+        self.index = None
+        self._lock = threading.Lock()
+        self._journal: Optional[list] = None
+
+    def _apply(self, operation: str, payload):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((operation, payload))
+            index = self.index
+        if index is not None:
+            getattr(index, operation)(payload)
+
+    def upsert(self, products):
+        """(Re)index created or updated products."""
+        try:
+            self._apply("upsert", [{name: product_field(product, name) for name in self.fields} for product in products])
+        except Exception as e:
+            logger.warning(f"Failed to index {len(products)} products for {self.name}: {e}")
+
+    def remove(self, product_ids):
+        try:
+            self._apply("remove", list(product_ids))
+        except Exception as e:
+            logger.warning(f"Failed to drop {len(product_ids)} products from {self.name}: {e}")
+
+    def patch(self, operation: str, payload):
+        """Apply an in-place update the index class provides beyond upsert/remove."""
+        try:
+            self._apply(operation, payload)
+        except Exception as e:
+            logger.warning(f"Failed to {operation} on {self.name}: {e}")
+
+    def _load_rows(self, engine) -> list:
+        statement = select(*[getattr(Product, name) for name in self.fields])
+        if self.where is not None:
+            statement = statement.where(self.where)
+        with Session(engine) as session:
+            result = session.exec(statement.execution_options(yield_per=LOAD_BATCH))
+            return [dict(zip(self.fields, row)) for row in result]
+
+    def rebuild(self, engine):
+        started = time.perf_counter()
+        with self._lock:
+            self._journal = []
+        try:
+            index = self.index_class()
+            index.build(self._load_rows(engine))
+        finally:
+            with self._lock:
+                journal, self._journal = self._journal, None
+
+        # Replay writes that raced with the build, then swap the new index in
+        for operation, payload in journal:
+            getattr(index, operation)(payload)
+        self.index = index
+        logger.info(f"Built {self.name} index for {len(index)} products in {time.perf_counter() - started:.2f}s")
+        self.save()
+
+    def _maintain(self, engine, rebuild_first: bool):
+        if rebuild_first:
+            try:
+                self.rebuild(engine)
+            except Exception as e:
+                logger.error(f"{self.name} index build failed: {e}")
+        while True:
+            time.sleep(self.rebuild_seconds)
+            try:
+                self.rebuild(engine)
+            except Exception as e:
+                logger.error(f"{self.name} index rebuild failed: {e}")
+
+    def start(self, engine):
+        """Load the saved index if there is one, and keep it rebuilt in a background thread."""
+        stale = True
+        if self.path and os.path.exists(self.path):
+            try:
+                self.index = self.index_class.load(self.path)
+                if self.index is not None:
+                    stale = time.time() - os.path.getmtime(self.path) > self.rebuild_seconds
+                    logger.info(f"Loaded {self.name} index for {len(self.index)} products from {self.path}")
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable {self.name} index {self.path}: {e}")
+        threading.Thread(
+            target=self._maintain, args=(engine, stale), daemon=True, name=f"{self.name}-index"
+        ).start()
+
+    def save(self):
+        if self.path and self.index is not None:
+            try:
+                self.index.save(self.path)
+            except Exception as e:
+                logger.warning(f"Failed to save {self.name} index to {self.path}: {e}")
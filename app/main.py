@@ -1,18 +1,41 @@
 from fastapi import FastAPI
-from sqlmodel import SQLModel
 from app.db import engine
+from app.migrations import run_migrations
+from app.cache import cache_stats
+from app.events import start_event_flusher, stop_event_flusher
+from app.changes import start_change_feed, stop_change_feed
+from app.suggestions import save_suggestion_index, start_suggestion_index
+from app.recommend import start_recommend_index
 from app.api import products  # your products router
 
 app = FastAPI()
 
 @app.on_event("startup")
 def on_startup():
-    # Create database tables
-    SQLModel.metadata.create_all(engine)
+    # Bring the schema up to date (tables, indexes, text search)
+    run_migrations(engine)
+    start_suggestion_index(engine)
+    start_recommend_index(engine)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    start_event_flusher()
+    start_change_feed()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await stop_event_flusher()
+    await stop_change_feed()
+    save_suggestion_index()
 
 @app.get("/")
 def root():
     return {"message": "Welcome to Bharat Product Intelligence API"}
 
+@app.get("/cache/stats")
+def read_cache_stats():
+    # Per-tier hit/miss counters for this worker
+    return cache_stats()
+
 # Include your products router under /api prefix
 app.include_router(products.router, prefix="/api")
@@ -0,0 +1,140 @@
+# app/migrations.py
+#
+# Versioned schema migrations, applied in order at startup. Each migration
+# runs once and is recorded in schema_migrations, so existing databases pick
+# up new indexes/columns without a rebuild. Append new migrations to the end
+# of MIGRATIONS; never edit or renumber one that has shipped.
+
+import logging
+import warnings
+from datetime import datetime
+from sqlalchemy import (
+    Column, Date, DateTime, Float, Integer, MetaData, String, Table, select, text,
+)
+from app.models.product import Product
+from app.search import create_search_index
+
+logger = logging.getLogger("migrations")
+logger.setLevel(logging.INFO)
+
+# Arbitrary constant; serialises workers that start at the same time (PostgreSQL)
+MIGRATION_LOCK_KEY = 74210311
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# The product table as first shipped. Frozen here so later migrations can
+# alter it the same way on new and existing databases.
+_baseline_product = Table(
+    "product",
+    _metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("description", String),
+    Column("brand", String),
+    Column("category", String),
+    Column("price", Float, nullable=False),
+    Column("region", String),
+    Column("tags", String),
+    Column("image_url", String),
+    Column("rating", Float),
+    Column("stock", Integer, nullable=False),
+    Column("warranty", String),
+    Column("size", String),
+    Column("material", String),
+    Column("expiry_date", Date),
+    Column("pack_size", String),
+    Column("views", Integer, nullable=False),
+    Column("purchase_count", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+def _add_updated_at(conn):
+    column_type = DateTime().compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE product ADD COLUMN updated_at {column_type}"))
+    conn.execute(text("UPDATE product SET updated_at = created_at"))
+
+def _create_indexes(*names):
+    indexes = {index.name: index for index in Product.__table__.indexes}
+
+    def migrate(conn):
+        with warnings.catch_warnings():
+            # checkfirst reflects the table's indexes, and SQLAlchemy skips expression ones noisily
+            warnings.filterwarnings("ignore", "Skipped unsupported reflection of expression-based index")
+            for name in names:
+                indexes[name].create(conn, checkfirst=True)
+    return migrate
+
+def _unique_natural_key(conn):
+    # Keep the oldest row of each (name, brand) so the unique index can build
+    removed = conn.execute(text(
+        "DELETE FROM product WHERE id NOT IN "
+        "(SELECT MIN(id) FROM product GROUP BY name, coalesce(brand, ''))"
+    )).rowcount
+    if removed:
+        logger.warning(f"Removed {removed} duplicate products before making (name, brand) unique")
+    conn.execute(text("DROP INDEX IF EXISTS ix_product_name_brand"))
+    # No checkfirst: SQLAlchemy can't reflect expression indexes, and it was just dropped
+    next(index for index in Product.__table__.indexes if index.name == "ix_product_name_brand").create(conn)
+
+# ----------------------------------
+# Migrations: (version, description, fn(conn))
+# ----------------------------------
+MIGRATIONS = [
+    (1, "create product table", lambda conn: _baseline_product.create(conn, checkfirst=True)),
+    (2, "index product natural key", _create_indexes("ix_product_name_brand")),
+    (3, "create product text search index", create_search_index),
+    (4, "index product listing filters and sorts", _create_indexes(
+        "ix_product_category",
+        "ix_product_region",
+        "ix_product_category_price",
+        "ix_product_region_price",
+        "ix_product_category_region",
+        "ix_product_price",
+        "ix_product_created_at",
+        "ix_product_name",
+        "ix_product_purchase_count",
+    )),
+    (5, "add product updated_at", _add_updated_at),
+    (6, "make product natural key unique", _unique_natural_key),
+]
+
+def _applied_versions(conn) -> set:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+def run_migrations(engine):
+    """Apply every pending migration, each in its own transaction."""
+    with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            schema_migrations.create(conn, checkfirst=True)
+            conn.commit()
+
+            applied = _applied_versions(conn)
+            for version, description, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                try:
+                    migrate(conn)
+                    conn.execute(schema_migrations.insert().values(
+                        version=version, description=description, applied_at=datetime.utcnow()
+                    ))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"Migration {version} failed: {e}")
+                    raise
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
@@ -2,10 +2,11 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
 from typing import Optional, List
 from datetime import datetime, date
-from pydantic import BaseModel, confloat
+from pydantic import BaseModel, confloat, conint
 from pydantic import field_validator
 class ProductBase(SQLModel):
     name: str
@@ -34,9 +35,31 @@ def validate_image_url(cls, v):
             raise ValueError("Image URL must end with .jpg, .jpeg, .png, or .webp")
     return v
 
+# Brand as it appears in the natural key index; ON CONFLICT targets must repeat it verbatim
+NATURAL_KEY_BRAND = "coalesce(brand, '')"
+
 class Product(ProductBase, table=True):
+    __table_args__ = (
+        # Natural key: the CSV loader upserts on it instead of duplicating rows.
+        # coalesce() so rows without a brand collide too (NULLs never do)
+        Index("ix_product_name_brand", "name", text(NATURAL_KEY_BRAND), unique=True),
+        # Listing filters and sorts, each tie-broken on id like the queries
+        Index("ix_product_category_price", "category", "price", "id"),
+        Index("ix_product_region_price", "region", "price", "id"),
+        Index("ix_product_category", "category", "id"),
+        Index("ix_product_region", "region", "id"),
+        Index("ix_product_category_region", "category", "region", "id"),
+        Index("ix_product_price", "price", "id"),
+        Index("ix_product_created_at", "created_at", "id"),
+        Index("ix_product_name", "name", "id"),
+        # Top sellers / trending
+        Index("ix_product_purchase_count", "purchase_count", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Bumped by every UPDATE except the batched counter flushes; feeds ETag/Last-Modified
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
 
 
 class ProductCreate(ProductBase):
@@ -46,11 +69,79 @@ class ProductCreate(ProductBase):
 class ProductRead(ProductBase):
     id: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
 
 class PaginatedProductResponse(BaseModel):
-    total: int
+    total: Optional[int] = None            # Omitted in cursor mode
+    total_is_estimate: bool = False        # True when exact=false returned a planner estimate
     items: List[ProductRead]
+    next_cursor: Optional[str] = None      # Opaque token for the next page in cursor mode
+
+
+class BulkRowError(BaseModel):
+    index: int  # Position of the row in the submitted batch
+    error: str
+
+
+class BulkProductResponse(BaseModel):
+    created: int
+    failed: int
+    errors: List[BulkRowError] = []
+
+
+class ReserveLine(BaseModel):
+    product_id: int
+    quantity: conint(ge=1) = 1
+
+
+class ReserveRequest(BaseModel):
+    items: List[ReserveLine]               # Repeated product ids are added together
+
+
+class ReservedLine(BaseModel):
+    product_id: int
+    quantity: int
+    stock: int                             # Left after this reservation
+
+
+class ReserveResponse(BaseModel):
+    reserved: List[ReservedLine]
+
+
+class RecommendRequest(BaseModel):
+    query: str                             # What the shopper is looking for, in their words
+    limit: conint(ge=1, le=100) = 10
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    region: Optional[str] = None
+    in_stock: bool = False
+
+
+class RecommendedProduct(ProductRead):
+    score: float  # BM25 relevance, higher is better
+
+
+class CategoryCount(BaseModel):
+    category: Optional[str] = None
+    count: int
+
+
+class PriceBucket(BaseModel):
+    min: float   # Inclusive
+    max: float   # Exclusive, except for the last bucket
+    count: int
+
+
+class ProductStats(BaseModel):
+    total: int
+    average_price: Optional[float] = None
+    average_rating: Optional[float] = None
+    rated: int = 0                         # Products with a rating, the base of average_rating
+    total_stock: int = 0
+    categories: List[CategoryCount] = []
+    price_histogram: List[PriceBucket] = []
+    top_rated: List[ProductRead] = []
 
 
 class ProductUpdate(SQLModel):
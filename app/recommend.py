@@ -0,0 +1,232 @@
+# app/recommend.py
+#
+# "Need help choosing?" retrieval. An in-memory BM25 inverted index over
+# name, brand, category, tags and description; a free-text need such as
+# "durable cotton kurta for summer" is scored against every product that
+# shares a term with it.
+#
+# Postings are array-backed (array('i') rows + array('H') term frequencies,
+# read as zero-copy NumPy views at query time) and scoring is vectorised per
+# term. Price, region and stock live in parallel NumPy columns so filters are
+# applied inside the index, before anything is fetched from the database.
+#
+# Updates append a new row and tombstone the old one; document frequencies
+# keep counting tombstoned rows until the next full rebuild (see
+# app/live_index.py), which only nudges idf.
+
+import os
+import re
+import math
+import logging
+import threading
+import numpy as np
+from array import array
+from typing import Dict, List, Optional, Tuple
+from app.live_index import LiveIndex, product_field
+
+logger = logging.getLogger("recommend")
+logger.setLevel(logging.INFO)
+
+BM25_K1 = float(os.getenv("RECOMMEND_BM25_K1", 1.2))
+BM25_B = float(os.getenv("RECOMMEND_BM25_B", 0.75))
+REBUILD_SECONDS = int(os.getenv("RECOMMEND_REBUILD_SECONDS", 900))
+MAX_QUERY_TERMS = 32
+COMMON_TERM_RATIO = 0.5  # Share of products above which a query term is skipped
+
+# Term frequency multiplier per field (a cheap BM25F)
+FIELD_WEIGHTS = {"name": 3, "brand": 2, "category": 2, "tags": 2, "description": 1}
+INDEX_FIELDS = ("id", "price", "region", "stock") + tuple(FIELD_WEIGHTS)
+
+STOPWORDS = frozenset("""
+    a about an and any are as at be best buy can for from get good have i in is it looking
+    me my need of on or please recommend show some something suggest that the this to under
+    want what which with would you
+""".split())
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def analyze(text: str) -> List[str]:
+    """Lower-cased terms without stopwords, with a light plural fold."""
+    terms = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+class RecommendIndex:
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.length = np.zeros(capacity, dtype=np.float32)
+        self.price = np.zeros(capacity, dtype=np.float32)
+        self.stock = np.zeros(capacity, dtype=np.int64)
+        self.region = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.regions: Dict[str, int] = {"": 0}
+        self.terms: Dict[str, int] = {}
+        self.postings: List[array] = []     # term id -> rows
+        self.frequencies: List[array] = []  # term id -> weighted tf per row
+        self.total_length = 0.0
+        self._row: Dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._row)
+
+    def _grow(self, needed: int):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ("ids", "length", "price", "stock", "region", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _add(self, product):
+        counts: Dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in analyze(product_field(product, field)):
+                counts[term] = counts.get(term, 0) + weight
+
+        row = self.size
+        self.size += 1
+        product_id = int(product_field(product, "id"))
+        self.ids[row] = product_id
+        self.length[row] = sum(counts.values())
+        price = product_field(product, "price")
+        self.price[row] = np.nan if price is None else price
+        self.stock[row] = product_field(product, "stock") or 0
+        self.region[row] = self.regions.setdefault((product_field(product, "region") or "").lower(), len(self.regions))
+        self.alive[row] = True
+        self.total_length += self.length[row]
+        self._row[product_id] = row
+
+        for term, count in counts.items():
+            term_id = self.terms.get(term)
+            if term_id is None:
+                term_id = self.terms[term] = len(self.postings)
+                self.postings.append(array("i"))
+                self.frequencies.append(array("H"))
+            self.postings[term_id].append(row)
+            self.frequencies[term_id].append(min(count, 65535))
+
+    def build(self, products):
+        with self._lock:
+            self._grow(len(products))
+            for product in products:
+                self._add(product)
+
+    def upsert(self, products):
+        with self._lock:
+            self.remove([product_field(product, "id") for product in products])
+            self._grow(self.size + len(products))
+            for product in products:
+                self._add(product)
+
+    def remove(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                row = self._row.pop(int(product_id), None)
+                if row is not None:
+                    self.alive[row] = False
+                    self.total_length -= self.length[row]
+
+    def set_stock(self, stock: Dict[int, int]):
+        """In-place stock update for indexed products, e.g. after a reservation."""
+        with self._lock:
+            for product_id, value in stock.items():
+                row = self._row.get(int(product_id))
+                if row is not None:
+                    self.stock[row] = value
+
+    def search(self, query: str, limit: int = 10, min_price: Optional[float] = None,
+               max_price: Optional[float] = None, region: Optional[str] = None,
+               in_stock: bool = False) -> List[Tuple[int, float]]:
+        """[(product id, BM25 score)] best first for products passing the filters."""
+        terms = list(dict.fromkeys(analyze(query)))[:MAX_QUERY_TERMS]
+        with self._lock:
+            term_ids = [self.terms[term] for term in terms if term in self.terms]
+            region_code = None
+            if region:
+                region_code = self.regions.get(region.lower())
+                if region_code is None:
+                    return []
+            live = len(self._row)
+            if not term_ids or not live:
+                return []
+
+            # Terms in most products add next to nothing to BM25 but cost a pass over
+            # most rows; drop them unless the query has nothing rarer
+            rare = [term_id for term_id in term_ids if len(self.postings[term_id]) <= live * COMMON_TERM_RATIO]
+            term_ids = rare or term_ids
+
+            average_length = self.total_length / live
+            matched = []
+            for term_id in term_ids:
+                rows = np.frombuffer(self.postings[term_id], dtype=np.int32)
+                tf = np.frombuffer(self.frequencies[term_id], dtype=np.uint16).astype(np.float32)
+                df = min(len(rows), live)
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.length[rows] / average_length)
+                matched.append((rows, idf * tf * (BM25_K1 + 1) / (tf + norm)))
+
+            # Sum per row: sparsely when few rows match, else into a dense accumulator
+            if sum(len(rows) for rows, _ in matched) * 8 < self.size:
+                candidates, inverse = np.unique(np.concatenate([rows for rows, _ in matched]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([values for _, values in matched]))
+            else:
+                dense = np.zeros(self.size, dtype=np.float32)
+                for rows, values in matched:
+                    dense[rows] += values
+                candidates = np.flatnonzero(dense)
+                scores = dense[candidates]
+
+            # Filters run on the matching rows only
+            keep = self.alive[candidates]
+            if min_price is not None:
+                keep &= self.price[candidates] >= min_price
+            if max_price is not None:
+                keep &= self.price[candidates] <= max_price
+            if region_code is not None:
+                keep &= self.region[candidates] == region_code
+            if in_stock:
+                keep &= self.stock[candidates] > 0
+            candidates, scores = candidates[keep], scores[keep]
+
+            if len(candidates) > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                candidates, scores = candidates[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            return [(int(self.ids[row]), float(score)) for row, score in zip(candidates[order], scores[order])]
+
+# ----------------------------------
+# Process-wide index
+# ----------------------------------
+live_index = LiveIndex("recommend", RecommendIndex, INDEX_FIELDS, REBUILD_SECONDS)
+
+def index_products(products):
+    """Hook for product writes: (re)index created or updated products."""
+    live_index.upsert(products)
+
+def remove_products(product_ids):
+    """Hook for product deletes."""
+    live_index.remove(product_ids)
+
+def update_stock(stock: Dict[int, int]):
+    """Hook for stock-only writes: {product id: new stock}, applied without reindexing."""
+    live_index.patch("set_stock", stock)
+
+def recommend(query: str, limit: int = 10, **filters) -> Optional[List[Tuple[int, float]]]:
+    """Ranked (product id, score) pairs, or None until the index has been built."""
+    index = live_index.index
+    if index is None:
+        return None
+    return index.search(query, limit, **filters)
+
+def start_recommend_index(engine):
+    live_index.start(engine)
@@ -0,0 +1,176 @@
+"""Fail if any product query falls back to a full scan of the product table.
+
+Seeds a throwaway database (a temporary SQLite file unless --database-url is
+given), applies the migrations, then EXPLAINs every query shape the CRUD layer
+issues. Exits 1 when a plan reads the whole product table instead of using an
+index for the query's filter or sort, so it can run in CI after schema or
+query changes (tests/test_query_plans.py runs it under pytest):
+
+    python app/scripts/check_query_plans.py
+    python app/scripts/check_query_plans.py --database-url postgresql://localhost/plans_check
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+SEED_ROWS = int(os.getenv("PLAN_CHECK_ROWS", 20000))
+CATEGORIES = ["smartphones", "accessories", "laptops", "fashion", "grocery", "home", "beauty", "toys"]
+REGIONS = ["India", "Global", "Mumbai", "Delhi", "Bengaluru", "Chennai"]
+WORDS = ["pro", "max", "lite", "ultra", "classic", "smart", "wireless", "organic", "cotton", "steel"]
+
+_SQLITE_TABLE_SCAN = re.compile(r"^SCAN product(?: AS \w+)?$")
+
+def seed(engine, rows):
+    from app.models.product import Product
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    batch = [
+        {
+            "name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+            "description": " ".join(rng.choice(WORDS) for _ in range(8)),
+            "brand": f"Brand{i % 200}",
+            "category": rng.choice(CATEGORIES),
+            "price": round(rng.uniform(50, 50000), 2),
+            "region": rng.choice(REGIONS),
+            "tags": ",".join(rng.sample(WORDS, 3)),
+            "rating": round(rng.uniform(1, 5), 1),
+            "stock": rng.randint(0, 500),
+            "views": rng.randint(0, 10000),
+            "purchase_count": rng.randint(0, 1000),
+            "created_at": now - timedelta(minutes=i),
+        }
+        for i in range(rows)
+    ]
+    with engine.begin() as conn:
+        conn.execute(Product.__table__.insert(), batch)
+        conn.exec_driver_sql("ANALYZE")
+
+def query_shapes(session):
+    """(label, statement) for every product query the API issues."""
+    from sqlalchemy import func
+    from sqlmodel import select
+    from app.models.product import Product
+    from app.crud import product_crud
+
+    def listing(search=None, category=None, region=None, min_price=None, max_price=None,
+                sort_by=None, order="asc"):
+        return product_crud._listing_statement(
+            session, 0, 20, search, category, region, min_price, max_price, sort_by, order, False, None
+        )
+
+    def count(**filters):
+        statement, _ = product_crud._filtered_statement(session, **filters)
+        return statement.with_only_columns(func.count(), maintain_column_froms=True).order_by(None)
+
+    sample = session.exec(select(Product).where(Product.category == CATEGORIES[0]).limit(1)).first()
+
+    return [
+        ("listing by category", listing(category="laptops")),
+        ("listing by region", listing(region="Mumbai")),
+        ("listing by category and region", listing(category="laptops", region="Mumbai")),
+        ("listing by price range", listing(min_price=1000, max_price=1200)),
+        ("listing by category and price range", listing(category="laptops", min_price=1000, max_price=5000)),
+        ("listing sorted by price", listing(sort_by="price")),
+        ("listing sorted by price desc", listing(sort_by="price", order="desc")),
+        ("listing sorted by created_at desc", listing(sort_by="created_at", order="desc")),
+        ("listing sorted by name", listing(sort_by="name")),
+        ("listing by category sorted by price", listing(category="laptops", sort_by="price")),
+        ("listing by search", listing(search="wireless")),
+        ("count by category", count(category="laptops")),
+        ("count by price range", count(min_price=1000, max_price=1200)),
+        ("facet counts", product_crud._facets_statement()),
+        ("top by purchase count", product_crud._top_purchase_statement(10)),
+        ("suggestions", product_crud._suggest_statement(sample, 500, 5)),
+    ]
+
+def _postgres_scans(node, parent=None):
+    """Plan nodes that read the whole product table.
+
+    With enable_seqscan off, a query with no usable index is planned as a full
+    walk of some other index (usually product_pkey) instead of a Seq Scan. An
+    index scan without an Index Cond counts as a table scan unless it is only
+    there to supply the order: i.e. it filters rows itself or feeds a Sort.
+    """
+    node_type = node.get("Node Type")
+    if node.get("Relation Name") == "product":
+        if node_type == "Seq Scan":
+            yield f"Seq Scan on {node['Relation Name']}"
+        elif node_type in ("Index Scan", "Index Only Scan") and "Index Cond" not in node:
+            if "Filter" in node:
+                yield f"{node_type} using {node['Index Name']} with Filter: {node['Filter']}"
+            elif parent is not None and parent.get("Node Type") in ("Sort", "Incremental Sort"):
+                yield f"{node_type} using {node['Index Name']} under {parent['Node Type']}"
+    for child in node.get("Plans", []):
+        yield from _postgres_scans(child, node)
+
+def sequential_scans(session, statement):
+    """Plan lines that read the whole product table."""
+    from app.crud import product_crud
+
+    sql, params = product_crud._driver_sql(session, statement)
+    conn = session.connection()
+    if conn.dialect.name == "postgresql":
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return list(_postgres_scans(plan[0]["Plan"]))
+
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).all()
+    return [row[-1] for row in rows if _SQLITE_TABLE_SCAN.match(row[-1])]
+
+def check_query_plans(database_url, rows=SEED_ROWS):
+    os.environ.setdefault("DATABASE_URL", database_url)
+    from sqlmodel import Session
+    from app.db import make_engine
+    from app.migrations import run_migrations
+
+    engine = make_engine(database_url)
+    run_migrations(engine)
+    seed(engine, rows)
+
+    failures = 0
+    total = 0
+    with Session(engine) as session:
+        if engine.dialect.name == "postgresql":
+            # Make the planner prefer any usable index; without one it walks the
+            # primary key instead, which _postgres_scans also reports
+            session.connection().exec_driver_sql("SET enable_seqscan = off")
+        shapes = query_shapes(session)
+        total = len(shapes)
+        for label, statement in shapes:
+            scans = sequential_scans(session, statement)
+            if scans:
+                failures += 1
+                print(f"❌ {label}: {'; '.join(scans)}")
+            else:
+                print(f"✅ {label}")
+
+    engine.dispose()
+    if failures:
+        print(f"\n{failures} of {total} queries scan the product table")
+    else:
+        print(f"\nNo full scans of product ({total} queries)")
+    return failures == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN every product query against a seeded database")
+    parser.add_argument("--database-url", default=None,
+                        help="Empty database to seed (default: a temporary SQLite file)")
+    parser.add_argument("--rows", type=int, default=SEED_ROWS)
+    args = parser.parse_args()
+
+    if args.database_url:
+        ok = check_query_plans(args.database_url, args.rows)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            ok = check_query_plans(f"sqlite:///{os.path.join(tmp, 'plans.db')}", args.rows)
+    sys.exit(0 if ok else 1)
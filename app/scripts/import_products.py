@@ -1,7 +1,14 @@
+import argparse
 import csv
+import io
 import requests
 import os
+import sys
 import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from requests.adapters import HTTPAdapter
 
 def safe_float(value, default=0.0):
     try:
@@ -15,78 +22,300 @@ def safe_int(value, default=0):
     except (ValueError, TypeError):
         return default
 
-def post_with_retries(url, data, retries=3, delay=1):
+API_URL = os.getenv("API_URL", "http://localhost:8000/api/products")
+BULK_API_URL = os.getenv("BULK_API_URL", f"{API_URL}/bulk")
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 500))
+CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", 4))
+DB_CHUNK_SIZE = int(os.getenv("IMPORT_DB_CHUNK_SIZE", 5000))
+
+# Columns written by the direct loader; (name, brand) is the natural key
+LOAD_COLUMNS = [
+    "name", "description", "brand", "category", "price",
+    "region", "tags", "image_url", "rating", "stock",
+]
+
+def make_session(pool_size=CONCURRENCY):
+    # One keep-alive connection per worker thread, reused for every chunk
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def post_with_retries(session, url, data, retries=3, delay=1):
     for attempt in range(retries):
         try:
-            response = requests.post(url, json=data)
+            response = session.post(url, json=data, timeout=60)
             if response.status_code in (200, 201):
                 return response
-            else:
-                print(f"Attempt {attempt+1}: Failed with status {response.status_code}")
+            if response.status_code < 500:
+                # Client errors won't succeed on retry
+                print(f"Attempt {attempt+1}: Failed with status {response.status_code}: {response.text[:200]}")
+                return None
+            print(f"Attempt {attempt+1}: Failed with status {response.status_code}")
         except requests.exceptions.RequestException as e:
             print(f"Attempt {attempt+1}: Request error: {e}")
-        time.sleep(delay)
+        time.sleep(delay * (2 ** attempt))
     return None
 
-API_URL = os.getenv("API_URL", "http://localhost:8000/products")
+def build_product(row):
+    """Turn a CSV row into a product payload, or None if the row is unusable."""
+    name = (row.get("name") or "").strip()
+    price = safe_float(row.get("price"), default=None)
+
+    if not name or price is None or price <= 0:
+        return None
+
+    return {
+        "name": name,
+        "description": row.get("description"),
+        "brand": row.get("brand"),
+        "category": row.get("category"),
+        "price": price,
+        "region": row.get("region"),
+        "tags": row.get("tags"),
+        "image_url": row.get("image_url") if (row.get("image_url") or "").startswith("http") else "https://via.placeholder.com/300",
+        "rating": safe_float(row.get("rating"), default=0.0),
+        "stock": safe_int(row.get("stock")),
+    }
+
+def iter_rows(csv_path):
+    """Stream (line_number, row) pairs so the file is never fully loaded."""
+    with open(csv_path, newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            yield reader.line_num, row
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def send_chunk(session, chunk):
+    """POST one chunk to the bulk endpoint. Returns (created, [(line, name, error), ...])."""
+    payload = [product for _, product in chunk]
+    response = post_with_retries(session, BULK_API_URL, payload)
+    if response is None:
+        return 0, [(line, product["name"], "request failed") for line, product in chunk]
 
-def import_products(csv_path):
+    body = response.json()
+    errors = [
+        (chunk[err["index"]][0], chunk[err["index"]][1]["name"], err["error"])
+        for err in body.get("errors", [])
+    ]
+    return body.get("created", 0), errors
+
+def import_products(csv_path, chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY):
     if not os.path.exists(csv_path):
         print(f"❌ File not found: {csv_path}")
         return
 
-    with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        total = 0
-        success = 0
-        skipped = 0
-        failed = 0
+    total = 0
+    success = 0
+    skipped = 0
+    failed = 0
+    started = time.perf_counter()
 
-        for row in reader:
+    def valid_rows():
+        nonlocal total, skipped
+        for line, row in iter_rows(csv_path):
             total += 1
-            name = (row.get("name") or "").strip()
-            price = safe_float(row.get("price"), default=None)
+            product = build_product(row)
+            if product is None:
+                print(f"⚠️ Skipped line {line} (invalid data): {(row.get('name') or '').strip() or 'Unnamed Product'} - Price: {row.get('price')}")
+                skipped += 1
+                continue
+            yield line, product
+
+    def collect(futures):
+        nonlocal success, failed
+        for future in futures:
+            created, errors = future.result()
+            success += created
+            failed += len(errors)
+            for line, name, error in errors:
+                print(f"❌ Failed line {line}: {name} - {error}")
+
+    session = make_session(concurrency)
+    with session, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        for chunk in iter_chunks(valid_rows(), chunk_size):
+            # Bound the number of chunks held in memory / on the wire
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(send_chunk, session, chunk))
+        collect(wait(in_flight).done)
+
+    elapsed = time.perf_counter() - started
+    print("\n✅ Import Summary:")
+    print(f"Total products processed: {total}")
+    print(f"Successfully added: {success}")
+    print(f"Skipped (invalid data): {skipped}")
+    print(f"Failed rows: {failed}")
+    print(f"Elapsed: {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/sec)")
+
+# ----------------------------------
+# Direct-to-database loader
+# ----------------------------------
+def _staging_table(metadata):
+    from sqlalchemy import Table, Column
+    from app.models.product import Product
+
+    product_table = Product.__table__
+    return Table(
+        "product_staging",
+        metadata,
+        *[Column(name, product_table.c[name].type) for name in LOAD_COLUMNS],
+        prefixes=["TEMPORARY"],
+    )
 
-            if not name or price is None or price <= 0:
-                print(f"⚠️ Skipped (invalid data): {name or 'Unnamed Product'} - Price: {row.get('price')}")
+def _copy_into_staging(conn, staging, rows):
+    """Load a chunk into the staging table: COPY on PostgreSQL, executemany elsewhere."""
+    if conn.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in LOAD_COLUMNS])
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {staging.name} ({', '.join(LOAD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+    else:
+        conn.execute(staging.insert(), rows)
+
+def _upsert_from_staging(conn, staging, loaded_at):
+    """Insert staged rows, updating any whose (name, brand) already exists, in one statement."""
+    from sqlalchemy import literal, select, text, true, DateTime
+    from sqlalchemy.dialects import postgresql, sqlite
+    from app.models.product import NATURAL_KEY_BRAND, Product
+
+    product_table = Product.__table__
+    dialect_insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+
+    rows = (
+        select(
+            *[staging.c[column] for column in LOAD_COLUMNS],
+            literal(0),
+            literal(0),
+            literal(loaded_at, DateTime),
+            literal(loaded_at, DateTime),
+        )
+        # SQLite needs a WHERE to parse INSERT ... SELECT ... ON CONFLICT
+        .where(true())
+    )
+    upsert = dialect_insert(product_table).from_select(
+        LOAD_COLUMNS + ["views", "purchase_count", "created_at", "updated_at"], rows
+    )
+    # The unique natural key index arbitrates, so concurrent loads can't both insert a key
+    conn.execute(upsert.on_conflict_do_update(
+        index_elements=[product_table.c.name, text(NATURAL_KEY_BRAND)],
+        set_={
+            **{column: upsert.excluded[column] for column in LOAD_COLUMNS if column not in ("name", "brand")},
+            "updated_at": upsert.excluded.updated_at,
+        },
+    ))
+
+def _db_row(product):
+    # Empty CSV cells become NULLs, matching what COPY does on PostgreSQL
+    return {
+        column: (None if product.get(column) == "" else product.get(column))
+        for column in LOAD_COLUMNS
+    }
+
+def load_products_direct(csv_path, chunk_size=DB_CHUNK_SIZE):
+    if not os.path.exists(csv_path):
+        print(f"❌ File not found: {csv_path}")
+        return
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+    from sqlalchemy import MetaData
+    from app.db import engine
+    from app.migrations import run_migrations
+    from app.crud import product_crud
+
+    total = 0
+    loaded = 0
+    merged = 0
+    skipped = 0
+    failed = 0
+    started = time.perf_counter()
+
+    def valid_rows():
+        nonlocal total, skipped
+        for line, row in iter_rows(csv_path):
+            total += 1
+            product = build_product(row)
+            if product is None:
                 skipped += 1
                 continue
+            yield _db_row(product)
 
-            product_data = {
-                "name": name,
-                "description": row.get("description"),
-                "brand": row.get("brand"),
-                "category": row.get("category"),
-                "price": price,
-                "region": row.get("region"),
-                "tags": row.get("tags"),
-                "image_url": row.get("image_url") if row.get("image_url", "").startswith("http") else "https://via.placeholder.com/300",
-                "rating": safe_float(row.get("rating"), default=0.0),
-                "stock": safe_int(row.get("stock")),
-            }
-
-            response = post_with_retries(API_URL, product_data)
-
-            if response:
-                print(f"✅ Added: {name}")
-                success += 1
-            else:
-                print(f"❌ Failed to add: {name}")
-                failed += 1
-
-            time.sleep(0.1)
-
-        print("\n✅ Import Summary:")
-        print(f"Total products processed: {total}")
-        print(f"Successfully added: {success}")
-        print(f"Skipped (invalid data): {skipped}")
-        print(f"Failed requests: {failed}")
+    run_migrations(engine)
 
-if __name__ == "__main__":
-    import os
+    with engine.connect() as conn:
+        # TEMPORARY tables live as long as the (pooled) connection, so it is
+        # dropped when the load ends; checkfirst covers one left by a crashed load
+        staging = _staging_table(MetaData())
+        staging.create(conn, checkfirst=True)
+        conn.execute(staging.delete())
+        conn.commit()
+
+        try:
+            for chunk in iter_chunks(valid_rows(), chunk_size):
+                # Last occurrence wins when a feed repeats a key within one chunk
+                rows = list({(row["name"], row["brand"]): row for row in chunk}.values())
+                merged += len(chunk) - len(rows)
+                try:
+                    _copy_into_staging(conn, staging, rows)
+                    _upsert_from_staging(conn, staging, datetime.utcnow())
+                    conn.execute(staging.delete())
+                    conn.commit()
+                    loaded += len(rows)
+                except Exception as e:
+                    conn.rollback()
+                    failed += len(rows)
+                    print(f"❌ Chunk of {len(rows)} rows failed: {e}")
 
+                elapsed = time.perf_counter() - started
+                print(f"… {loaded} rows loaded ({loaded / elapsed if elapsed else 0:.0f} rows/sec)")
+        finally:
+            conn.rollback()
+            staging.drop(conn, checkfirst=True)
+            conn.commit()
+
+    product_crud.invalidate_product_caches()
+
+    elapsed = time.perf_counter() - started
+    print("\n✅ Load Summary:")
+    print(f"Total rows read: {total}")
+    print(f"Upserted: {loaded}")
+    print(f"Merged (repeated name and brand): {merged}")
+    print(f"Skipped (invalid data): {skipped}")
+    print(f"Failed: {failed}")
+    print(f"Elapsed: {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/sec)")
+
+if __name__ == "__main__":
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(current_dir, "products.csv")
 
-    print(f"📄 Looking for: {csv_path}")  # Helps debug
-    import_products(csv_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import products from a CSV file")
+    parser.add_argument("csv_path", nargs="?", default=os.path.join(current_dir, "products.csv"))
+    parser.add_argument("--mode", choices=["http", "db"], default="http",
+                        help="http: POST to the bulk API; db: load straight into the database")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+
+    print(f"📄 Looking for: {args.csv_path}")  # Helps debug
+    if args.mode == "db":
+        load_products_direct(args.csv_path, chunk_size=args.chunk_size or DB_CHUNK_SIZE)
+    else:
+        import_products(args.csv_path, chunk_size=args.chunk_size or CHUNK_SIZE, concurrency=args.concurrency)
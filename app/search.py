@@ -0,0 +1,173 @@
+# app/search.py
+#
+# Indexed product search. PostgreSQL gets a generated tsvector column (GIN)
+# plus a trigram index on name for typo tolerance; SQLite gets an FTS5
+# external-content table kept in sync by triggers. Any other backend falls
+# back to the old LIKE scan.
+
+import os
+import re
+import difflib
+import logging
+from sqlalchemy import column, func, literal, literal_column, or_, select, table, text
+from sqlmodel import Session
+from app.models.product import Product
+
+logger = logging.getLogger("search")
+logger.setLevel(logging.INFO)
+
+TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "simple")
+MAX_TERMS = 8
+TYPO_CANDIDATES = 3
+TYPO_CUTOFF = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""
+    ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(brand, '')), 'A') ||
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(tags, '')), 'B') ||
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_product_name_trgm ON product USING GIN (lower(name) gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, brand, tags, description,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts_vocab USING fts5vocab(product_fts, 'row')",
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, brand, tags, description)
+        VALUES (new.id, new.name, new.brand, new.tags, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, brand, tags, description)
+        VALUES ('delete', old.id, old.name, old.brand, old.tags, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, brand, tags, description ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, brand, tags, description)
+        VALUES ('delete', old.id, old.name, old.brand, old.tags, old.description);
+        INSERT INTO product_fts(rowid, name, brand, tags, description)
+        VALUES (new.id, new.name, new.brand, new.tags, new.description);
+    END
+    """,
+]
+
+def tokenize(term: str):
+    return _TOKEN_RE.findall(term.lower())[:MAX_TERMS]
+
+# Create (or no-op if present) the text index for the connection's backend
+def create_search_index(conn):
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        for ddl in POSTGRES_DDL:
+            conn.execute(text(ddl))
+    elif dialect == "sqlite":
+        existed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'product_fts'")
+        ).first()
+        for ddl in SQLITE_DDL:
+            conn.execute(text(ddl))
+        if not existed:
+            # Index rows that were there before the FTS table
+            conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    else:
+        logger.warning(f"No text index for dialect {dialect}; search will scan")
+
+def _next_prefix(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _sqlite_expand_token(session: Session, token: str):
+    """Return the token plus close spellings from the FTS vocabulary when it has no prefix hit."""
+    hit = session.execute(
+        text("SELECT 1 FROM product_fts_vocab WHERE term >= :lo AND term < :hi LIMIT 1"),
+        {"lo": token, "hi": _next_prefix(token)},
+    ).first()
+    if hit or len(token) < 4:
+        return [token]
+
+    # Only compare against terms sharing the first letter and a similar length
+    candidates = session.execute(
+        text(
+            "SELECT term FROM product_fts_vocab "
+            "WHERE term >= :lo AND term < :hi AND length(term) BETWEEN :min_len AND :max_len"
+        ),
+        {"lo": token[0], "hi": _next_prefix(token[0]), "min_len": len(token) - 2, "max_len": len(token) + 2},
+    ).scalars().all()
+    return [token] + difflib.get_close_matches(token, candidates, n=TYPO_CANDIDATES, cutoff=TYPO_CUTOFF)
+
+def _sqlite_matches(session: Session, tokens):
+    groups = []
+    for token in tokens:
+        variants = _sqlite_expand_token(session, token)
+        groups.append("(" + " OR ".join(f'"{variant}"*' for variant in variants) + ")")
+
+    fts = table("product_fts", column("rowid"), column("rank"))
+    return (
+        select(
+            fts.c.rowid.label("id"),
+            # FTS5 rank is bm25, where lower is better
+            (-fts.c.rank).label("rank"),
+        )
+        .where(text("product_fts MATCH :fts_query").bindparams(fts_query=" AND ".join(groups)))
+        .subquery("search_matches")
+    )
+
+def _postgres_matches(term: str, tokens):
+    vector = literal_column("product.search_vector")
+    # Every token is matched as a prefix; tokens are \w+ so they need no escaping
+    query = func.to_tsquery(TS_CONFIG, " & ".join(f"{token}:*" for token in tokens))
+    phrase = term.lower().strip()
+    return (
+        select(
+            Product.id.label("id"),
+            (func.ts_rank_cd(vector, query) + func.word_similarity(phrase, func.lower(Product.name))).label("rank"),
+        )
+        .where(or_(
+            vector.op("@@")(query),
+            # Trigram word similarity catches misspellings (served by the trigram index)
+            literal(phrase).op("<%")(func.lower(Product.name)),
+        ))
+        .subquery("search_matches")
+    )
+
+def _like_matches(term: str):
+    pattern = f"%{term.lower()}%"
+    return (
+        select(Product.id.label("id"), literal(0.0).label("rank"))
+        .where(or_(
+            func.lower(Product.name).like(pattern),
+            func.lower(Product.brand).like(pattern),
+            func.lower(Product.description).like(pattern),
+            func.lower(Product.tags).like(pattern),
+        ))
+        .subquery("search_matches")
+    )
+
+# Subquery of (id, rank) for products matching `term`, higher rank = more relevant
+def match_products(session: Session, term: str):
+    tokens = tokenize(term)
+    dialect = session.get_bind().dialect.name
+    if not tokens:
+        return _like_matches(term)
+    if dialect == "postgresql":
+        return _postgres_matches(term, tokens)
+    if dialect == "sqlite":
+        return _sqlite_matches(session, tokens)
+    return _like_matches(term)
@@ -1,25 +1,90 @@
+import copy
+import json
+import time
+import threading
+from collections import Counter
 import streamlit as st
 import requests
 import pandas as pd
 import matplotlib.pyplot as plt
+import pyarrow as pa
 
-API_BASE = "http://localhost:8000"  # Change if your backend URL is different
+API_BASE = "http://localhost:8000/api"  # Change if your backend URL is different
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+CACHE_TTL = 60   # Seconds an API response is reused across reruns; writes clear it at once
+PAGE_SIZE = 25
+# Columns the product list shows and edits; the rest stay on the server
+LIST_FIELDS = "name,price,rating,category,stock,description,image_url"
+LIVE_REFRESH_SECONDS = 2      # Dashboard redraw interval; redraws use local state only
+LIVE_RESYNC_SECONDS = 300     # Full stats reload, to shed any drift from missed deltas
 
 # --- API calls ---
 
+@st.cache_resource
+def http_session():
+    """One keep-alive connection pool shared by every rerun and browser session."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _get_products(params):
+    resp = http_session().get(
+        f"{API_BASE}/products", params=params, headers={"Accept": ARROW_MEDIA_TYPE}, timeout=5
+    )
+    resp.raise_for_status()
+    table = pa.ipc.open_stream(pa.py_buffer(resp.content)).read_all()
+    next_cursor = (table.schema.metadata or {}).get(b"next_cursor")
+    return table, next_cursor.decode() if next_cursor else None
+
+def _request_stats(session, params=None):
+    """ProductStats as a dict, sent as a one-row Arrow table rather than JSON."""
+    resp = session.get(
+        f"{API_BASE}/products/stats", params=params, headers={"Accept": ARROW_MEDIA_TYPE}, timeout=5
+    )
+    resp.raise_for_status()
+    # The breakdowns arrive as list<struct> columns and come back as lists of dicts
+    return pa.ipc.open_stream(pa.py_buffer(resp.content)).read_all().to_pylist()[0]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _get_total(params):
+    # An empty offset page: only the listing count runs, and exact=false lets it use the facet counts
+    resp = http_session().get(
+        f"{API_BASE}/products", params={**params, "limit": 0, "fields": "id", "exact": "false"},
+        headers={"Accept": ARROW_MEDIA_TYPE}, timeout=5,
+    )
+    resp.raise_for_status()
+    metadata = pa.ipc.open_stream(pa.py_buffer(resp.content)).schema.metadata or {}
+    return int(metadata[b"total"]), metadata.get(b"total_is_estimate") == b"true"
+
+def invalidate_cache():
+    # Every cached listing and aggregate may include the product just written
+    _get_products.clear()
+    _get_total.clear()
+
 def fetch_products(params=None):
+    """(Arrow table, next cursor) for a listing page, read straight from the response buffer."""
     try:
-        resp = requests.get(f"{API_BASE}/products", params=params or {}, timeout=5)
-        resp.raise_for_status()
-        return resp.json()
+        return _get_products(params or {})
     except Exception as e:
         st.error(f"Failed to fetch products: {e}")
-        return {"total": 0, "items": []}
+        return pa.table({}), None
+
+def fetch_total(filters=None):
+    """(matching product count, whether it is an estimate), or None if the request failed."""
+    try:
+        return _get_total(filters or {})
+    except Exception as e:
+        st.error(f"Failed to count products: {e}")
+        return None
 
 def create_product(data):
     try:
-        resp = requests.post(f"{API_BASE}/products", json=data, timeout=5)
+        resp = http_session().post(f"{API_BASE}/products", json=data, timeout=5)
         resp.raise_for_status()
+        invalidate_cache()
         return True
     except Exception as e:
         st.error(f"Failed to create product: {e}")
@@ -27,8 +92,9 @@ def create_product(data):
 
 def update_product(product_id, data):
     try:
-        resp = requests.put(f"{API_BASE}/products/{product_id}", json=data, timeout=5)
+        resp = http_session().put(f"{API_BASE}/products/{product_id}", json=data, timeout=5)
         resp.raise_for_status()
+        invalidate_cache()
         return True
     except Exception as e:
         st.error(f"Failed to update product: {e}")
@@ -36,53 +102,187 @@ def update_product(product_id, data):
 
 def delete_product(product_id):
     try:
-        resp = requests.delete(f"{API_BASE}/products/{product_id}", timeout=5)
+        resp = http_session().delete(f"{API_BASE}/products/{product_id}", timeout=5)
         resp.raise_for_status()
+        invalidate_cache()
         return True
     except Exception as e:
         st.error(f"Failed to delete product: {e}")
         return False
 
+# --- Live dashboard ---
+
+class LiveStats:
+    """Dashboard aggregates loaded once, then kept current from the /products/events delta feed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+        self.loaded_at = 0.0
+        self.activity = Counter()   # views / purchases seen on the feed
+        self.connected = False
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def snapshot(self):
+        """(stats, activity, connected) for one redraw; reloads the stats if missing or old."""
+        with self.lock:
+            stale = self.stats is None or time.monotonic() - self.loaded_at > LIVE_RESYNC_SECONDS
+        if stale:
+            self._reload()
+        with self.lock:
+            return copy.deepcopy(self.stats), dict(self.activity), self.connected
+
+    def _reload(self):
+        try:
+            stats = _request_stats(http_session())
+        except Exception as e:
+            st.error(f"Failed to fetch stats: {e}")
+            return
+        with self.lock:
+            self.stats = stats
+            self.loaded_at = time.monotonic()
+
+    def _follow(self):
+        # Own session: this connection stays open for as long as the app runs
+        session = requests.Session()
+        while True:
+            try:
+                with session.get(f"{API_BASE}/products/events", stream=True, timeout=(5, 60)) as resp:
+                    resp.raise_for_status()
+                    with self.lock:
+                        # Deltas may have been missed while disconnected
+                        self.stats = None
+                        self.connected = True
+                    for line in resp.iter_lines():
+                        if line.startswith(b"data: "):
+                            self._apply(json.loads(line[6:]))
+            except Exception:
+                pass
+            self.connected = False
+            time.sleep(3)
+
+    def _apply(self, deltas):
+        with self.lock:
+            for delta in deltas:
+                kind = delta["type"]
+                if kind == "counters":
+                    for counts in delta["changes"].values():
+                        self.activity.update(counts)
+                elif self.stats is None:
+                    continue
+                elif kind == "reset":
+                    self.stats = None
+                elif kind == "created":
+                    self._count(delta["product"], 1)
+                elif kind == "deleted":
+                    self._count(delta["product"], -1)
+                    self.stats["top_rated"] = [row for row in self.stats["top_rated"] if row["id"] != delta["id"]]
+                elif kind == "updated":
+                    changes = delta["changes"]
+                    old = {name: values[0] for name, values in changes.items()}
+                    new = {name: values[1] for name, values in changes.items()}
+                    self._count(old, -1, partial=True)
+                    self._count(new, 1, partial=True)
+                    for row in self.stats["top_rated"]:
+                        if row["id"] == delta["id"]:
+                            row.update(new)
+
+    def _count(self, product, sign, partial=False):
+        """Add (sign=1) or remove (sign=-1) a product's contribution; partial: only the fields given."""
+        stats = self.stats
+        total = stats["total"]
+        if not partial:
+            stats["total"] = total + sign
+        if "price" in product:
+            price_sum = (stats["average_price"] or 0) * total + sign * product["price"]
+            stats["average_price"] = price_sum / stats["total"] if stats["total"] else None
+            self._bucket(product["price"], sign)
+        if product.get("rating") is not None:
+            rated = stats["rated"]
+            rating_sum = (stats["average_rating"] or 0) * rated + sign * product["rating"]
+            stats["rated"] = rated + sign
+            stats["average_rating"] = rating_sum / stats["rated"] if stats["rated"] else None
+        if "stock" in product:
+            stats["total_stock"] += sign * (product["stock"] or 0)
+        if "category" in product:
+            for row in stats["categories"]:
+                if row["category"] == product["category"]:
+                    row["count"] += sign
+                    break
+            else:
+                stats["categories"].append({"category": product["category"], "count": sign})
+
+    def _bucket(self, price, sign):
+        buckets = self.stats["price_histogram"]
+        if not buckets:
+            return
+        width = (buckets[0]["max"] - buckets[0]["min"]) or 1.0
+        index = min(max(int((price - buckets[0]["min"]) / width), 0), len(buckets) - 1)
+        buckets[index]["count"] += sign
+
+@st.cache_resource
+def live_stats():
+    # One feed connection per Streamlit server, shared by every browser session
+    return LiveStats()
+
 # --- UI functions ---
 
-def show_dashboard(products):
+def show_dashboard(stats):
     st.title("📊 Product Dashboard & Insights")
 
-    if not products:
+    if not stats or not stats["total"]:
         st.warning("No products to show.")
         return
 
-    df = pd.DataFrame(products)
+    average_price = stats["average_price"] or 0
+    average_rating = stats["average_rating"] or 0
 
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Products", len(df))
-    col2.metric("Average Price", f"₹{df['price'].mean():.2f}")
-    col3.metric("Average Rating", f"{df['rating'].mean():.2f} ⭐")
-    col4.metric("Total Stock", int(df['stock'].sum()))
+    col1.metric("Total Products", stats["total"])
+    col2.metric("Average Price", f"₹{average_price:.2f}")
+    col3.metric("Average Rating", f"{average_rating:.2f} ⭐")
+    col4.metric("Total Stock", int(stats["total_stock"]))
 
     st.markdown("### Category Distribution")
-    cat_counts = df['category'].value_counts()
+    cat_counts = pd.Series(
+        {row["category"] or "Uncategorised": row["count"] for row in stats["categories"]}
+    )
     fig1, ax1 = plt.subplots()
     ax1.pie(cat_counts, labels=cat_counts.index, autopct='%1.1f%%', startangle=140)
     ax1.axis('equal')
     st.pyplot(fig1)
 
     st.markdown("### Price Distribution")
+    buckets = stats["price_histogram"]
     fig2, ax2 = plt.subplots()
-    ax2.hist(df['price'], bins=20, color='skyblue', edgecolor='black')
+    ax2.bar(
+        [bucket["min"] for bucket in buckets],
+        [bucket["count"] for bucket in buckets],
+        width=[bucket["max"] - bucket["min"] for bucket in buckets],
+        align="edge", color='skyblue', edgecolor='black',
+    )
     ax2.set_xlabel("Price (₹)")
     ax2.set_ylabel("Number of Products")
     st.pyplot(fig2)
 
     st.markdown("### 🔥 Trending Products (Top Rated)")
-    trending = df.sort_values(by='rating', ascending=False).head(5)
-    for _, row in trending.iterrows():
+    for row in stats["top_rated"]:
         st.write(f"**{row['name']}** - ₹{row['price']} - ⭐ {row['rating']}")
         if row.get("image_url") and row["image_url"].startswith("http"):
             st.image(row["image_url"], width=120)
-        st.write(f"*{row.get('description', 'No description')}*")
+        st.write(f"*{row.get('description') or 'No description'}*")
         st.markdown("---")
 
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def show_live_dashboard():
+    # Aggregated server-side once, then moved along by the change feed: redraws make no API calls
+    stats, activity, connected = live_stats().snapshot()
+    show_dashboard(stats)
+    st.caption(
+        f"{'🟢 Live' if connected else '🔴 Reconnecting'} · "
+        f"{activity.get('views', 0)} views, {activity.get('purchase_count', 0)} purchases since the feed started"
+    )
+
 def show_product_list():
     st.title("📦 Product List & Management")
 
@@ -92,34 +292,61 @@ def show_product_list():
     category = st.sidebar.text_input("Category")
     min_price = st.sidebar.number_input("Min Price", min_value=0.0, value=0.0)
     max_price = st.sidebar.number_input("Max Price", min_value=0.0, value=100000.0)
-    sort_by = st.sidebar.selectbox("Sort By", options=["", "price", "rating", "name"])
+    sort_by = st.sidebar.selectbox("Sort By", options=["", "price", "created_at", "name"])
     order = st.sidebar.radio("Order", options=["asc", "desc"])
 
-    params = {
-        "search": search if search else None,
-        "category": category if category else None,
-        "min_price": min_price if min_price > 0 else None,
-        "max_price": max_price if max_price > 0 else None,
-        "sort_by": sort_by if sort_by else None,
-        "order": order,
+    filters = {
+        key: value for key, value in {
+            "search": search or None,
+            "category": category or None,
+            "min_price": min_price if min_price > 0 else None,
+            "max_price": max_price if max_price > 0 else None,
+        }.items() if value is not None
     }
-
-    data = fetch_products(params)
-    total = data.get("total", 0)
-    items = data.get("items", [])
-
-    if not items:
+    listing = {**filters, "order": order, **({"sort_by": sort_by} if sort_by else {})}
+
+    # Keyset pages: cursors[i] opens page i. Changing the filters starts over.
+    if st.session_state.get("listing") != listing:
+        st.session_state["listing"] = listing
+        st.session_state["cursors"] = [None]
+    cursors = st.session_state["cursors"]
+    page = len(cursors) - 1
+
+    params = {**listing, "pagination": "cursor", "limit": PAGE_SIZE, "fields": LIST_FIELDS}
+    if cursors[-1]:
+        params["cursor"] = cursors[-1]
+    table, next_cursor = fetch_products(params)
+
+    if not table.num_rows and page > 0:
+        # The last rows of this page were deleted
+        cursors.pop()
+        st.rerun()
+    if not table.num_rows:
         st.warning("No products found with current filters.")
         return
 
-    df = pd.DataFrame(items)
-
-    st.write(f"### Total products found: {total}")
+    counted = fetch_total(filters)
+    if counted:
+        total, estimate = counted
+        st.write(f"### Total products found: {'about ' if estimate else ''}{total}")
+
+    # Only this page is in the grid, which loads thumbnails for the rows on screen
+    st.dataframe(
+        table,
+        column_config={"image_url": st.column_config.ImageColumn("Image")},
+    )
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    prev_col.button("← Previous", disabled=page == 0, on_click=cursors.pop)
+    page_col.write(f"Page {page + 1}")
+    next_col.button("Next →", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
 
     # Select product to edit/delete
-    product_names = df["name"].tolist()
-    selected_product_name = st.radio("Select product to Edit / Delete", options=product_names)
-    selected_product = df[df["name"] == selected_product_name].iloc[0]
+    products = {row["id"]: row for row in table.to_pylist()}
+    selected_id = st.selectbox(
+        "Select product to Edit / Delete", options=list(products),
+        format_func=lambda product_id: f"{products[product_id]['name']} (#{product_id})",
+    )
+    selected_product = products[selected_id]
 
     st.markdown(f"## Editing: {selected_product['name']}")
 
@@ -151,12 +378,12 @@ def show_product_list():
             }
             if update_product(selected_product["id"], updated_data):
                 st.success("Product updated successfully!")
-                st.experimental_rerun()
+                st.rerun()
 
         if delete_btn:
             if delete_product(selected_product["id"]):
                 st.success("Product deleted successfully!")
-                st.experimental_rerun()
+                st.rerun()
 
 def show_add_product():
     st.title("➕ Add New Product")
@@ -186,7 +413,7 @@ def show_add_product():
             }
             if create_product(new_data):
                 st.success("Product added successfully!")
-                st.experimental_rerun()
+                st.rerun()
 
 def main():
     st.sidebar.title("Navigation")
@@ -194,9 +421,7 @@ def main():
     choice = st.sidebar.radio("Go to", options)
 
     if choice == "Dashboard":
-        # Pass limit param properly as dict
-        all_products = fetch_products(params={"limit": 1000}).get("items", [])
-        show_dashboard(all_products)
+        show_live_dashboard()
     elif choice == "Product List":
         show_product_list()
     elif choice == "Add Product":
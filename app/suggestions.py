@@ -0,0 +1,281 @@
+# app/suggestions.py
+#
+# Precomputed "similar products" index. Each product becomes a NumPy feature
+# vector (hashed tags and brand, log-price, rating) and its top
+# SUGGEST_NEIGHBOURS neighbours within the same category are computed up
+# front, so a suggestion lookup is a dict hit plus an array slice.
+#
+# Similarity between a product p and a candidate c:
+#     cosine(tags+brand of p, of c)
+#     - PRICE_WEIGHT * |log(1 + price_p) - log(1 + price_c)|
+#     + RATING_WEIGHT * rating_c / 5
+#
+# Writes made through the CRUD layer update the index in place: the new
+# product gets its own neighbour list and is merged into the lists of the
+# products it beats. Lists that lose a deleted neighbour are recomputed on
+# their next lookup. Each worker keeps its own index, so a full rebuild every
+# SUGGEST_REBUILD_SECONDS picks up writes made elsewhere (other workers,
+# the CSV loader). The index is saved to SUGGEST_INDEX_PATH for warm restarts.
+
+import os
+import math
+import zlib
+import logging
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from app.live_index import LiveIndex, product_field
+from app.models.product import Product
+
+logger = logging.getLogger("suggestions")
+logger.setLevel(logging.INFO)
+
+FEATURE_DIMS = int(os.getenv("SUGGEST_FEATURE_DIMS", 256))
+NEIGHBOURS = int(os.getenv("SUGGEST_NEIGHBOURS", 20))
+TAG_WEIGHT = float(os.getenv("SUGGEST_TAG_WEIGHT", 1.0))
+BRAND_WEIGHT = float(os.getenv("SUGGEST_BRAND_WEIGHT", 0.6))
+PRICE_WEIGHT = float(os.getenv("SUGGEST_PRICE_WEIGHT", 0.5))
+RATING_WEIGHT = float(os.getenv("SUGGEST_RATING_WEIGHT", 0.2))
+INDEX_PATH = os.getenv("SUGGEST_INDEX_PATH", "suggestions_index.npz")
+REBUILD_SECONDS = int(os.getenv("SUGGEST_REBUILD_SECONDS", 900))
+BLOCK_CELLS = 4_000_000  # Bounds the score matrix held at once (16 MB of float32)
+INDEX_VERSION = 1
+
+# Product fields the index reads
+FEATURE_FIELDS = ("id", "tags", "brand", "category", "price", "rating")
+
+def _slot(kind: str, value: str) -> int:
+    # crc32 rather than hash() so slots are stable across processes and restarts
+    return zlib.crc32(f"{kind}:{value}".encode()) % FEATURE_DIMS
+
+def featurize(products):
+    """(features, log_price, rating) arrays for a list of products or dicts."""
+    features = np.zeros((len(products), FEATURE_DIMS), dtype=np.float32)
+    log_price = np.zeros(len(products), dtype=np.float32)
+    rating = np.zeros(len(products), dtype=np.float32)
+    for row, product in enumerate(products):
+        tags = [tag.strip().lower() for tag in (product_field(product, "tags") or "").split(",") if tag.strip()]
+        for tag in tags:
+            features[row, _slot("tag", tag)] += TAG_WEIGHT / math.sqrt(len(tags))
+        brand = (product_field(product, "brand") or "").strip().lower()
+        if brand:
+            features[row, _slot("brand", brand)] += BRAND_WEIGHT
+        log_price[row] = math.log1p(max(product_field(product, "price") or 0.0, 0.0))
+        rating[row] = (product_field(product, "rating") or 0.0) / 5.0
+
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    np.divide(features, norms, out=features, where=norms > 0)
+    return features, log_price, rating
+
+class SuggestionIndex:
+    """Neighbour lists for every categorised product, kept in growable arrays."""
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.features = np.zeros((capacity, FEATURE_DIMS), dtype=np.float32)
+        self.log_price = np.zeros(capacity, dtype=np.float32)
+        self.rating = np.zeros(capacity, dtype=np.float32)
+        self.category = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Neighbour product ids (-1 = empty) and their scores, best first
+        self.neighbours = np.full((capacity, NEIGHBOURS), -1, dtype=np.int64)
+        self.scores = np.full((capacity, NEIGHBOURS), -np.inf, dtype=np.float32)
+        self.categories: Dict[str, int] = {}
+        self._row: Dict[int, int] = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._row)
+
+    # Array housekeeping
+    def _grow(self, needed: int):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ("ids", "features", "log_price", "rating", "category", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        neighbours = np.full((capacity, NEIGHBOURS), -1, dtype=np.int64)
+        neighbours[:self.size] = self.neighbours[:self.size]
+        scores = np.full((capacity, NEIGHBOURS), -np.inf, dtype=np.float32)
+        scores[:self.size] = self.scores[:self.size]
+        self.neighbours, self.scores = neighbours, scores
+
+    def _category_rows(self, code: int) -> np.ndarray:
+        return np.flatnonzero((self.category[:self.size] == code) & self.alive[:self.size])
+
+    def _score(self, rows: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """len(rows) x len(candidates) similarity matrix; a row never matches itself."""
+        scores = self.features[rows] @ self.features[candidates].T
+        scores -= PRICE_WEIGHT * np.abs(self.log_price[rows, None] - self.log_price[None, candidates])
+        scores += RATING_WEIGHT * self.rating[None, candidates]
+        # candidates is sorted (np.flatnonzero), so each row's own column is a binary search away
+        positions = np.searchsorted(candidates, rows)
+        own = positions < len(candidates)
+        own[own] = candidates[positions[own]] == rows[own]
+        scores[np.flatnonzero(own), positions[own]] = -np.inf
+        return scores
+
+    def _fill(self, rows: np.ndarray, candidates: np.ndarray):
+        """Recompute the neighbour lists of rows from scratch."""
+        k = min(NEIGHBOURS, len(candidates))
+        block_rows = max(1, BLOCK_CELLS // max(len(candidates), 1))
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            self.neighbours[block] = -1
+            self.scores[block] = -np.inf
+            if k == 0:
+                continue
+            scores = self._score(block, candidates)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            found = np.isfinite(top_scores)
+            self.neighbours[block, :k] = np.where(found, self.ids[candidates][top], -1)
+            self.scores[block, :k] = np.where(found, top_scores, -np.inf)
+
+    # Public operations
+    def build(self, products):
+        """Index products from scratch (used for full rebuilds)."""
+        with self._lock:
+            products = [product for product in products if product_field(product, "category")]
+            self._grow(len(products))
+            features, log_price, rating = featurize(products)
+            count = len(products)
+            self.size = count
+            self.ids[:count] = [product_field(product, "id") for product in products]
+            self.features[:count] = features
+            self.log_price[:count] = log_price
+            self.rating[:count] = rating
+            self.category[:count] = [
+                self.categories.setdefault(product_field(product, "category"), len(self.categories))
+                for product in products
+            ]
+            self.alive[:count] = True
+            self._row = {int(product_id): row for row, product_id in enumerate(self.ids[:count])}
+            for code in self.categories.values():
+                rows = self._category_rows(code)
+                self._fill(rows, rows)
+
+    def upsert(self, products):
+        """Add or re-index products, merging each into its neighbours' lists.
+
+        The lock is taken per product, so lookups wait for one product rather
+        than the whole batch; meanwhile they fall back to the database.
+        """
+        self.remove([product_field(product, "id") for product in products])
+        products = [product for product in products if product_field(product, "category")]
+        if not products:
+            return
+        features, log_price, rating = featurize(products)
+        for offset, product in enumerate(products):
+            with self._lock:
+                self._grow(self.size + 1)
+                row = self.size
+                self.size += 1
+                self.ids[row] = product_field(product, "id")
+                self.features[row] = features[offset]
+                self.log_price[row] = log_price[offset]
+                self.rating[row] = rating[offset]
+                self.category[row] = self.categories.setdefault(product_field(product, "category"), len(self.categories))
+                self.alive[row] = True
+                self._row[int(self.ids[row])] = row
+
+                candidates = self._category_rows(self.category[row])
+                self._fill(np.array([row]), candidates)
+                # Does the new product beat the weakest neighbour of anyone in its category?
+                scores = self._score(candidates, np.array([row]))[:, 0]
+                beaten = scores > self.scores[candidates, -1]
+                for candidate, score in zip(candidates[beaten], scores[beaten]):
+                    position = np.searchsorted(-self.scores[candidate], -score)
+                    self.neighbours[candidate, position + 1:] = self.neighbours[candidate, position:-1].copy()
+                    self.scores[candidate, position + 1:] = self.scores[candidate, position:-1].copy()
+                    self.neighbours[candidate, position] = self.ids[row]
+                    self.scores[candidate, position] = score
+
+    def remove(self, product_ids):
+        with self._lock:
+            rows = [self._row.pop(int(product_id)) for product_id in product_ids if int(product_id) in self._row]
+            if not rows:
+                return
+            self.alive[rows] = False
+            self._dirty.difference_update(rows)
+            removed = self.ids[rows]
+            # Lists that pointed at a removed product are recomputed when next read
+            affected = np.isin(self.neighbours[:self.size], removed).any(axis=1) & self.alive[:self.size]
+            self._dirty.update(np.flatnonzero(affected).tolist())
+
+    def lookup(self, product_id: int, limit: int) -> Optional[List[int]]:
+        """Neighbour ids best first, or None if the product isn't indexed."""
+        with self._lock:
+            row = self._row.get(product_id)
+            if row is None:
+                return None
+            if row in self._dirty:
+                self._fill(np.array([row]), self._category_rows(self.category[row]))
+                self._dirty.discard(row)
+            neighbours = self.neighbours[row, :limit]
+            return neighbours[neighbours >= 0].tolist()
+
+    # Persistence
+    def save(self, path: str):
+        with self._lock:
+            rows = np.flatnonzero(self.alive[:self.size])
+            names = np.array(sorted(self.categories, key=self.categories.get), dtype=object)
+            meta = np.array([INDEX_VERSION, FEATURE_DIMS, NEIGHBOURS], dtype=np.int64)
+            arrays = {name: getattr(self, name)[rows] for name in (
+                "ids", "features", "log_price", "rating", "category", "neighbours", "scores"
+            )}
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, meta=meta, categories=names.astype(str), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SuggestionIndex"]:
+        with np.load(path, allow_pickle=False) as data:
+            if data["meta"].tolist() != [INDEX_VERSION, FEATURE_DIMS, NEIGHBOURS]:
+                return None
+            index = cls(capacity=max(len(data["ids"]), 1))
+            index.size = len(data["ids"])
+            for name in ("ids", "features", "log_price", "rating", "category", "neighbours", "scores"):
+                getattr(index, name)[:index.size] = data[name]
+            index.alive[:index.size] = True
+            index.categories = {name: code for code, name in enumerate(data["categories"].tolist())}
+        index._row = {int(product_id): row for row, product_id in enumerate(index.ids[:index.size])}
+        return index
+
+# ----------------------------------
+# Process-wide index
+# ----------------------------------
+live_index = LiveIndex(
+    "suggestion", SuggestionIndex, FEATURE_FIELDS, REBUILD_SECONDS,
+    path=INDEX_PATH, where=Product.category.is_not(None),
+)
+
+def index_products(products):
+    """Hook for product writes: (re)index created or updated products."""
+    live_index.upsert(products)
+
+def remove_products(product_ids):
+    """Hook for product deletes."""
+    live_index.remove(product_ids)
+
+def neighbours(product_id: int, limit: int) -> Optional[List[int]]:
+    """Suggested product ids, or None when the index can't answer for this product."""
+    index = live_index.index
+    if index is None:
+        return None
+    return index.lookup(product_id, limit)
+
+def start_suggestion_index(engine):
+    live_index.start(engine)
+
+def save_suggestion_index():
+    live_index.save()
@@ -0,0 +1,200 @@
+# app/trending.py
+#
+# Time-decayed trending leaderboards. Every view/purchase adds a weighted
+# score to one Redis sorted set per (window, scope): global, the product's
+# category, its region and its category+region pair. Reads are a
+# ZREVRANGE, O(log n + limit), and never touch the database.
+#
+# Decay is by score inflation: an event at time t scores
+# weight * 2 ** ((t - era_start) / half_life), so newer events outweigh older
+# ones exactly as if every score decayed continuously, without rewriting
+# anything. To keep the exponent bounded each window restarts its sets every
+# ERA_HALF_LIVES half-lives; reads fold in the previous era's set scaled
+# down to the current base, so nothing drops off at the boundary.
+#
+# While Redis is unavailable the same sets are kept in process memory.
+
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.cache import LocalCache, aredis_call, redis_call
+from app.db import async_read_engine
+from app.models.product import Product
+
+logger = logging.getLogger("trending")
+logger.setLevel(logging.INFO)
+
+# Window name -> half-life in seconds
+TRENDING_WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+DEFAULT_WINDOW = "24h"
+ERA_HALF_LIVES = 32
+VIEW_WEIGHT = float(os.getenv("TRENDING_VIEW_WEIGHT", 1))
+PURCHASE_WEIGHT = float(os.getenv("TRENDING_PURCHASE_WEIGHT", 10))
+# Counter column -> trending weight per unit
+COUNTER_WEIGHTS = {"views": VIEW_WEIGHT, "purchase_count": PURCHASE_WEIGHT}
+# Read a few extra ids per era so merging the two eras stays accurate
+READ_FANOUT = 2
+SCOPE_CACHE_TTL = int(os.getenv("TRENDING_SCOPE_CACHE_TTL", 300))
+
+KEY_PREFIX = "trending:"
+
+# product id -> (category, region), so events only need the id
+_scopes = LocalCache(max_entries=int(os.getenv("TRENDING_SCOPE_CACHE_ENTRIES", 10000)))
+
+_memory = {}
+_memory_lock = threading.Lock()
+
+def scope_name(category: Optional[str] = None, region: Optional[str] = None) -> str:
+    parts = []
+    if category:
+        parts.append(f"category:{category}")
+    if region:
+        parts.append(f"region:{region}")
+    return "|".join(parts) or "all"
+
+def _product_scopes(category: Optional[str], region: Optional[str]) -> List[str]:
+    scopes = ["all"]
+    if category:
+        scopes.append(scope_name(category))
+    if region:
+        scopes.append(scope_name(region=region))
+    if category and region:
+        scopes.append(scope_name(category, region))
+    return scopes
+
+def _era(window: str, now: float) -> Tuple[int, float]:
+    """(era number, era start) for window at time now."""
+    era_seconds = TRENDING_WINDOWS[window] * ERA_HALF_LIVES
+    era = int(now // era_seconds)
+    return era, era * era_seconds
+
+def _key(window: str, era: int, scope: str) -> str:
+    return f"{KEY_PREFIX}{window}:{era}:{scope}"
+
+def remember_scope(product_id: int, category: Optional[str], region: Optional[str]):
+    _scopes.set(product_id, (category, region), SCOPE_CACHE_TTL)
+
+async def product_scope(product_id: int):
+    """(category, region) for a product, or None if it doesn't exist."""
+    scope, state = _scopes.get(product_id)
+    if state == "fresh":
+        return scope
+    async with AsyncSession(async_read_engine()) as session:
+        scope = (await session.exec(
+            select(Product.category, Product.region).where(Product.id == product_id)
+        )).first()
+    if scope is not None:
+        scope = tuple(scope)
+        remember_scope(product_id, *scope)
+    return scope
+
+# ----------------------------------
+# Recording
+# ----------------------------------
+def _increments(product_id: int, category, region, weight: float, now: float):
+    """(key, increment, ttl) for every set this event lands in."""
+    for window, half_life in TRENDING_WINDOWS.items():
+        era, start = _era(window, now)
+        increment = weight * 2 ** ((now - start) / half_life)
+        # The set is still read as the previous era for one more era
+        ttl = int(half_life * ERA_HALF_LIVES * 2)
+        for scope in _product_scopes(category, region):
+            yield _key(window, era, scope), increment, ttl
+
+def _record_in_memory(increments, member: str, now: float):
+    with _memory_lock:
+        for key, increment, _ in increments:
+            _memory.setdefault(key, Counter())[member] += increment
+        # Forget eras that are no longer read
+        for key in list(_memory):
+            window, era, _ = key[len(KEY_PREFIX):].split(":", 2)
+            if int(era) < _era(window, now)[0] - 1:
+                del _memory[key]
+
+async def record_activity(product_id: int, category: Optional[str], region: Optional[str], weight: float):
+    now = time.time()
+    increments = list(_increments(product_id, category, region, weight, now))
+    member = str(product_id)
+
+    async def run(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for key, increment, ttl in increments:
+                pipe.zincrby(key, increment, member)
+                pipe.expire(key, ttl)
+            return await pipe.execute()
+
+    if await aredis_call(f"trending for {product_id}", run) is None:
+        _record_in_memory(increments, member, now)
+
+async def record_counter(product_id: int, column: str, amount: int = 1):
+    """Score a counter event (see COUNTER_WEIGHTS) on the product's leaderboards."""
+    scope = await product_scope(product_id)
+    if scope is None:
+        return
+    await record_activity(product_id, *scope, COUNTER_WEIGHTS[column] * amount)
+
+# ----------------------------------
+# Reading
+# ----------------------------------
+def _merge(current, previous, limit: int, window: str, now: float) -> List[Tuple[int, float]]:
+    """Top `limit` (product id, decayed score) over the current and previous era."""
+    _, start = _era(window, now)
+    scores = Counter()
+    for member, score in current:
+        scores[int(member)] += score
+    for member, score in previous:
+        scores[int(member)] += score * 2 ** -ERA_HALF_LIVES
+    decay = 2 ** (-(now - start) / TRENDING_WINDOWS[window])
+    return [(product_id, score * decay) for product_id, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])]
+
+def _read_keys(window: str, scope: str, now: float):
+    era, _ = _era(window, now)
+    return _key(window, era, scope), _key(window, era - 1, scope)
+
+def _memory_top(keys, count: int):
+    with _memory_lock:
+        return [
+            heapq.nlargest(count, _memory.get(key, Counter()).items(), key=lambda item: item[1])
+            for key in keys
+        ]
+
+def top_products(window: str = DEFAULT_WINDOW, category: Optional[str] = None,
+                 region: Optional[str] = None, limit: int = 10) -> List[Tuple[int, float]]:
+    """[(product id, decayed score)] best first; empty when nothing has trended yet."""
+    now = time.time()
+    keys = _read_keys(window, scope_name(category, region), now)
+    count = limit * READ_FANOUT
+
+    def run(client):
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrevrange(key, 0, count - 1, withscores=True)
+        return pipe.execute()
+
+    ranked = redis_call(f"trending {keys[0]}", run)
+    if ranked is None:
+        ranked = _memory_top(keys, count)
+    return _merge(ranked[0], ranked[1], limit, window, now)
+
+async def atop_products(window: str = DEFAULT_WINDOW, category: Optional[str] = None,
+                        region: Optional[str] = None, limit: int = 10) -> List[Tuple[int, float]]:
+    now = time.time()
+    keys = _read_keys(window, scope_name(category, region), now)
+    count = limit * READ_FANOUT
+
+    async def run(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.zrevrange(key, 0, count - 1, withscores=True)
+            return await pipe.execute()
+
+    ranked = await aredis_call(f"trending {keys[0]}", run)
+    if ranked is None:
+        ranked = _memory_top(keys, count)
+    return _merge(ranked[0], ranked[1], limit, window, now)
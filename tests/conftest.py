@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+# app.db and app.cache build their engines and clients at import time, so the
+# environment has to point at throwaway resources before anything imports app
+_tmp = tempfile.mkdtemp(prefix="product-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("REDIS_URL", "")
+os.environ.setdefault("SUGGEST_INDEX_PATH", os.path.join(_tmp, "suggestions_index.npz"))
+# Tests flush buffered events themselves
+os.environ.setdefault("EVENT_FLUSH_INTERVAL", "3600")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def make_product(client):
+    def make(**fields):
+        response = client.post("/api/products", json={
+            "name": f"Test {uuid.uuid4().hex[:8]}",
+            "description": "Test product",
+            "price": 100.0,
+            "category": "tests",
+            "brand": "Acme",
+            "stock": 10,
+            **fields,
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    return make
@@ -0,0 +1,95 @@
+import time
+import uuid
+import pytest
+import redis
+import redis.asyncio as aioredis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+from app import cache
+
+@pytest.fixture
+def redis_down(monkeypatch):
+    """Point the cache at a port nobody listens on, as if Redis had gone away."""
+    monkeypatch.setattr(cache, "redis_client", redis.Redis(port=1, retry=Retry(NoBackoff(), 0)))
+    monkeypatch.setattr(cache, "async_redis_client", aioredis.Redis(port=1, retry=Retry(NoBackoff(), 0)))
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker())
+    monkeypatch.setattr(cache, "_pending_bumps", cache.Counter())
+    cache.local_cache.clear()
+    yield
+    with cache._generations_lock:
+        cache._generations.clear()
+    cache.local_cache.clear()
+
+def listing_total(client, category):
+    response = client.get("/api/products", params={"category": category})
+    assert response.status_code == 200
+    return response.json()["total"]
+
+def test_listing_reflects_a_write(client, make_product):
+    category = f"cache-{uuid.uuid4().hex[:8]}"
+    make_product(category=category)
+    assert listing_total(client, category) == 1
+    make_product(category=category)
+    assert listing_total(client, category) == 2
+
+def test_write_while_redis_is_down_stays_visible(client, make_product, redis_down):
+    category = f"cache-{uuid.uuid4().hex[:8]}"
+    assert listing_total(client, category) == 0
+    make_product(category=category)
+    assert listing_total(client, category) == 1
+
+    # Past the generation TTL the held bump must still apply
+    time.sleep(cache.GENERATION_TTL + 0.2)
+    assert listing_total(client, category) == 1
+    assert cache._pending_bumps
+
+def test_held_bumps_are_replayed_when_redis_returns(client, make_product, redis_down, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    category = f"cache-{uuid.uuid4().hex[:8]}"
+    make_product(category=category)
+    assert listing_total(client, category) == 1
+    make_product(category=category)
+    held = dict(cache._pending_bumps)
+    assert held
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker())
+
+    assert listing_total(client, category) == 2
+    assert not cache._pending_bumps
+    redis_generations = cache.redis_client.mget([cache.GENERATION_PREFIX + tag for tag in held])
+    assert [int(generation) for generation in redis_generations] == list(held.values())
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker())
+    cache.local_cache.clear()
+    yield cache.redis_client
+    cache.local_cache.clear()
+
+def test_fill_is_written_when_nothing_changed(shared_redis):
+    key = f"test-entry:{uuid.uuid4().hex}"
+    versions = cache.cache_versions([key])
+    cache.cache_set_many_if_unchanged({key: b"fresh"}, versions, raw=True)
+    assert shared_redis.get(key) == "fresh"
+
+def test_fill_racing_a_write_is_dropped(shared_redis):
+    key = f"test-entry:{uuid.uuid4().hex}"
+    versions = cache.cache_versions([key])
+    # A write lands between the fill's read and its write-back
+    cache.cache_delete_versioned([key])
+    cache.cache_set_many_if_unchanged({key: b"old"}, versions, raw=True)
+    assert shared_redis.get(key) is None
+    assert cache.local_cache.get(key) == (None, None)
+
+def test_product_body_refilled_after_update(client, make_product, shared_redis):
+    product_id = make_product(price=10.0)
+    assert client.get(f"/api/products/{product_id}").json()["price"] == 10.0
+    assert client.put(f"/api/products/{product_id}", json={"price": 12.0}).status_code == 200
+    assert client.get(f"/api/products/{product_id}").json()["price"] == 12.0
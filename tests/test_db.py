@@ -0,0 +1,41 @@
+import asyncio
+import time
+import pytest
+from app import cache, db
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker())
+    return cache.redis_client
+
+@pytest.fixture
+def replica(tmp_path):
+    sync_replica = db.make_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    async_replica = db.make_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    yield sync_replica, async_replica
+    sync_replica.dispose()
+    asyncio.run(async_replica.dispose())
+
+def test_cache_fills_use_the_replica_without_a_recent_write(shared_redis, replica):
+    sync_replica, async_replica = replica
+    assert db.fill_engine(sync_replica) is sync_replica
+    assert asyncio.run(db.afill_engine(async_replica)) is async_replica
+
+def test_cache_fills_use_the_primary_after_another_workers_write(shared_redis, replica):
+    sync_replica, async_replica = replica
+    # As written by note_write on some other worker
+    shared_redis.set(db.LAST_WRITE_KEY, time.time())
+    assert db.fill_engine(sync_replica) is db.engine
+    assert asyncio.run(db.afill_engine(async_replica)) is db.async_engine
+
+    shared_redis.set(db.LAST_WRITE_KEY, time.time() - db.DB_REPLICA_LAG_SECONDS - 1)
+    assert db.fill_engine(sync_replica) is sync_replica
+
+def test_note_write_is_shared(shared_redis):
+    asyncio.run(db.anote_write())
+    assert time.time() - float(shared_redis.get(db.LAST_WRITE_KEY)) < 1
+    assert shared_redis.ttl(db.LAST_WRITE_KEY) > 0
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import exc
+from sqlmodel import Session
+from app import cache, events
+from app.db import engine
+from app.models.product import Product
+
+OUT_OF_RANGE_ID = 2 ** 70
+
+def counters(product_id):
+    with Session(engine) as session:
+        product = session.get(Product, product_id)
+        return product.views, product.purchase_count
+
+def flush(client):
+    return client.portal.call(events.flush_events)
+
+def test_events_for_unknown_products_are_refused(client, make_product):
+    assert client.post("/api/products/987654321/view").status_code == 404
+    assert client.post(f"/api/products/{OUT_OF_RANGE_ID}/view").status_code == 404
+    product_id = make_product()
+    response = client.post(f"/api/products/{product_id}/purchase", params={"quantity": events.MAX_EVENT_QUANTITY + 1})
+    assert response.status_code == 422
+
+def test_flush_applies_buffered_counts(client, make_product):
+    product_id = make_product()
+    for _ in range(3):
+        assert client.post(f"/api/products/{product_id}/view").status_code == 202
+    assert client.post(f"/api/products/{product_id}/purchase", params={"quantity": 2}).status_code == 202
+    flush(client)
+    assert counters(product_id) == (3, 2)
+
+def test_bad_row_is_dropped_from_the_local_buffer(client, make_product):
+    first, second = make_product(), make_product()
+    with events._local_lock:
+        events._local_counts.update({
+            (first, "views"): 2, (OUT_OF_RANGE_ID, "views"): 1, (second, "purchase_count"): 3,
+        })
+    assert flush(client) == 5
+    assert not events._local_counts
+    assert counters(first) == (2, 0)
+    assert counters(second) == (0, 3)
+    # Nothing left to fail the next flush
+    assert flush(client) == 0
+
+def test_bad_row_is_set_aside_from_the_redis_buffer(client, make_product, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "breaker", cache.CircuitBreaker())
+
+    product_id = make_product()
+    redis.hset(events.PENDING_KEY, mapping={f"views:{product_id}": 4, f"views:{OUT_OF_RANGE_ID}": 1})
+    assert flush(client) == 4
+    assert counters(product_id) == (4, 0)
+    assert not redis.exists(events.PENDING_KEY, events.PROCESSING_KEY)
+    assert redis.hgetall(events.REJECTED_KEY) == {f"views:{OUT_OF_RANGE_ID}": "1"}
+
+def _wrapped(error_class, cause):
+    # How SQLAlchemy's asyncpg adapter surfaces a driver error
+    orig = Exception(str(cause))
+    orig.__cause__ = cause
+    return error_class("UPDATE product ...", {}, orig)
+
+def test_rejected_row_classification():
+    asyncpg = pytest.importorskip("asyncpg")
+    from asyncpg.exceptions._base import DataError as ClientDataError
+
+    assert events._rejected_row(OverflowError("Python int too large to convert to SQLite INTEGER"))
+    assert events._rejected_row(_wrapped(exc.InterfaceError, ClientDataError("value out of int32 range")))
+    assert events._rejected_row(_wrapped(exc.DBAPIError, asyncpg.exceptions.NumericValueOutOfRangeError("integer out of range")))
+    # Transient failures are retried, not set aside
+    assert not events._rejected_row(_wrapped(exc.DBAPIError, asyncpg.exceptions.DeadlockDetectedError("deadlock detected")))
+    assert not events._rejected_row(_wrapped(exc.DBAPIError, asyncpg.exceptions.QueryCanceledError("statement timeout")))
+    assert not events._rejected_row(_wrapped(exc.OperationalError, ConnectionResetError()))
+
+def test_flush_keeps_updated_at_and_counter_free_etags(client, make_product):
+    product_id = make_product()
+    before = client.get(f"/api/products/{product_id}")
+    projected = client.get(f"/api/products/{product_id}", params={"fields": "name,price"})
+
+    client.post(f"/api/products/{product_id}/view")
+    flush(client)
+
+    after = client.get(f"/api/products/{product_id}")
+    assert after.json()["views"] == before.json()["views"] + 1
+    assert after.json()["updated_at"] == before.json()["updated_at"]
+    assert after.headers["etag"] != before.headers["etag"]
+    response = client.get(
+        f"/api/products/{product_id}", params={"fields": "name,price"},
+        headers={"If-None-Match": projected.headers["etag"]},
+    )
+    assert response.status_code == 304
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from app.export import EXPORT_FORMATS
+
+def _rows(format, content):
+    if format == "ndjson":
+        return [json.loads(line) for line in content.splitlines()]
+    if format == "csv":
+        return list(csv.DictReader(io.StringIO(content.decode())))
+    if format == "arrow":
+        return pa.ipc.open_stream(pa.py_buffer(content)).read_all().to_pylist()
+    return pq.read_table(pa.BufferReader(content)).to_pylist()
+
+@pytest.fixture
+def category(make_product):
+    name = f"export-{uuid.uuid4().hex[:8]}"
+    ids = [make_product(category=name, price=float(index + 1)) for index in range(5)]
+    return name, ids
+
+@pytest.mark.parametrize("format", list(EXPORT_FORMATS))
+def test_export_formats(client, category, format, monkeypatch):
+    # Several chunks per export, so chunk boundaries are exercised too
+    monkeypatch.setattr("app.api.products.EXPORT_CHUNK_ROWS", 2)
+    name, ids = category
+    response = client.get("/api/products/export", params={"format": format, "category": name, "fields": "name,price"})
+    assert response.status_code == 200
+    media_type, extension = EXPORT_FORMATS[format]
+    assert response.headers["content-type"] == media_type
+    assert response.headers["content-disposition"] == f'attachment; filename="products.{extension}"'
+
+    rows = _rows(format, response.content)
+    assert sorted(int(row["id"]) for row in rows) == sorted(ids)
+    assert set(rows[0]) == {"id", "name", "price"}
+    assert sorted(float(row["price"]) for row in rows) == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+def test_export_format_from_accept_header(client, category):
+    name, ids = category
+    response = client.get("/api/products/export", params={"category": name},
+                          headers={"Accept": "application/vnd.apache.parquet"})
+    assert response.headers["content-type"] == EXPORT_FORMATS["parquet"][0]
+    assert len(_rows("parquet", response.content)) == len(ids)
+
+    default = client.get("/api/products/export", params={"category": name})
+    assert default.headers["content-type"] == EXPORT_FORMATS["ndjson"][0]
+
+def test_gzipped_export(client, category):
+    name, ids = category
+    response = client.get("/api/products/export", params={"format": "csv", "gzip": "true", "category": name})
+    assert response.headers["content-encoding"] == "gzip"
+    # The test client inflates it, which fails unless the stream is one valid gzip member
+    assert len(_rows("csv", response.content)) == len(ids)
+
+def test_unknown_export_format_is_rejected(client):
+    assert client.get("/api/products/export", params={"format": "xml"}).status_code == 422
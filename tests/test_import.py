@@ -0,0 +1,62 @@
+import csv
+import uuid
+from sqlalchemy import func, select
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["name", "brand", "price", "stock"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def _count(name):
+    from sqlmodel import Session
+    from app.db import engine
+    from app.models.product import Product
+
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(Product).where(Product.name == name)).one()[0]
+
+def test_direct_load_upserts_on_name_and_brand(client, tmp_path, capsys):
+    from app.scripts.import_products import load_products_direct
+
+    name = f"Import {uuid.uuid4().hex[:8]}"
+    path = tmp_path / "products.csv"
+    _write_csv(path, [
+        {"name": name, "brand": "Acme", "price": 10, "stock": 1},
+        {"name": name, "brand": "Acme", "price": 11, "stock": 2},
+        {"name": name, "brand": "", "price": 12, "stock": 3},
+        {"name": "", "brand": "Acme", "price": 13, "stock": 4},
+    ])
+
+    # Repeats within a chunk, across chunks and across loads all land on one row per key
+    load_products_direct(str(path), chunk_size=2)
+    load_products_direct(str(path), chunk_size=4)
+    assert _count(name) == 2
+
+    summary = capsys.readouterr().out.split("Load Summary:")[-1]
+    assert "Total rows read: 4" in summary
+    assert "Upserted: 2" in summary
+    assert "Merged (repeated name and brand): 1" in summary
+    assert "Skipped (invalid data): 1" in summary
+    assert "Failed: 0" in summary
+
+def test_api_rejects_duplicate_name_and_brand(client, make_product):
+    name = f"Dup {uuid.uuid4().hex[:8]}"
+    product_id = make_product(name=name, brand=None)
+
+    assert client.post("/api/products", json={"name": name, "price": 5.0}).status_code == 409
+    assert client.post("/api/products", json={"name": name, "brand": "Other", "price": 5.0}).status_code == 200
+
+    response = client.post("/api/products/bulk", json=[
+        {"name": name, "price": 5.0},
+        {"name": name, "brand": "Third", "price": 5.0},
+        {"name": name, "brand": "Third", "price": 6.0},
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 1
+    assert [error["index"] for error in body["errors"]] == [0, 2]
+
+    other = client.post("/api/products", json={"name": f"{name} b", "price": 5.0}).json()["id"]
+    assert client.put(f"/api/products/{other}", json={"name": name}).status_code == 409
+    assert client.get(f"/api/products/{product_id}").status_code == 200
@@ -0,0 +1,47 @@
+import threading
+import time
+import uuid
+import pytest
+from app import recommend, suggestions
+from app.crud import async_product_crud
+
+def wait_for_indexes():
+    """Block until every queued index change has been applied."""
+    async_product_crud._index_executor.submit(lambda: None).result()
+
+@pytest.fixture
+def indexes(client):
+    deadline = time.monotonic() + 10
+    while suggestions.live_index.index is None or recommend.live_index.index is None:
+        assert time.monotonic() < deadline, "indexes were never built"
+        time.sleep(0.05)
+    return suggestions.live_index.index, recommend.live_index.index
+
+def test_delete_after_bulk_create_stays_deleted(client, indexes):
+    # Hold the index thread so the bulk upsert is still queued when the delete arrives
+    release = threading.Event()
+    async_product_crud._index_executor.submit(release.wait, 10)
+    category = f"index-{uuid.uuid4().hex[:8]}"
+    response = client.post("/api/products/bulk", json=[
+        {"name": f"Bulk {i}", "description": "d", "price": 10.0 + i, "category": category, "brand": "Acme", "stock": 5}
+        for i in range(20)
+    ])
+    assert response.status_code == 200 and response.json()["created"] == 20
+    product_id = client.get("/api/products", params={"category": category, "limit": 1}).json()["items"][0]["id"]
+
+    # Delete returns once the index thread has caught up, so don't wait on it here
+    deleting = threading.Thread(target=client.delete, args=(f"/api/products/{product_id}",))
+    deleting.start()
+    time.sleep(0.3)
+    release.set()
+    deleting.join()
+    wait_for_indexes()
+    for index in indexes:
+        assert product_id not in index._row
+
+def test_reservation_updates_recommend_stock(client, make_product, indexes):
+    product_id = make_product(stock=5)
+    assert client.post("/api/products/reserve", json={"items": [{"product_id": product_id, "quantity": 2}]}).status_code == 200
+    wait_for_indexes()
+    _, recommend_index = indexes
+    assert recommend_index.stock[recommend_index._row[product_id]] == 3
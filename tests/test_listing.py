@@ -0,0 +1,76 @@
+import uuid
+import pytest
+
+@pytest.fixture
+def category(make_product):
+    # A category of its own, with prices repeated so keyset ties break on id
+    name = f"listing-{uuid.uuid4().hex[:8]}"
+    ids = [make_product(category=name, price=float(10 + index % 3)) for index in range(7)]
+    return name, ids
+
+def pages(client, **params):
+    cursor = None
+    while True:
+        query = {**params, "pagination": "cursor", "limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/products", params=query)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["total"] is None
+        yield body["items"]
+        cursor = body["next_cursor"]
+        if not cursor:
+            return
+
+@pytest.mark.parametrize("sort_by,order", [("price", "asc"), ("price", "desc"), ("name", "asc"), ("id", "desc")])
+def test_cursor_pages_cover_every_row_once(client, category, sort_by, order):
+    name, ids = category
+    params = {"category": name, "order": order, "sort_by": sort_by}
+    seen = [item["id"] for page in pages(client, **params) for item in page]
+    assert sorted(seen) == sorted(ids)
+
+    offset = client.get("/api/products", params={**params, "limit": 100}).json()["items"]
+    assert seen == [item["id"] for item in offset]
+
+def test_bad_cursor_is_rejected(client, category):
+    name, _ = category
+    for cursor in ("not-a-cursor", "e30", "!!!"):
+        response = client.get("/api/products", params={"category": name, "pagination": "cursor", "cursor": cursor})
+        assert response.status_code == 400
+
+    first = client.get("/api/products", params={
+        "category": name, "pagination": "cursor", "limit": 3, "sort_by": "price",
+    }).json()["next_cursor"]
+    # A cursor only continues the sort it came from
+    response = client.get("/api/products", params={
+        "category": name, "pagination": "cursor", "sort_by": "name", "cursor": first,
+    })
+    assert response.status_code == 400
+
+def test_product_etag_revalidates(client, make_product):
+    product_id = make_product()
+    response = client.get(f"/api/products/{product_id}")
+    etag = response.headers["ETag"]
+
+    assert client.get(f"/api/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/api/products/{product_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get(f"/api/products/{product_id}", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+    # Each projection is its own representation
+    projected = client.get(f"/api/products/{product_id}", params={"fields": "name,price"})
+    assert projected.headers["ETag"] != etag
+
+    assert client.put(f"/api/products/{product_id}", json={"price": 123.0}).status_code == 200
+    response = client.get(f"/api/products/{product_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_listing_etag_changes_with_the_listing(client, category):
+    name, ids = category
+    response = client.get("/api/products", params={"category": name})
+    etag = response.headers["ETag"]
+    assert client.get("/api/products", params={"category": name}, headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.put(f"/api/products/{ids[0]}", json={"price": 99.0}).status_code == 200
+    response = client.get("/api/products", params={"category": name}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,43 @@
+import os
+import pytest
+from app.scripts.check_query_plans import _postgres_scans, check_query_plans
+
+# An empty PostgreSQL database to run the full check against; skipped when unset
+PLAN_CHECK_DATABASE_URL = os.getenv("PLAN_CHECK_DATABASE_URL")
+
+def _scan(node_type, index_name, **fields):
+    return {"Node Type": node_type, "Relation Name": "product", "Index Name": index_name, **fields}
+
+def test_seq_scan_is_reported():
+    plan = {"Node Type": "Limit", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "product"}]}
+    assert list(_postgres_scans(plan)) == ["Seq Scan on product"]
+
+def test_index_walk_filtering_an_unindexed_predicate_is_reported():
+    # What enable_seqscan = off produces for a filter no index covers
+    plan = {"Node Type": "Limit", "Plans": [
+        _scan("Index Scan", "product_pkey", Filter="((region)::text = 'Mumbai'::text)"),
+    ]}
+    assert list(_postgres_scans(plan)) == [
+        "Index Scan using product_pkey with Filter: ((region)::text = 'Mumbai'::text)"
+    ]
+
+def test_index_walk_feeding_a_sort_is_reported():
+    plan = {"Node Type": "Limit", "Plans": [
+        {"Node Type": "Sort", "Plans": [_scan("Index Only Scan", "product_pkey")]},
+    ]}
+    assert list(_postgres_scans(plan)) == ["Index Only Scan using product_pkey under Sort"]
+
+def test_index_lookup_and_ordered_index_walk_pass():
+    lookup = {"Node Type": "Limit", "Plans": [
+        _scan("Index Scan", "ix_product_category_price", **{"Index Cond": "((category)::text = 'laptops'::text)"}),
+    ]}
+    ordered = {"Node Type": "Limit", "Plans": [_scan("Index Scan", "ix_product_price")]}
+    assert list(_postgres_scans(lookup)) == []
+    assert list(_postgres_scans(ordered)) == []
+
+def test_sqlite_plans_use_indexes(tmp_path):
+    assert check_query_plans(f"sqlite:///{tmp_path / 'plans.db'}", rows=2000)
+
+@pytest.mark.skipif(not PLAN_CHECK_DATABASE_URL, reason="PLAN_CHECK_DATABASE_URL is not set")
+def test_postgres_plans_use_indexes():
+    assert check_query_plans(PLAN_CHECK_DATABASE_URL, rows=5000)
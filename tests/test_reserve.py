@@ -0,0 +1,56 @@
+from sqlmodel import Session
+from app.db import engine
+from app.models.product import Product
+
+def stock_of(*product_ids):
+    with Session(engine) as session:
+        return [session.get(Product, product_id).stock for product_id in product_ids]
+
+def reserve(client, *items):
+    return client.post("/api/products/reserve", json={
+        "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in items]
+    })
+
+def test_reserves_every_line(client, make_product):
+    first, second = make_product(stock=5), make_product(stock=3)
+    response = reserve(client, (first, 2), (second, 3))
+    assert response.status_code == 200
+    assert response.json() == {"reserved": [
+        {"product_id": first, "quantity": 2, "stock": 3},
+        {"product_id": second, "quantity": 3, "stock": 0},
+    ]}
+    assert stock_of(first, second) == [3, 0]
+
+def test_short_line_reserves_nothing(client, make_product):
+    # The plentiful line sorts first, so it is decremented before the short one fails
+    plentiful, short = make_product(stock=10), make_product(stock=1)
+    response = reserve(client, (short, 2), (plentiful, 4))
+    assert response.status_code == 409
+    assert response.json()["detail"] == {
+        "message": "Insufficient stock; nothing was reserved",
+        "unavailable": [{"product_id": short, "requested": 2, "available": 1}],
+    }
+    assert stock_of(plentiful, short) == [10, 1]
+
+def test_unknown_product_is_404(client, make_product):
+    known = make_product(stock=5)
+    response = reserve(client, (known, 1), (987654321, 1))
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Unknown products: 987654321"
+    assert stock_of(known) == [5]
+
+def test_repeated_product_ids_are_merged(client, make_product):
+    product_id = make_product(stock=5)
+    response = reserve(client, (product_id, 2), (product_id, 2))
+    assert response.status_code == 200
+    assert response.json() == {"reserved": [{"product_id": product_id, "quantity": 4, "stock": 1}]}
+    assert stock_of(product_id) == [1]
+
+    # Merged, the lines ask for more than is left even though each alone would fit
+    response = reserve(client, (product_id, 1), (product_id, 1))
+    assert response.status_code == 409
+    assert response.json()["detail"]["unavailable"] == [{"product_id": product_id, "requested": 2, "available": 1}]
+    assert stock_of(product_id) == [1]
+
+def test_empty_request_is_400(client):
+    assert reserve(client).status_code == 400